@@ -0,0 +1,86 @@
+"""Micro-benchmarks of the key value parser (evaluation/key_values.py) against
+the two parsers it replaced, on all key value strings of the data collection
+and the validation sets.
+
+    python benchmarks/bench_key_values.py
+"""
+import ast
+import csv
+import glob
+import os
+import re
+import sys
+import timeit
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "evaluation"))
+from key_values import KEYS, parse_key_values, parse_key_values_column
+
+REPEAT = 5
+
+# Previous parser of execution_based.py: walks the string character by character
+def legacy_execution_parser(kv_string):
+    if not kv_string:
+        return {}
+    result = {}
+    current_key = None
+    current_value = ""
+    in_brackets = False
+    i = 0
+    while i < len(kv_string):
+        char = kv_string[i]
+        if char == ":" and not in_brackets:
+            current_key = kv_string[:i].strip()
+            kv_string = kv_string[i + 1:].lstrip()
+            i = 0
+            continue
+        elif char == "[":
+            in_brackets = True
+            current_value = ""
+        elif char == "]":
+            in_brackets = False
+            try:
+                result[current_key] = ast.literal_eval("[" + current_value + "]")
+            except Exception:
+                result[current_key] = []
+            kv_string = kv_string[i + 1:].lstrip(", ").lstrip()
+            i = 0
+            current_key = None
+            continue
+        elif in_brackets:
+            current_value += char
+        i += 1
+    return result
+
+# Previous parser of kve_evaluation.py: one regex search per key, values split on commas
+def legacy_kve_parser(key_values_str):
+    key_values = {"Activity": [], "EntityType": [], "Actor": []}
+    if not isinstance(key_values_str, str) or not key_values_str.strip():
+        return key_values
+    for key in key_values:
+        match = re.search(key + r':\s*\[(.*?)\]', key_values_str)
+        if match:
+            key_values[key] = [x.strip().strip('"') for x in match.group(1).split(",") if x.strip()]
+    return key_values
+
+def load_strings():
+    strings = []
+    for path in [os.path.join(ROOT, "data", "data_collection.csv")] + sorted(glob.glob(os.path.join(ROOT, "evaluation", "validation_sets", "*.csv"))):
+        with open(path, newline='', encoding='utf-8-sig') as f:
+            strings += [row["Key Values"] for row in csv.DictReader(f)]
+    return strings
+
+def bench(name, function, strings):
+    best = min(timeit.repeat(function, number=1, repeat=REPEAT))
+    print(f"{name:<40} {best * 1000:9.2f} ms  {best / len(strings) * 1e6:7.2f} us/string")
+    return best
+
+if __name__ == "__main__":
+    strings = load_strings()
+    print(f"{len(strings)} key value strings, {len(set(strings))} distinct, best of {REPEAT} runs\n")
+    legacy = bench("legacy execution_based parser", lambda: [legacy_execution_parser(s) for s in strings], strings)
+    bench("legacy kve_evaluation parser", lambda: [legacy_kve_parser(s) for s in strings], strings)
+    parser = bench("parse_key_values", lambda: [parse_key_values(s) for s in strings], strings)
+    bench("parse_key_values (KEYS)", lambda: [parse_key_values(s, KEYS) for s in strings], strings)
+    column = bench("parse_key_values_column", lambda: parse_key_values_column(strings), strings)
+    print(f"\nSpeedup over the legacy execution_based parser: {legacy / parser:.1f}x per string, {legacy / column:.1f}x per column")
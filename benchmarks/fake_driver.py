@@ -0,0 +1,68 @@
+"""Stand-in of the Neo4j driver for running the loading stages of
+ocel_to_ekg/ocel_to_ekg.py without a database.
+
+It accepts the statements the stages send through execute_query, sessions and
+write transactions, and counts them and their parameter rows instead of
+executing them. Timing a stage against it measures the client side of the
+load: building the rows, converting them to parameters and batching them.
+"""
+import threading
+
+COUNTERS = ['nodes_created', 'relationships_created', 'properties_set',
+            'labels_added', 'indexes_added', 'constraints_added']
+
+class FakeCounters:
+    def __init__(self):
+        for c in COUNTERS:
+            setattr(self, c, 0)
+
+class FakeSummary:
+    def __init__(self):
+        self.counters = FakeCounters()
+
+class FakeResult:
+    def __init__(self, summary):
+        self.summary = summary
+
+    def consume(self):
+        return self.summary
+
+class FakeTransaction:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def run(self, query, **params):
+        return FakeResult(self.driver.record(query, params))
+
+class FakeSession(FakeTransaction):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute_write(self, work):
+        return work(FakeTransaction(self.driver))
+
+class FakeDriver:
+    """Counts the statements and the rows of their $rows parameter; queries
+    return no records."""
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.lock = threading.Lock()  # the REL/CORR stages send from worker threads
+
+    def record(self, query, params):
+        with self.lock:
+            self.statements += 1
+            self.rows += len(params.get('rows') or [])
+        return FakeSummary()
+
+    def execute_query(self, query, **params):
+        return [], self.record(query, params), []
+
+    def session(self):
+        return FakeSession(self)
+
+    def verify_connectivity(self):
+        pass
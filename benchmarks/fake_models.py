@@ -0,0 +1,73 @@
+"""Deterministic stand-ins of MistralBaseModel and MistralFtModel (gradio-app/)
+with the same methods, for benchmarking the app pipeline and the evaluation
+scripts without a GPU, model weights or network.
+
+Both answer from the data collection: the fine-tuned model returns the rule's
+Cypher query, the base model its key values. A fixed share of the rules,
+chosen by a hash of the rule text, gets the answer of another rule instead, so
+the scores are neither perfect nor random. Unknown rules get a generic query.
+"""
+import hashlib
+
+ERROR_RATE = 0.2  # Share of the rules answered with another rule's query or key values
+FALLBACK_QUERY = "MATCH (e:Event) RETURN count(e) > 0 AS ruleSatisfied"
+EMPTY_KEY_VALUES = "Activity: [], EntityType: [], Actor: []"
+
+def stable_hash(text, salt=""):
+    """Hash of text that, unlike hash(), is the same in every process."""
+    return int(hashlib.sha256((salt + text).encode()).hexdigest()[:12], 16)
+
+class FakeModel:
+    def __init__(self, answers, error_rate=ERROR_RATE):
+        self.answers = answers  # rule -> correct answer
+        self.rules = sorted(answers)
+        self.error_rate = error_rate
+        self.calls = 0
+
+    def answer(self, rule, default):
+        self.calls += 1
+        rule = rule.strip()
+        if rule not in self.answers:
+            return default
+        if stable_hash(rule) % 1000 < self.error_rate * 1000:
+            return self.answers[self.rules[stable_hash(rule, "other") % len(self.rules)]]
+        return self.answers[rule]
+
+class FakeFtModel(FakeModel):
+    """MistralFtModel without the model: the query of the rule in the data collection."""
+    def __init__(self, rows, error_rate=ERROR_RATE):
+        super().__init__({row["NL input"].strip(): row["Cypher Query"] for row in rows}, error_rate)
+
+    def generate_answer(self, rule, key_values):
+        return self.answer(rule, FALLBACK_QUERY)
+
+    def generate_open_answer(self, query, key_values):
+        return self.answer(query, FALLBACK_QUERY)
+
+class FakeBaseModel(FakeModel):
+    """MistralBaseModel without the model: the key values of the rule in the data
+    collection, and fixed-form explanations and result summaries."""
+    def __init__(self, rows, error_rate=ERROR_RATE):
+        super().__init__({row["NL input"].strip(): row["Key Values"] for row in rows}, error_rate)
+
+    def generate_answer_kve(self, available_key_values, rule):
+        return self.answer(rule, EMPTY_KEY_VALUES)
+
+    def explain_query(self, cypher_query):
+        self.calls += 1
+        return f"The query has {len(cypher_query.split())} tokens and matches {cypher_query.count('MATCH')} patterns."
+
+    def correct_error(self, user_request, error_message):
+        self.calls += 1
+        return f"{FALLBACK_QUERY}\nThe query could not be executed: {error_message}"
+
+    def prettify_result(self, result):
+        self.calls += 1
+        if isinstance(result, dict) and "error" in result:
+            return f"There was an error: {result['error']}"
+        values = [value for record in result for value in record.values()]
+        if True in values:
+            return "The rule is satisfied."
+        if False in values:
+            return "The rule is not satisfied."
+        return f"The query returned {len(result)} records."
@@ -0,0 +1,335 @@
+"""End-to-end benchmarks of ingestion, evaluation and the app pipeline that run
+without a GPU, network or Neo4j server.
+
+    python benchmarks/run_benchmarks.py [--events 20000] [--only ocel_to_ekg scoring]
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/<earlier run>.json
+
+The groups are
+- ocel_to_ekg: reading a synthetic OCEL 2.0 log (synthetic_ekg.py) with
+  ocel_to_ekg.py's read_ocel, with and without its cache, and with the
+  streaming reader, the row builders of the EKG, the loading stages of the
+  script against a driver that counts what it is sent (fake_driver.py), the
+  bulk-import export and loading the in-process EKG,
+- key_values: the key value parser on the data collection and validation sets,
+- scoring: canonical queries, BLEU / token F1 and KVE scores of predictions
+  made by the fake models (fake_models.py) for the data collection,
+- direct_check: the app's rule check (gradio-app/gradio_app.py) with the fake
+  models on the synthetic EKG held in memory.
+
+Every benchmark is run REPEAT times; the best and median wall times, the
+number of items and a check value (row counts, scores) that shows whether the
+same work was done are written to a JSON file in RESULTS_DIR, together with
+the commit, Python and package versions. With --compare, the best times are
+compared with those of an earlier results file. Benchmarks whose optional
+dependencies are not installed are listed as skipped.
+"""
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from importlib import metadata
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(BENCHMARKS_DIR, "..")
+for directory in ("evaluation", "evaluation/CQP", "evaluation/KVE", "ocel_to_ekg", "gradio-app"):
+    sys.path.insert(0, os.path.join(ROOT, directory))
+from synthetic_ekg import load_data_collection, write_ocel, read_ocel
+from fake_models import FakeBaseModel, FakeFtModel
+from fake_driver import FakeDriver
+
+REPEAT = 3  # Runs per benchmark; the best time is compared between runs
+EVENTS = 20000  # Events of the synthetic log
+OBJECTS = 4000  # Objects of the synthetic log
+SEED = 0  # Seed of the synthetic log
+RULES = 100  # Rules of the data collection run through direct_check
+QUERY_TIMEOUT = 10  # Seconds per query of direct_check on the in-process EKG
+RESULTS_DIR = os.path.join(BENCHMARKS_DIR, "results")
+PACKAGES = ["pandas", "numpy", "pm4py", "ijson", "pyarrow", "sacrebleu", "gradio"]
+
+class Suite:
+    def __init__(self, repeat, workdir, args):
+        self.repeat = repeat
+        self.workdir = workdir
+        self.args = args
+        self.results = {}
+        self.skipped = {}
+        self.prepared = {}
+
+    def measure(self, name, function, items, unit, setup=None):
+        """Times function (after setup, untimed) repeat times. Its return value of
+        the last run is kept as the check value."""
+        times = []
+        try:
+            for _ in range(self.repeat):
+                if setup:
+                    setup()
+                with contextlib.redirect_stdout(io.StringIO()):  # the scripts print their progress
+                    start = time.perf_counter()
+                    check = function()
+                    times.append(time.perf_counter() - start)
+        except ImportError as e:
+            self.skip(name, e)
+            return
+        best = min(times)
+        self.results[name] = {
+            "best_s": best,
+            "median_s": statistics.median(times),
+            "runs_s": times,
+            "items": items,
+            "unit": unit,
+            "us_per_item": best / items * 1e6 if items else None,
+            "check": check,
+        }
+        print(f"{name:<45} {best * 1000:10.2f} ms  {best / items * 1e6 if items else 0:9.2f} us/{unit}")
+
+    def skip(self, name, error):
+        self.skipped[name] = str(error)
+        print(f"{name:<45} skipped: {error}")
+
+    def prepare(self, name, function):
+        """Returns the input function builds for several benchmarks, built once."""
+        if name not in self.prepared:
+            self.prepared[name] = function()
+        return self.prepared[name]
+
+    def ocel_file(self):
+        path = os.path.join(self.workdir, f"synthetic_{self.args.events}_{self.args.objects}_{self.args.seed}.jsonocel")
+        return self.prepare("ocel_file", lambda: write_ocel(path, self.args.events, self.args.objects,
+                                                             self.args.seed, self.data_collection()))
+
+    def ocel(self):
+        return self.prepare("ocel", lambda: read_ocel(self.ocel_file()))
+
+    def bulk_import_dir(self):
+        def export():
+            from ekg_bulk_import import export_bulk_import
+            directory = os.path.join(self.workdir, "bulk_import")
+            shutil.rmtree(directory, ignore_errors=True)
+            export_bulk_import(self.ocel(), directory)
+            return directory
+        return self.prepare("bulk_import_dir", export)
+
+    def data_collection(self):
+        return self.prepare("data_collection", load_data_collection)
+
+# Groups
+def bench_ocel_to_ekg(suite):
+    path = suite.ocel_file()
+    events = suite.args.events
+    import ocel_to_ekg as script  # needs pm4py and neo4j
+    script.ingestion_mode = 'batched'
+
+    def read(cache_dir):
+        script.cache_dir = cache_dir
+        return len(script.timed(script.lbl_meta_read, script.read_ocel, path).events)
+    suite.measure("ocel_to_ekg.read_ocel", lambda: read(None), events, "event")
+
+    cache_dir = os.path.join(suite.workdir, "ocel_cache")
+    try:
+        import pyarrow  # without it, read_ocel_cached falls back to parsing the file
+        with contextlib.redirect_stdout(io.StringIO()):
+            read(cache_dir)  # fills the cache; the benchmark measures the cache hits
+        suite.measure("ocel_to_ekg.read_ocel_cached", lambda: read(cache_dir), events, "event")
+    except ImportError as e:
+        suite.skip("ocel_to_ekg.read_ocel_cached", e)
+
+    suite.measure("ocel_to_ekg.read_stream", lambda: len(read_ocel(path).events), events, "event")
+
+    from ekg_model import event_rows, entity_rows, rel_rows, corr_rows, df_rows
+    ocel = suite.ocel()
+    for name, builder in [("event_rows", event_rows), ("entity_rows", entity_rows), ("rel_rows", rel_rows),
+                          ("corr_rows", corr_rows), ("df_rows", df_rows)]:
+        suite.measure(f"ocel_to_ekg.{name}", lambda: len(builder(ocel)), events, "event")
+
+    # the stages of the batched mode in the order of the script, against a driver
+    # that only counts the statements and rows sent to it
+    for name, label, stage, args in [
+            ("create_event_nodes", script.lbl_meta_node_event, script.create_event_nodes, (ocel,)),
+            ("create_entity_nodes", script.lbl_meta_node_entity, script.create_entity_nodes, (ocel,)),
+            ("create_schema", script.lbl_meta_schema, script.create_schema, ()),
+            ("create_snapshot_nodes", script.lbl_meta_node_snapshot, script.create_snapshot_nodes, (ocel,)),
+            ("create_rel_edges", script.lbl_meta_rel_entity_rel_entity, script.create_rel_edges, (ocel,)),
+            ("create_corr_edges", script.lbl_meta_rel_event_corr_entity, script.create_corr_edges, (ocel,)),
+            ("create_df_edges", script.lbl_meta_rel_event_df_event, script.create_df_edges, (ocel,))]:
+        def load():
+            driver = FakeDriver()
+            script.timed(label, stage, driver, *args)
+            return {"statements": driver.statements, "rows": driver.rows}
+        suite.measure(f"ocel_to_ekg.{name}", load, events, "event")
+
+    export_dir = os.path.join(suite.workdir, "export")
+    suite.measure("ocel_to_ekg.export_bulk_import",
+                  lambda: len(script.timed(script.lbl_meta_export, script.export_bulk_import, ocel, export_dir, script.batch_size)),
+                  events, "event", setup=lambda: shutil.rmtree(export_dir, ignore_errors=True))
+
+    from ekg_local import LocalEKG
+    suite.measure("ocel_to_ekg.local_ekg_from_ocel", lambda: LocalEKG.from_ocel(ocel).fingerprint(), events, "event")
+    bulk_import_dir = suite.bulk_import_dir()
+    suite.measure("ocel_to_ekg.local_ekg_from_bulk_import", lambda: LocalEKG.from_bulk_import(bulk_import_dir).fingerprint(),
+                  events, "event")
+
+def bench_key_values(suite):
+    from bench_key_values import load_strings
+    from key_values import parse_key_values, parse_key_values_column
+    strings = load_strings()
+    suite.measure("key_values.parse_key_values", lambda: sum(len(parse_key_values(s)) for s in strings), len(strings), "string")
+    suite.measure("key_values.parse_key_values_column", lambda: len(parse_key_values_column(strings)), len(strings), "string")
+
+def write_rows(path, fieldnames, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    return path
+
+def bench_scoring(suite):
+    rows = suite.data_collection()
+    ft_model, base_model = FakeFtModel(rows), FakeBaseModel(rows)
+    predicted_queries = [ft_model.generate_answer(row["NL input"], row["Key Values"]) for row in rows]
+    ground_truth = write_rows(os.path.join(suite.workdir, "ground_truth.csv"), ["NL input", "Key Values", "Cypher Query"], rows)
+    predictions = write_rows(os.path.join(suite.workdir, "predictions.csv"), ["NL input", "Key Values", "Predicted Query"],
+                             [{**row, "Predicted Query": query} for row, query in zip(rows, predicted_queries)])
+    kve_predictions = write_rows(os.path.join(suite.workdir, "kve_predictions.csv"), ["NL input", "Predicted Key Values"],
+                                 [{**row, "Predicted Key Values": base_model.generate_answer_kve("", row["NL input"])} for row in rows])
+    output = os.path.join(suite.workdir, "scores.csv")
+
+    from cypher_canonical import canonical_query
+    queries = list(dict.fromkeys([row["Cypher Query"] for row in rows] + predicted_queries))
+    suite.measure("scoring.canonical_query", lambda: len(set(map(canonical_query, queries))), len(queries), "query",
+                  setup=canonical_query.cache_clear)
+
+    def bleu():
+        import translation_based
+        translation_based.calculate_bleu_scores(ground_truth, predictions, output, workers=1)
+        with open(output, newline='', encoding='utf-8-sig') as f:
+            scores = [float(row["BLEU Score"]) for row in csv.DictReader(f)]
+        return round(statistics.fmean(scores), 6)
+    suite.measure("scoring.bleu", bleu, len(rows), "pair", setup=canonical_query.cache_clear)
+
+    def kve():
+        from kve_evaluation import evaluate_key_extraction
+        return round(evaluate_key_extraction(ground_truth, kve_predictions, output)["micro"]["f1"], 6)
+    suite.measure("scoring.kve", kve, len(rows), "rule")
+
+def bench_direct_check(suite):
+    try:
+        import gradio_app
+    except ImportError as e:
+        suite.skip("direct_check", e)
+        return
+    from neo4j_connector import LocalEKGConnector
+
+    rows = suite.data_collection()
+    gradio_app.local_connector = LocalEKGConnector(suite.bulk_import_dir(), timeout=QUERY_TIMEOUT)
+    gradio_app.mistral_base_model = FakeBaseModel(rows)
+    gradio_app.mistral_ft_model = FakeFtModel(rows)
+
+    suite.measure("direct_check.fetch_db_identifiers", lambda: len(gradio_app.fetch_db_identifiers()), 1, "call")
+
+    step = max(1, len(rows) // suite.args.rules)
+    rules = [row["NL input"] for row in rows[::step][:suite.args.rules]]
+    def check_rules():
+        outcomes = Counter()
+        for rule in rules:
+            final = list(gradio_app.direct_check(rule))[-1]
+            outcomes[final.rsplit("Final result: ", 1)[-1].split(":")[0]] += 1
+        return dict(sorted(outcomes.items()))
+    suite.measure("direct_check.pipeline", check_rules, len(rules), "rule")
+
+GROUPS = {
+    "ocel_to_ekg": bench_ocel_to_ekg,
+    "key_values": bench_key_values,
+    "scoring": bench_scoring,
+    "direct_check": bench_direct_check,
+}
+
+# Run information and comparison
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+    except OSError:
+        commit, dirty = None, None
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return {"commit": commit or None, "dirty": dirty, "python": platform.python_version(),
+            "platform": platform.platform(), "cpus": os.cpu_count(), "packages": versions}
+
+def compare(results, baseline_file):
+    """Prints the best times of results next to those of an earlier results file."""
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_file} ({baseline['environment'].get('commit')}, {baseline['created']}):")
+    inputs = ("events", "objects", "seed", "rules")
+    if any(baseline["config"].get(key) != results["config"].get(key) for key in inputs):
+        print(f"Warning: different inputs {[baseline['config'].get(key) for key in inputs]} ({', '.join(inputs)}), the times are not comparable")
+    print(f"{'Benchmark':<45}{'Before':>12}{'After':>12}{'Ratio':>8}  Check")
+    for name, result in results["benchmarks"].items():
+        before = baseline["benchmarks"].get(name)
+        if before is None:
+            print(f"{name:<45}{'-':>12}{result['best_s'] * 1000:>10.2f}ms")
+            continue
+        ratio = result["best_s"] / before["best_s"] if before["best_s"] else float('inf')
+        same = "same" if result["check"] == before["check"] else f"changed: {before['check']} -> {result['check']}"
+        print(f"{name:<45}{before['best_s'] * 1000:>10.2f}ms{result['best_s'] * 1000:>10.2f}ms{ratio:>7.2f}x  {same}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--only", nargs="+", choices=list(GROUPS), default=list(GROUPS), help="groups to run")
+    parser.add_argument("--events", type=int, default=EVENTS, help="events of the synthetic log")
+    parser.add_argument("--objects", type=int, default=OBJECTS, help="objects of the synthetic log")
+    parser.add_argument("--seed", type=int, default=SEED, help="seed of the synthetic log")
+    parser.add_argument("--rules", type=int, default=RULES, help="rules run through direct_check")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="runs per benchmark")
+    parser.add_argument("--output", help="results file, default: RESULTS_DIR/benchmarks_<time>.json")
+    parser.add_argument("--compare", help="earlier results file to compare with")
+    parser.add_argument("--workdir", help="directory of the generated files, kept after the run (default: a temporary one)")
+    args = parser.parse_args(argv)
+
+    created = time.strftime('%Y-%m-%d %H:%M:%S')
+    with contextlib.ExitStack() as stack:
+        workdir = args.workdir or stack.enter_context(tempfile.TemporaryDirectory(prefix="benchmarks_"))
+        os.makedirs(workdir, exist_ok=True)
+        suite = Suite(args.repeat, workdir, args)
+        print(f"best of {args.repeat} runs, synthetic log of {args.events} events and {args.objects} objects\n")
+        for group in args.only:
+            try:
+                GROUPS[group](suite)
+            except ImportError as e:  # a dependency of the group's inputs, e.g. pm4py
+                suite.skip(group, e)
+
+    results = {
+        "created": created,
+        "environment": environment(),
+        "config": {"events": args.events, "objects": args.objects, "seed": args.seed, "rules": args.rules,
+                   "repeat": args.repeat, "groups": args.only},
+        "benchmarks": suite.results,
+        "skipped": suite.skipped,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, "benchmarks_" + time.strftime('%Y%m%d-%H%M%S') + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1)
+    print(f"\nResults saved to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return results
+
+if __name__ == "__main__":
+    main()
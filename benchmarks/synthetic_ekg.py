@@ -0,0 +1,98 @@
+"""Deterministic synthetic OCEL 2.0 logs for the benchmarks.
+
+The activities, entity types and actors are the ones named in the key values
+of the data collection, so its rule queries find events and entities to match
+on the EKG built from the log. The same size and seed always give the same
+file.
+"""
+import csv
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "evaluation"))
+sys.path.insert(0, os.path.join(ROOT, "ocel_to_ekg"))
+from key_values import KEYS, parse_key_values_column
+
+DATA_COLLECTION = os.path.join(ROOT, "data", "data_collection.csv")
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+STATUSES = ["open", "in progress", "closed"]
+
+def load_data_collection():
+    """Returns the rows (NL input, Key Values, Cypher Query) of the data collection."""
+    with open(DATA_COLLECTION, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+def vocabulary(rows):
+    """Returns the sorted activities, entity types and actors named in the key values of rows."""
+    values = {key: set() for key in KEYS}
+    for key_values in parse_key_values_column((row["Key Values"] for row in rows), KEYS):
+        for key in KEYS:
+            values[key].update(key_values[key])
+    return {key: sorted(values[key]) for key in KEYS}
+
+def write_ocel(path, events, objects, seed=0, rows=None):
+    """Writes an OCEL 2.0 JSON log with the given numbers of events and objects.
+    Each object has a status and an amount attribute and up to two O2O
+    relations; each event has an actor and is related to one to three objects.
+    Events are spread over a year in timestamp order."""
+    rng = random.Random(seed)
+    words = vocabulary(rows if rows is not None else load_data_collection())
+    activities = words["Activity"] or ["Activity"]
+    entity_types = words["EntityType"] or ["Entity"]
+    actors = words["Actor"] or ["Actor"]
+
+    object_list = []
+    for i in range(objects):
+        object_list.append({
+            "id": f"o{i}",
+            "type": rng.choice(entity_types),
+            "attributes": [
+                {"name": "status", "time": "1970-01-01T00:00:00Z", "value": rng.choice(STATUSES)},
+                {"name": "amount", "time": "1970-01-01T00:00:00Z", "value": round(rng.uniform(1, 1000), 2)},
+            ],
+            "relationships": [{"objectId": f"o{rng.randrange(objects)}", "qualifier": "related"}
+                              for _ in range(rng.randint(0, 2))],
+        })
+
+    minutes = sorted(rng.randrange(365 * 24 * 60) for _ in range(events))
+    event_list = []
+    for i, minute in enumerate(minutes):
+        event_list.append({
+            "id": f"e{i}",
+            "type": rng.choice(activities),
+            "time": (START + timedelta(minutes=minute)).isoformat().replace("+00:00", "Z"),
+            "attributes": [{"name": "Actor", "value": rng.choice(actors)}],
+            "relationships": [{"objectId": f"o{o}", "qualifier": ""}
+                              for o in rng.sample(range(objects), min(objects, rng.randint(1, 3)))],
+        })
+
+    log = {
+        "objectTypes": [{"name": t, "attributes": [{"name": "status", "type": "string"}, {"name": "amount", "type": "float"}]}
+                        for t in entity_types],
+        "eventTypes": [{"name": a, "attributes": [{"name": "Actor", "type": "string"}]} for a in activities],
+        "objects": object_list,
+        "events": event_list,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(log, f)
+    return path
+
+def read_ocel(path, chunk_size=50000):
+    """Reads a log with the streaming reader of ocel_to_ekg.py into one pm4py OCEL."""
+    from pm4py.objects.ocel.obj import OCEL
+    from ocel_stream import read_object_types, read_objects, read_events
+    object_types = read_object_types(path)
+    object_chunks = list(read_objects(path, chunk_size))
+    event_chunks = list(read_events(path, chunk_size, object_types))
+    return OCEL(
+        events=pd.concat([chunk.events for chunk in event_chunks], ignore_index=True),
+        objects=pd.concat([chunk.objects for chunk in object_chunks], ignore_index=True),
+        relations=pd.concat([chunk.relations for chunk in event_chunks], ignore_index=True),
+        o2o=pd.concat([chunk.o2o for chunk in object_chunks], ignore_index=True),
+    )
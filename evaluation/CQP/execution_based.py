@@ -1,76 +1,314 @@
 import csv
 import threading
-import ast
-from neo4j import GraphDatabase
+import time
+import json
+import os
+import hashlib
+import statistics
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor, Future
+from neo4j import GraphDatabase, Query
+from neo4j.exceptions import Neo4jError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "ocel_to_ekg"))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from ekg_local import load_ekg, QueryTimeout
+from key_values import parse_key_values_column, contains_all_key_values
+from cypher_canonical import canonical_query
 
 # Neo4j connection details (replace with your credentials)
 NEO4J_URI = "bolt://localhost:7687"
 NEO4J_USER = "neo4j"
 NEO4J_PASSWORD = "12341234"
 TIMEOUT = 120  # Timeout in seconds
+WORKERS = 1  # Rows evaluated concurrently; 1 evaluates them one after another. Raise it up to the
+            # number of queries the server can run at once (its worker threads / the driver pool)
+GT_CACHE_DIR = "gt_cache"  # Directory of the ground truth result cache, None disables it
+GRAPH_VERSION = ""  # Optional version stamp of the loaded EKG, part of the cache key
+PREFLIGHT = False  # EXPLAIN each predicted query before executing it
+MAX_ESTIMATED_ROWS = 10_000_000  # Plans estimating more rows than this are flagged as explosive
+EXPLOSIVE_ACTION = "skip"  # "skip" explosive queries, or "tighten" to run them with EXPLOSIVE_TIMEOUT
+EXPLOSIVE_TIMEOUT = 10  # Timeout in seconds for explosive queries
+PROFILE = False  # PROFILE ground truth and predicted queries and record their cost
+RESULT_LIMIT = 2  # Records fetched per query; two already classify a result as "Other"
+RESUME = True  # Continue a partial results file from an interrupted run instead of overwriting it
+LOCAL_EKG = None  # EKG bulk-import directory or OCEL 2.0 file to evaluate on in-process instead of Neo4j
+MEMOIZE = True  # Execute queries with the same canonical form (cypher_canonical.py) only once per run
+
+UNAVAILABLE = "Error: Database unavailable"  # prefix of errors that say nothing about the query itself
+# Neo4j error classifications (Neo.ClientError.<classification>.<title>) caused by the query itself;
+# the others (Security, Transaction, Cluster, Database, ...) depend on the server and its state
+QUERY_ERROR_CLASSIFICATIONS = ("Statement", "Procedure", "Schema")
+
+def query_error(e):
+    """Whether a Neo4j error is caused by the query, e.g. a syntax or type error,
+    so that running the same query again gives the same error."""
+    parts = (e.code or "").split(".")
+    return len(parts) > 2 and parts[1] == "ClientError" and parts[2] in QUERY_ERROR_CLASSIFICATIONS
+
+def cacheable(result):
+    """Whether a ground truth result can be cached: records or an error of the
+    query itself, not a timeout or a connection, authentication or server failure."""
+    return not (isinstance(result, str) and (result.startswith(UNAVAILABLE) or "timeout" in result))
 
 class Neo4jExecutor:
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+    def __init__(self, uri, user, password, pool_size=WORKERS, database=None):
+        # one driver for all workers; its connection pool is shared by their sessions
+        self.driver = GraphDatabase.driver(uri, auth=(user, password), max_connection_pool_size=pool_size)
+        self.database = database  # None uses the server's default database
     
     def close(self):
         self.driver.close()
     
-    def execute_query(self, query):
-        """Executes a Cypher query with a timeout."""
+    def execute_query(self, query, timeout=TIMEOUT):
+        """Executes a Cypher query with a server-side transaction timeout. When
+        the timeout is exceeded, the database terminates the transaction, so a
+        timed-out query stops consuming server resources.
+        Returns the first RESULT_LIMIT records as dicts, or an error message.
+        Further records are never pulled from the server."""
         print(f"Try to execute query {query}")
-        result_container = []
+        try:
+            with self.driver.session(database=self.database, fetch_size=RESULT_LIMIT) as session:
+                result = session.run(Query(query, timeout=timeout))
+                records = []
+                for record in result:
+                    records.append(record.data())
+                    if len(records) == RESULT_LIMIT:
+                        break
+                return records
+        except Neo4jError as e:
+            if e.code and "TimedOut" in e.code:
+                return "Error: Query timeout"
+            if not query_error(e):
+                return f"{UNAVAILABLE}: {str(e)}"
+            return f"Error: {str(e)}"
+        except Exception as e:  # ServiceUnavailable, SessionExpired, ...
+            return f"{UNAVAILABLE}: {str(e)}"
 
-        def run_query():
-            try:
-                with self.driver.session() as session:
-                    result = session.run(query)
-                    result_container.append(str([record.data() for record in result]))
-            except Exception as e:
-                result_container.append(f"Error: {str(e)}")
-        
-        thread = threading.Thread(target=run_query)
-        thread.start()
-        thread.join(timeout=TIMEOUT)
-        
-        if not result_container:
+    def profile_query(self, query, timeout=TIMEOUT):
+        """Executes a query with PROFILE. Returns the result like execute_query
+        and the cost of the executed plan (total db hits and rows over all
+        operators, elapsed time in ms and the operator types), or None on error.
+        The query runs to completion for a complete profile, but only the first
+        RESULT_LIMIT records are kept."""
+        print(f"Try to profile query {query}")
+        try:
+            with self.driver.session(database=self.database) as session:
+                result = session.run(Query("PROFILE " + query, timeout=timeout))
+                records = []
+                for record in result:
+                    if len(records) < RESULT_LIMIT:
+                        records.append(record.data())
+                summary = result.consume()
+        except Neo4jError as e:
+            if e.code and "TimedOut" in e.code:
+                return "Error: Query timeout", None
+            if not query_error(e):
+                return f"{UNAVAILABLE}: {str(e)}", None
+            return f"Error: {str(e)}", None
+        except Exception as e:
+            return f"{UNAVAILABLE}: {str(e)}", None
+
+        cost = {"db_hits": 0, "rows": 0, "operators": []}
+        operators = [summary.profile] if summary.profile else []
+        while operators:
+            operator = operators.pop()
+            cost["db_hits"] += operator.get("dbHits", 0)
+            cost["rows"] += operator.get("rows", 0)
+            cost["operators"].append(operator.get("operatorType", "").split("@")[0])
+            operators.extend(operator.get("children", []))
+        cost["time_ms"] = (summary.result_available_after or 0) + (summary.result_consumed_after or 0)
+        return records, cost
+
+    def explain(self, query):
+        """Plans a query with EXPLAIN without executing it. Returns an error
+        message (e.g. for syntax errors) or None, and the largest row estimate
+        of any operator in the plan. Errors that are not caused by the query,
+        e.g. an unreachable database, are raised, so that predictions are not
+        marked invalid because of them."""
+        try:
+            with self.driver.session(database=self.database) as session:
+                plan = session.run("EXPLAIN " + query).consume().plan
+        except Neo4jError as e:
+            if not query_error(e):
+                raise
+            return f"Error: {str(e)}", 0
+
+        estimated_rows = 0
+        operators = [plan] if plan else []
+        while operators:
+            operator = operators.pop()
+            estimated_rows = max(estimated_rows, operator.get("args", {}).get("EstimatedRows", 0))
+            operators.extend(operator.get("children", []))
+        return None, estimated_rows
+
+    def fingerprint(self):
+        """Returns the node count per label and relationship count per type of the graph."""
+        counts = {}
+        with self.driver.session(database=self.database) as session:
+            labels = [r["label"] for r in session.run("CALL db.labels()")]
+            types = [r["relationshipType"] for r in session.run("CALL db.relationshipTypes()")]
+            for label in labels:
+                counts[f"node:{label}"] = session.run(f"MATCH (n:`{label}`) RETURN count(n) AS c").single()["c"]
+            for rel_type in types:
+                counts[f"rel:{rel_type}"] = session.run(f"MATCH ()-[r:`{rel_type}`]->() RETURN count(r) AS c").single()["c"]
+        return counts
+
+class LocalEKGExecutor:
+    """Drop-in replacement of Neo4jExecutor that evaluates the queries in-process
+    on an EKG loaded into memory (ocel_to_ekg/ekg_local.py), so no Neo4j server
+    is needed. Results, errors and timeouts have the same shape as with Neo4j."""
+    def __init__(self, path):
+        print(f"Loading EKG from {path}")
+        self.graph = load_ekg(path)
+
+    def close(self):
+        pass
+
+    def execute_query(self, query, timeout=TIMEOUT):
+        print(f"Try to execute query {query}")
+        try:
+            records = []
+            for record in self.graph.run(query, timeout=timeout):
+                records.append(record)
+                if len(records) == RESULT_LIMIT:
+                    break
+            return records
+        except QueryTimeout:
             return "Error: Query timeout"
-        return result_container[0]
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    def profile_query(self, query, timeout=TIMEOUT):
+        """Runs a query to completion like Neo4jExecutor.profile_query; the db hits
+        are the nodes and relationships visited by the in-process engine."""
+        print(f"Try to profile query {query}")
+        start = time.time()
+        try:
+            execution = self.graph.run(query, timeout=timeout)
+            records = []
+            for record in execution:
+                if len(records) < RESULT_LIMIT:
+                    records.append(record)
+        except QueryTimeout:
+            return "Error: Query timeout", None
+        except Exception as e:
+            return f"Error: {str(e)}", None
+        cost = {"db_hits": execution.db_hits, "rows": execution.rows, "operators": execution.operators,
+                "time_ms": (time.time() - start) * 1000}
+        return records, cost
+
+    def explain(self, query):
+        """Only parses the query: syntax errors are reported, but there are no row estimates."""
+        try:
+            self.graph.run(query)
+        except Exception as e:
+            return f"Error: {str(e)}", 0
+        return None, 0
+
+    def fingerprint(self):
+        return self.graph.fingerprint()
+
+# Ground truth results never change for a given graph, so they are cached on disk
+class GroundTruthCache:
+    """Processed GT results keyed by the canonical query text. Each graph
+    fingerprint (counts per label/type plus GRAPH_VERSION) has its own cache
+    file, so a changed graph starts with an empty cache."""
+
+    def __init__(self, cache_dir, fingerprint):
+        key = hashlib.sha256(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, f"gt_results_{key}.json")
+        self.fingerprint = fingerprint
+        self.lock = threading.Lock()
+        self.results = {}
+        self.hits = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as f:
+                self.results = json.load(f)["results"]
+        print(f"Loaded {len(self.results)} cached ground truth results from {self.path}")
+
+    @staticmethod
+    def normalize(query):
+        return canonical_query(query)
+
+    def get(self, query):
+        with self.lock:
+            result = self.results.get(self.normalize(query))
+            if result is not None:
+                self.hits += 1
+            return result
+
+    def put(self, query, result):
+        """Stores a processed result; only pass results that are cacheable()."""
+        if result == "timeout":  # might succeed on a less loaded database
+            return
+        with self.lock:
+            self.results[self.normalize(query)] = result
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with self.lock:
+            with open(self.path, 'w', encoding='utf-8') as f:
+                json.dump({"fingerprint": self.fingerprint, "results": self.results}, f, indent=1)
+
+class ExecutionMemo:
+    """Executions of the current run keyed by mode, timeout and canonical query
+    text, so that a query is executed only once however it is written. A query
+    requested again while it is still running waits for that execution."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executions = {}
+
+    def run(self, mode, query, timeout, execute):
+        """Returns the result of execute() for query, and whether it was memoized."""
+        key = (mode, timeout, canonical_query(query))
+        with self.lock:
+            future = self.executions.get(key)
+            memoized = future is not None
+            if not memoized:
+                future = self.executions[key] = Future()
+        if memoized:
+            return future.result(), True
+        try:
+            future.set_result(execute())
+        except Exception as e:
+            future.set_exception(e)
+        return future.result(), False
 
 # Postprocess query result
-import ast
+def result_values(value):
+    """Yields the scalar values of a record, descending into lists and maps."""
+    if isinstance(value, dict):
+        for v in value.values():
+            yield from result_values(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from result_values(v)
+    else:
+        yield value
 
 def process_result(result):
-    """Processes the query execution result."""
-    
-    try:
-        # Only evaluate if it looks like a list
-        if isinstance(result, str) and result.strip().startswith('[') and result.strip().endswith(']'):
-            evaluated_result = ast.literal_eval(result)
-            if isinstance(evaluated_result, list):
-                if len(evaluated_result) > 1:  # List of multiple boolean values
-                    return "Other"
-        
-        # Other string-based checks
-        if "True" in result:
-            return "True"
-        elif "False" in result:
-            return "False"
-        elif "None" in result:
-            return "none"
-        elif "timeout" in result:
+    """Processes the query execution result: the records returned by
+    execute_query, or an error message."""
+    if isinstance(result, str):
+        if "timeout" in result:
             return "timeout"
-        else:
-            return "Error"
+        return "Error"
 
-    except (ValueError, SyntaxError):
-        # If literal_eval fails, check for known string cases
-        if "None" in result:
-            return "none"
-        elif "timeout" in result:
-            return "timeout"
-        else:
-            return "Error"
+    if len(result) > 1:  # List of multiple boolean values
+        return "Other"
+
+    values = list(result_values(result))
+    if any(v is True for v in values):
+        return "True"
+    elif any(v is False for v in values):
+        return "False"
+    elif any(v is None for v in values):
+        return "none"
+    else:
+        return "Error"
 
 
 # Load CSV data
@@ -94,124 +332,362 @@ def load_csv(file_path, query_column):
             except KeyError as e:
                 print(f"Error: Missing column {str(e)} in file {file_path}. Available columns: {headers}")
                 raise
+    for entry, key_values_dict in zip(data, parse_key_values_column(entry["key_values"] for entry in data)):
+        entry["key_values_dict"] = key_values_dict
     return data
 
-def parse_key_values(kv_string):
-    """Parses the key value string into a dictionary."""
-    if not kv_string:
+# Execute and compare one ground truth / prediction pair
+def evaluate_pair(executor, gt, pred, gt_cache=None, memo=None):
+    gt_cost = pred_cost = None
+    memoized = 0
+
+    def run(mode, query, timeout, execute):
+        nonlocal memoized
+        if memo is None:
+            return execute()
+        result, hit = memo.run(mode, query, timeout, execute)
+        if mode != "explain":  # only executions count towards the throughput
+            memoized += hit
+        return result
+
+    # profiling needs the cost of the GT query, so it is executed despite a cached result
+    processed_gt_result = gt_cache.get(gt["query"]) if gt_cache and not PROFILE else None
+    gt_cached = processed_gt_result is not None
+    if not gt_cached:
+        if PROFILE:
+            gt_result, gt_cost = run("profile", gt["query"], TIMEOUT, lambda: executor.profile_query(gt["query"]))
+        else:
+            gt_result = run("execute", gt["query"], TIMEOUT, lambda: executor.execute_query(gt["query"]))
+        processed_gt_result = process_result(gt_result)
+        if gt_cache and cacheable(gt_result):
+            gt_cache.put(gt["query"], processed_gt_result)
+
+    preflight = ""
+    timeout = TIMEOUT
+    if PREFLIGHT:
+        error, estimated_rows = run("explain", pred["query"], None, lambda: executor.explain(pred["query"]))
+        if error:
+            preflight = "error"
+        elif estimated_rows > MAX_ESTIMATED_ROWS:
+            preflight = "explosive"
+            timeout = EXPLOSIVE_TIMEOUT
+
+    if preflight == "error":
+        pred_result = error  # never executed
+    elif preflight == "explosive" and EXPLOSIVE_ACTION == "skip":
+        pred_result = None
+    elif PROFILE:
+        pred_result, pred_cost = run("profile", pred["query"], timeout,
+                                     lambda: executor.profile_query(pred["query"], timeout=timeout))
+    else:
+        pred_result = run("execute", pred["query"], timeout, lambda: executor.execute_query(pred["query"], timeout=timeout))
+
+    processed_pred_result = process_result(pred_result) if pred_result is not None else "skipped"
+    if(processed_gt_result not in ("timeout", "skipped") and processed_pred_result not in ("timeout", "skipped")):
+        exact_match = processed_gt_result == processed_pred_result
+    else:
+        exact_match = False
+
+    key_values_match = contains_all_key_values(pred["query"], gt["key_values_dict"])
+
+    row = {
+        "NL input": gt["NL input"],
+        "Ground Truth Query": gt["query"],
+        "GT Result": processed_gt_result,
+        "Predicted Query": pred["query"],
+        "Predicted Result": processed_pred_result,
+        "Exact Match": exact_match,
+        "Key Values Match": key_values_match,
+        "Preflight": preflight,
+        "GT Cached": gt_cached,  # not written to the results file
+        "Memoized": memoized  # executions taken from the memo, not written either
+    }
+    if PROFILE:
+        row.update(cost_columns("GT", gt_cost))
+        row.update(cost_columns("Predicted", pred_cost))
+        if gt_cost and pred_cost and gt_cost["db_hits"] > 0:
+            row["DB Hits Ratio"] = round(pred_cost["db_hits"] / gt_cost["db_hits"], 4)
+    return row
+
+def cost_columns(prefix, cost):
+    if cost is None:
         return {}
-    
-    result = {}
-    current_key = None
-    current_value = ""
-    in_brackets = False
-
-    i = 0
-    while i < len(kv_string):
-        char = kv_string[i]
-
-        if char == ":" and not in_brackets:
-            current_key = kv_string[:i].strip()
-            kv_string = kv_string[i + 1:].lstrip()
-            i = 0
-            continue
-        elif char == "[":
-            in_brackets = True
-            current_value = ""
-        elif char == "]":
-            in_brackets = False
-            try:
-                result[current_key] = ast.literal_eval("[" + current_value + "]")
-            except Exception as e:
-                print(f"Error parsing list for key '{current_key}': {e}")
-                result[current_key] = []
-            kv_string = kv_string[i + 1:].lstrip(", ").lstrip()
-            i = 0
-            current_key = None
-            continue
-        elif in_brackets:
-            current_value += char
-
-        i += 1
-
-    return result
-
-# Check if predicted query contains all key values
-def contains_all_key_values(pred_query, key_values_dict):
-    """Checks if all values from key_values_dict appear in the predicted query."""
-    for key, values in key_values_dict.items():
-        for value in values:
-            if value not in pred_query:
-                return False
-    return True
+    return {
+        f"{prefix} DB Hits": cost["db_hits"],
+        f"{prefix} Rows": cost["rows"],
+        f"{prefix} Time (ms)": cost["time_ms"],
+        f"{prefix} Operators": ";".join(cost["operators"]),
+    }
+
+def summarize_costs(ratios):
+    """Prints the distribution of predicted/GT db hit ratios."""
+    if not ratios:
+        print("Cost ratio (predicted / GT db hits): no rows with both queries profiled")
+        return
+    geometric_mean = math.exp(statistics.fmean(math.log(max(r, 1e-9)) for r in ratios))
+    print(f"Cost ratio (predicted / GT db hits) over {len(ratios)} profiled pairs: "
+          f"median {statistics.median(ratios):.2f}, geometric mean {geometric_mean:.2f}, "
+          f"max {max(ratios):.2f}, >10x more expensive: {sum(r > 10 for r in ratios)}")
+
+def open_executor(local_ekg=None, database=None, pool_size=WORKERS):
+    """Returns the executor and GT cache for a graph: the in-process EKG at
+    local_ekg, or the given database of the Neo4j server at NEO4J_URI."""
+    if local_ekg:
+        executor = LocalEKGExecutor(local_ekg)
+    else:
+        executor = Neo4jExecutor(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD, pool_size=pool_size, database=database)
+    gt_cache = None
+    if GT_CACHE_DIR is not None:
+        fingerprint = {"uri": local_ekg or NEO4J_URI, "version": GRAPH_VERSION, **executor.fingerprint()}
+        if database:
+            fingerprint["database"] = database
+        gt_cache = GroundTruthCache(GT_CACHE_DIR, fingerprint)
+    return executor, gt_cache
+
+# Resume an interrupted run from its partial results file
+def load_partial_results(output_file, fieldnames, gt_data, pred_data):
+    """Returns the rows of an interrupted run's results file that can be kept,
+    with their values converted back as evaluate_pair returns them. A row cut
+    off by the interruption is dropped, so it is evaluated again."""
+    if not RESUME or not os.path.exists(output_file):
+        return []
+    with open(output_file, newline='', encoding='utf-8-sig') as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=',')
+        if reader.fieldnames != fieldnames:
+            raise ValueError(f"Columns of {output_file} do not match the current configuration "
+                             f"(PREFLIGHT, PROFILE). Remove it to start over.")
+        rows = []
+        for row in reader:
+            if None in row.values() or None in row:  # truncated or malformed last line
+                break
+            rows.append(row)
+
+    for row, gt, pred in zip(rows, gt_data, pred_data):
+        if row["Ground Truth Query"] != gt["query"] or row["Predicted Query"] != pred["query"]:
+            raise ValueError(f"{output_file} belongs to different ground truth or predictions files. Remove it to start over.")
+    if len(rows) > len(gt_data):
+        raise ValueError(f"{output_file} has more rows than the ground truth file. Remove it to start over.")
+
+    for row in rows:
+        row["Exact Match"] = row["Exact Match"] == "True"
+        row["Key Values Match"] = row["Key Values Match"] == "True"
+        row.setdefault("Preflight", "")
+        if row.get("DB Hits Ratio"):
+            row["DB Hits Ratio"] = float(row["DB Hits Ratio"])
+        else:
+            row.pop("DB Hits Ratio", None)
+        row["GT Cached"] = False
+        row["Memoized"] = 0
+    print(f"Resuming {output_file} after {len(rows)} completed rows")
+    return rows
 
 # Compare results,  write output and calculate metrics
-def compare_and_save_results(gt_file, pred_file, output_file):
+def evaluate_set(executor, gt_file, pred_file, output_file, workers=WORKERS, gt_cache=None, memo=None):
+    """Evaluates one validation set against the graph of executor, writes the
+    rows to output_file and returns the counts of the summary. With RESUME,
+    the completed rows of a partial output_file are kept and only the
+    remaining rows are evaluated; the counts cover all rows of the file.
+    Sets on the same graph can share a memo; with MEMOIZE, each set gets its
+    own otherwise."""
     gt_data = load_csv(gt_file, "Cypher Query")
     pred_data = load_csv(pred_file, "Predicted Query")
     
     if len(gt_data) != len(pred_data):
-        raise ValueError("Mismatch in row count between ground truth and predicted files.")
-    
-    executor = Neo4jExecutor(NEO4J_URI, NEO4J_USER, NEO4J_PASSWORD)
+        raise ValueError(f"Mismatch in row count between ground truth and predicted files ({gt_file}, {pred_file}).")
 
-    exact_match_count = 0
-    syntax_error_count = 0
-    all_key_values_used_count = 0
-    total_count = len(gt_data)
+    fieldnames = [
+        "NL input", "Ground Truth Query", "GT Result",
+        "Predicted Query", "Predicted Result", "Exact Match",
+        "Key Values Match"
+    ]
+    if PREFLIGHT:
+        fieldnames.append("Preflight")
+    if PROFILE:
+        for prefix in ("GT", "Predicted"):
+            fieldnames += [f"{prefix} DB Hits", f"{prefix} Rows", f"{prefix} Time (ms)", f"{prefix} Operators"]
+        fieldnames.append("DB Hits Ratio")
+    completed = load_partial_results(output_file, fieldnames, gt_data, pred_data)
+    if memo is None and MEMOIZE:
+        memo = ExecutionMemo()
 
+    metrics = {
+        "total": len(gt_data),
+        "resumed": len(completed),
+        "exact_matches": 0,
+        "syntax_errors": 0,
+        "gt_timeouts": 0,
+        "pred_timeouts": 0,
+        "explosive": 0,
+        "key_values_used": 0,
+        "gt_cache_hits": 0,
+        "memo_hits": 0,
+        "preflight_skipped": 0,
+        "cost_ratios": [],
+        "workers": workers,
+        "output_file": output_file,
+    }
+
+    def count(row):
+        if row["Key Values Match"]:
+            metrics["key_values_used"] += 1
+        if row["Exact Match"]:
+            metrics["exact_matches"] += 1
+        if row["Predicted Result"] == "Error":
+            metrics["syntax_errors"] += 1
+        if row["GT Result"] == "timeout":
+            metrics["gt_timeouts"] += 1
+        if row["Predicted Result"] == "timeout":
+            metrics["pred_timeouts"] += 1
+        if row["Preflight"] == "explosive":
+            metrics["explosive"] += 1
+        if row["GT Cached"]:
+            metrics["gt_cache_hits"] += 1
+        metrics["memo_hits"] += row["Memoized"]
+        if "DB Hits Ratio" in row:
+            metrics["cost_ratios"].append(row["DB Hits Ratio"])
+
+    start = time.time()
+
+    # the completed rows are written again, which also drops a line cut off by the interruption
     with open(output_file, mode='w', newline='', encoding='utf-8-sig') as csvfile:
-        fieldnames = [
-            "NL input", "Ground Truth Query", "GT Result",
-            "Predicted Query", "Predicted Result", "Exact Match",
-            "Key Values Match"
-        ]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=',')
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames, delimiter=',', extrasaction='ignore')
         writer.writeheader()
+        for row in completed:
+            count(row)
+            writer.writerow(row)
         
-        for gt, pred in zip(gt_data, pred_data):
-            gt_result = executor.execute_query(gt["query"])
-            pred_result = executor.execute_query(pred["query"])
-            
-            processed_gt_result = process_result(gt_result)
-            processed_pred_result = process_result(pred_result)
-            if(processed_gt_result != "timeout" and processed_pred_result != "timeout"):
-                exact_match = processed_gt_result == processed_pred_result
-            else:
-                exact_match = False
-
-            key_values_dict = parse_key_values(gt["key_values"])
-            key_values_match = contains_all_key_values(pred["query"], key_values_dict)
-            if key_values_match:
-                all_key_values_used_count += 1
-
-            if exact_match:
-                exact_match_count += 1
-            if processed_pred_result == "Error":
-                syntax_error_count += 1
-
-            writer.writerow({
-                "NL input": gt["NL input"],
-                "Ground Truth Query": gt["query"],
-                "GT Result": processed_gt_result,
-                "Predicted Query": pred["query"],
-                "Predicted Result": processed_pred_result,
-                "Exact Match": exact_match,
-                "Key Values Match": key_values_match
-            })
-    
-    executor.close()
+        # map yields the rows in input order, so the output order does not depend on the workers
+        remaining = zip(gt_data[len(completed):], pred_data[len(completed):])
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for row in pool.map(lambda pair: evaluate_pair(executor, *pair, gt_cache, memo), remaining):
+                count(row)
+                if row["Preflight"] == "error" or row["Predicted Result"] == "skipped":
+                    metrics["preflight_skipped"] += 1  # the predicted query was only planned, not executed
+                writer.writerow(row)
+                csvfile.flush()  # every written row survives a crash
 
-    exact_match_percentage = (exact_match_count / total_count) * 100
-    syntax_error_rate = (syntax_error_count / total_count) * 100
-    all_key_values_used_rate = (all_key_values_used_count /total_count) * 100
+    metrics["elapsed"] = time.time() - start
+    metrics["executed"] = (2 * (metrics["total"] - metrics["resumed"]) - metrics["gt_cache_hits"] - metrics["memo_hits"]
+                           - metrics["preflight_skipped"])
+    return metrics
 
-    print(f"\nEvaluation Summary:")
+def print_summary(metrics, title="Evaluation Summary"):
+    total_count = metrics["total"]
+    print(f"\n{title}:")
     print(f"Total queries evaluated: {total_count}")
-    print(f"Exact matches of query execution: {exact_match_count} / {total_count} ({exact_match_percentage:.2f}%)")
-    print(f"Predicted syntax errors: {syntax_error_count} / {total_count} ({syntax_error_rate:.2f}%)")
-    print(f"Ratio of samples which use all relevant key values: {all_key_values_used_count} / {total_count} ({all_key_values_used_rate:.2f}%)")
+    if total_count == 0:
+        return
+    print(f"Exact matches of query execution: {metrics['exact_matches']} / {total_count} ({metrics['exact_matches'] / total_count * 100:.2f}%)")
+    print(f"Predicted syntax errors: {metrics['syntax_errors']} / {total_count} ({metrics['syntax_errors'] / total_count * 100:.2f}%)")
+    print(f"Predicted queries timed out: {metrics['pred_timeouts']} / {total_count} ({metrics['pred_timeouts'] / total_count * 100:.2f}%)")
+    print(f"Ground truth queries timed out: {metrics['gt_timeouts']} / {total_count}")
+    if PREFLIGHT:
+        action = "skipped" if EXPLOSIVE_ACTION == "skip" else f"run with {EXPLOSIVE_TIMEOUT}s timeout"
+        print(f"Predicted queries flagged as explosive by EXPLAIN: {metrics['explosive']} / {total_count} ({action})")
+        print(f"Predicted queries not executed after EXPLAIN (errors, skipped explosive queries): {metrics['preflight_skipped']}")
+    if PROFILE:
+        summarize_costs(metrics["cost_ratios"])
+    print(f"Ratio of samples which use all relevant key values: {metrics['key_values_used']} / {total_count} ({metrics['key_values_used'] / total_count * 100:.2f}%)")
+    if metrics["resumed"]:
+        print(f"Rows taken over from the partial results file: {metrics['resumed']} / {total_count}")
+    print(f"Throughput: {metrics['executed'] / metrics['elapsed']:.2f} queries/sec ({metrics['elapsed']:.1f}s, {metrics['workers']} workers)")
+    if GT_CACHE_DIR is not None:
+        print(f"Ground truth results served from cache: {metrics['gt_cache_hits']} / {total_count}")
+    if MEMOIZE:
+        print(f"Executions shared between queries with the same canonical form: {metrics['memo_hits']}")
+
+def compare_and_save_results(gt_file, pred_file, output_file, workers=WORKERS, database=None):
+    executor, gt_cache = open_executor(LOCAL_EKG, database, pool_size=workers)
+    try:
+        metrics = evaluate_set(executor, gt_file, pred_file, output_file, workers, gt_cache)
+    finally:
+        executor.close()
+    if gt_cache:
+        gt_cache.save()
+
+    print_summary(metrics)
     print(f"\nResults saved to {output_file}")
+    return metrics
+
+# Evaluate several validation sets, each against its own database
+def macro_rate(results, key):
+    """Rate of key averaged over the sets with rows, or None if no set has any."""
+    rates = [m[key] / m["total"] for m in results if m["total"]]
+    return statistics.fmean(rates) if rates else None
+
+def evaluate_manifest(manifest_file, workers=WORKERS):
+    """Evaluates all sets of a JSON manifest concurrently and prints per-set
+    and aggregate metrics. Each entry of "sets" names its ground truth and
+    predictions file, the target "database" on the Neo4j server (or a
+    "local_ekg" path) and optionally its "output" file. Relative paths are
+    resolved against the manifest's directory. Sets on the same graph share
+    one executor, GT cache and execution memo."""
+    with open(manifest_file, encoding='utf-8') as f:
+        manifest = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(manifest_file))
+    resolve = lambda path: os.path.normpath(os.path.join(base_dir, path))
+    output_dir = resolve(manifest.get("output_dir", "."))
+    os.makedirs(output_dir, exist_ok=True)
+
+    sets = manifest["sets"]
+    targets = {}
+    for entry in sets:
+        local_ekg = resolve(entry["local_ekg"]) if entry.get("local_ekg") else None
+        entry["target"] = (local_ekg, None if local_ekg else entry.get("database"))
+        targets.setdefault(entry["target"], 0)
+        targets[entry["target"]] += 1
+
+    executors = {}
+    for (local_ekg, database), set_count in targets.items():
+        print(f"Opening {local_ekg or 'database ' + (database or 'default')} for {set_count} set(s)")
+        executors[(local_ekg, database)] = open_executor(local_ekg, database, pool_size=workers * set_count)
+    memos = {target: ExecutionMemo() for target in targets} if MEMOIZE else {}
+
+    def run(entry):
+        executor, gt_cache = executors[entry["target"]]
+        output_file = resolve(entry["output"]) if entry.get("output") else os.path.join(output_dir, f"{entry['name']}_results.csv")
+        return evaluate_set(executor, resolve(entry["ground_truth"]), resolve(entry["predictions"]),
+                            output_file, workers, gt_cache, memos.get(entry["target"]))
+
+    start = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=len(sets)) as pool:
+            results = list(pool.map(run, sets))
+    finally:
+        for executor, gt_cache in executors.values():
+            executor.close()
+            if gt_cache:
+                gt_cache.save()
+
+    summary = {"sets": {}}
+    for entry, metrics in zip(sets, results):
+        summary["sets"][entry["name"]] = metrics
+        print_summary(metrics, f"Evaluation Summary ({entry['name']}, {entry['target'][0] or entry['target'][1] or 'default database'})")
+        print(f"Results saved to {metrics['output_file']}")
+
+    # micro: counts summed over all rows; macro: rates averaged over the sets
+    aggregate = {key: sum(m[key] for m in results) for key in
+                 ("total", "exact_matches", "syntax_errors", "gt_timeouts", "pred_timeouts",
+                  "explosive", "key_values_used", "gt_cache_hits", "memo_hits", "preflight_skipped", "resumed", "executed")}
+    aggregate["cost_ratios"] = [r for m in results for r in m["cost_ratios"]]
+    aggregate["workers"] = workers * len(sets)
+    aggregate["elapsed"] = time.time() - start
+    aggregate["macro_exact_match_rate"] = macro_rate(results, "exact_matches")
+    aggregate["macro_syntax_error_rate"] = macro_rate(results, "syntax_errors")
+    summary["aggregate"] = aggregate
+
+    print_summary(aggregate, f"Aggregate Summary over {len(sets)} sets")
+    if aggregate["macro_exact_match_rate"] is None:
+        print("Macro-averaged rates: no set has rows to evaluate")
+    else:
+        print(f"Macro-averaged exact match rate: {aggregate['macro_exact_match_rate'] * 100:.2f}%")
+        print(f"Macro-averaged syntax error rate: {aggregate['macro_syntax_error_rate'] * 100:.2f}%")
+
+    summary_file = os.path.join(output_dir, "summary.json")
+    with open(summary_file, 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=1)
+    print(f"\nSummary saved to {summary_file}")
+    return summary
 
 # Usage: As input, we require a ground truth file which follows the same schema as the validation sets, and a predictions file. This should look like the example_predictions_file.csv file.
 if __name__ == "__main__":
@@ -220,3 +696,5 @@ if __name__ == "__main__":
         "path_to_predictions_file.csv", # Replace with your input path
         "path_to_results_file.csv" # Replace with your file path
     )
+    # To evaluate several validation sets in one run, each against its own database:
+    # evaluate_manifest("manifest.json")
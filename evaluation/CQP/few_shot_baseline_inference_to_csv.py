@@ -3,6 +3,10 @@ import os
 import re
 import torch
 import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from resume import resume_predictions
 
 os.environ["HF_TOKEN"] = "YOUR_HF_TOKEN"
 
@@ -28,17 +32,19 @@ def truncate_string(input_string):
 # Split the string on "### Answer:"
 split_word = "### Answer:"
 
-#retrieve validation set - replace the file path
-validation_dataset = pd.read_csv("path_to_validatiopn_set.csv", delimiter=',')
+def predict_queries(validation_file, predictions_file):
+	"""Predicts the query of every rule of validation_file and appends it to predictions_file."""
+	#retrieve validation set
+	validation_dataset = pd.read_csv(validation_file, delimiter=',')
 
-#define data frame that will later contain the predicted query, can be used for evaluation later
-df = pd.DataFrame(columns=['NL input', 'Key Values', 'Predicted Query'])
+	#resume an interrupted run: rows already in the predictions file are skipped
+	done = resume_predictions(predictions_file, validation_dataset, ['NL input', 'Key Values', 'Predicted Query'])
 
-#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query for each sample in the test dataset
-for index, row in validation_dataset.iterrows():
-	rule = row['NL input']
-	key_values = row['Key Values']
-	prompt = f'''<s>[SYSTEM_PROMPT]You are an expert in translating NL business rules into Cypher queries that check the specified property.
+	#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query for each sample in the test dataset
+	for index, row in validation_dataset.iloc[done:].iterrows():
+		rule = row['NL input']
+		key_values = row['Key Values']
+		prompt = f'''<s>[SYSTEM_PROMPT]You are an expert in translating NL business rules into Cypher queries that check the specified property.
 		Consider the following schema information of a Neo4j graph database storing event logs:
 		Node Types: 
 		Event (with properties Activity, Actor, Timestamp)
@@ -97,26 +103,27 @@ for index, row in validation_dataset.iterrows():
 		The relevant key values for this query are: {key_values}
 		Create a corresponding Cypher query that returns true if the rule is satisfied, false otherwise. Ensure that the query is syntactically correct, adheres 			to the database schema and leverages the key values effectively.
 		### Answer: '''
-                
-	device = "cuda:0"
-	inputs = tokenizer(prompt, return_tensors="pt").to(device)
 
-	outputs = model.generate(**inputs, max_new_tokens=300)
-	input_length = inputs['input_ids'].shape[1]
+		device = "cuda:0"
+		inputs = tokenizer(prompt, return_tensors="pt").to(device)
+
+		outputs = model.generate(**inputs, max_new_tokens=300)
+		input_length = inputs['input_ids'].shape[1]
+
+		# Decode only the newly generated tokens
+		generated_tokens = outputs[0][input_length:]
+		new_tokens_decoded = tokenizer.decode(generated_tokens, skip_special_tokens=True)
+		predicted_query = truncate_string(new_tokens_decoded)
+		print(predicted_query)	
+
+		new_entry = {
+		'NL input': rule,
+		'Key Values' : key_values,
+		'Predicted Query': predicted_query
+		}
+		# Append the new entry to the predictions file, so it is kept if the run is interrupted
+		pd.DataFrame([new_entry]).to_csv(predictions_file, mode='a', header=False, sep=',', index=False)
 
-	# Decode only the newly generated tokens
-	generated_tokens = outputs[0][input_length:]
-	new_tokens_decoded = tokenizer.decode(generated_tokens, skip_special_tokens=True)
-	predicted_query = truncate_string(new_tokens_decoded)
-	print(predicted_query)	
-    
-	new_entry = {
-	'NL input': rule,
-	'Key Values' : key_values,
-	'Predicted Query': predicted_query
-	}
-	# Append the new entry to the DataFrame
-	df = df._append(new_entry, ignore_index=True)
-    
-#Convert the data frame into a csv file and store it. Use it for evaluation.
-df.to_csv('path_to_predictions_file.csv', sep=',', index=False) #replace the file path
+# Usage: replace the file paths
+if __name__ == "__main__":
+	predict_queries("path_to_validation_set.csv", 'path_to_predictions_file.csv')
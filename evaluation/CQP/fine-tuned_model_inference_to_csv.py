@@ -4,6 +4,10 @@ from peft import AutoPeftModelForCausalLM
 import re
 import torch
 import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from resume import resume_predictions
 
 os.environ["HF_TOKEN"] = "YOUR_HF_TOKEN"
 
@@ -13,9 +17,6 @@ bnb_config = BitsAndBytesConfig(
     load_in_4bit=True, bnb_4bit_quant_type="nf4", bnb_4bit_compute_dtype=torch.bfloat16
 )
 
-#specify the path to the folder that contains the LoRA weights
-model = AutoPeftModelForCausalLM.from_pretrained("path_to_lora_adapter", quantization_config=bnb_config)
-                                     
 tokenizer = AutoTokenizer.from_pretrained(model_id, token=os.environ['HF_TOKEN'])
 
 def truncate_string(input_string):
@@ -28,17 +29,22 @@ def truncate_string(input_string):
 # Split the string on the last word of the input prompt
 split_word = "effectively."
 
-#retrieve validation set - replace the file path
-validation_dataset = pd.read_csv("path_to_validation_set.csv", delimiter=',')
+def predict_queries(validation_file, predictions_file, adapter_path):
+    """Predicts the query of every rule of validation_file with the fine-tuned model of
+    adapter_path (the folder that contains the LoRA weights) and appends it to predictions_file."""
+    model = AutoPeftModelForCausalLM.from_pretrained(adapter_path, quantization_config=bnb_config)
+
+    #retrieve validation set
+    validation_dataset = pd.read_csv(validation_file, delimiter=',')
 
-#define data frame that will later contain the predicted query, can be used for evaluation later
-df = pd.DataFrame(columns=['NL input', 'Key Values', 'Predicted Query'])
+    #resume an interrupted run: rows already in the predictions file are skipped
+    done = resume_predictions(predictions_file, validation_dataset, ['NL input', 'Key Values', 'Predicted Query'])
 
-#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query instruction for each sentence in the test dataset
-for index, row in validation_dataset.iterrows():
-    rule = row['NL input']
-    key_values = row['Key Values']
-    prompt =f'''<s>[SYSTEM_PROMPT]Consider the following schema information of a Neo4j graph database storing event logs:
+    #Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query instruction for each sentence in the test dataset
+    for index, row in validation_dataset.iloc[done:].iterrows():
+        rule = row['NL input']
+        key_values = row['Key Values']
+        prompt =f'''<s>[SYSTEM_PROMPT]Consider the following schema information of a Neo4j graph database storing event logs:
                 Node Types: 
                 Event (with properties Activity, Actor, Timestamp)
                 Entity (with properties EntityType, ID)
@@ -49,24 +55,25 @@ for index, row in validation_dataset.iterrows():
                 [INST]I want to check the following business rule: {rule}
                 The relevant key values for this query are: {key_values}
                 Create a corresponding Cypher query that returns true if the rule is satisfied, false otherwise. Ensure that the query is syntactically correct, adheres to the database schema and leverages the key values effectively.[/INST]'''
-    device = "cuda:0"
-    inputs = tokenizer(prompt, return_tensors="pt").to(device)
+        device = "cuda:0"
+        inputs = tokenizer(prompt, return_tensors="pt").to(device)
+
+        outputs = model.generate(**inputs, max_new_tokens=300)
+        output_decoded = tokenizer.decode(outputs[0], skip_special_tokens=True)
+        substrings = re.split(rf"{re.escape(split_word)}", output_decoded)
+
+        predicted_query = substrings[1]
+        predicted_query = truncate_string(predicted_query)
+        print(predicted_query)
+
+        new_entry = {
+            'NL input': rule,
+            'Key Values' : key_values,
+            'Predicted Query': predicted_query
+        }
+        # Append the new entry to the predictions file, so it is kept if the run is interrupted
+        pd.DataFrame([new_entry]).to_csv(predictions_file, mode='a', header=False, sep=',', index=False)
 
-    outputs = model.generate(**inputs, max_new_tokens=300)
-    output_decoded = tokenizer.decode(outputs[0], skip_special_tokens=True)
-    substrings = re.split(rf"{re.escape(split_word)}", output_decoded)
-    
-    predicted_query = substrings[1]
-    predicted_query = truncate_string(predicted_query)
-    print(predicted_query)
-    
-    new_entry = {
-        'NL input': rule,
-        'Key Values' : key_values,
-        'Predicted Query': predicted_query
-    }
-    # Append the new entry to the DataFrame
-    df = df._append(new_entry, ignore_index=True)
-    
-#Convert the data frame into a csv file and store it. Use it for evaluation.
-df.to_csv('path_to_your_predictions_file.csv', sep=',', index=False) #replace the file path
+# Usage: replace the file paths
+if __name__ == "__main__":
+    predict_queries("path_to_validation_set.csv", 'path_to_your_predictions_file.csv', "path_to_lora_adapter")
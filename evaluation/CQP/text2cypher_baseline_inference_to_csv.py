@@ -1,6 +1,11 @@
 from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, BitsAndBytesConfig
+import os
 import torch
 import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from resume import resume_predictions
 
 
 baseline_model_name = "neo4j/text2cypher-gemma-2-9b-it-finetuned-2024v1"
@@ -84,26 +89,29 @@ def generate_answer(rule, key_values):
 	
 	return(output)
 	
-#retrieve validation set - replace the file path
-validation_dataset = pd.read_csv("path_to_validation_set.csv", delimiter=',')
+def predict_queries(validation_file, predictions_file):
+	"""Predicts the query of every rule of validation_file and appends it to predictions_file."""
+	#retrieve validation set
+	validation_dataset = pd.read_csv(validation_file, delimiter=',')
+
+	#resume an interrupted run: rows already in the predictions file are skipped
+	done = resume_predictions(predictions_file, validation_dataset, ['NL input', 'Key Values', 'Predicted Query'])
+
+	#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query for each sample in the test dataset
+	for index, row in validation_dataset.iloc[done:].iterrows():
+		rule = row['NL input']
+		key_values = row['Key Values']
+		predicted_query = generate_answer(rule, key_values)
+		print(predicted_query)	
 
-#define data frame that will later contain the predicted query, can be used for evaluation later
-df = pd.DataFrame(columns=['NL input', 'Key Values', 'Predicted Query'])
+		new_entry = {
+		'NL input': rule,
+		'Key Values' : key_values,
+		'Predicted Query': predicted_query
+		}
+		# Append the new entry to the predictions file, so it is kept if the run is interrupted
+		pd.DataFrame([new_entry]).to_csv(predictions_file, mode='a', header=False, sep=',', index=False)
 
-#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query for each sample in the test dataset
-for index, row in validation_dataset.iterrows():
-	rule = row['NL input']
-	key_values = row['Key Values']
-	predicted_query = generate_answer(rule, key_values)
-	print(predicted_query)	
-    
-	new_entry = {
-	'NL input': rule,
-	'Key Values' : key_values,
-	'Predicted Query': predicted_query
-	}
-	# Append the new entry to the DataFrame
-	df = df._append(new_entry, ignore_index=True)
-    
-#Convert the data frame into a csv file and store it. Use it for evaluation.
-df.to_csv('path_to_predictions_file.csv', sep=',', index=False) #replace the file path
+# Usage: replace the file paths
+if __name__ == "__main__":
+	predict_queries("path_to_validation_set.csv", 'path_to_predictions_file.csv')
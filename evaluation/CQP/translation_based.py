@@ -1,17 +1,20 @@
 import csv
-import evaluate
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from sacrebleu.metrics import BLEU
 
-sacrebleu = evaluate.load("sacrebleu")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from cypher_tokens import cypher_tokens, token_overlap, token_f1
+from cypher_canonical import canonical_query
 
-def preprocess_query(query):
-    """
-    Preprocess the query by replacing double quotes and
-    normalizing whitespace.
-    """
-    query = query.replace("''", "'")  # Replace '' with '
-    query = query.strip()  # Remove leading and trailing spaces
-    query = " ".join(query.split())  # Normalize internal whitespace
-    return query
+WORKERS = 4  # Processes scoring the query pairs, 1 scores them in this process
+CHUNK_SIZE = 2000  # Query pairs per task of a worker process
+
+# same settings as sacrebleu.compute of the evaluate library: exp smoothing, 13a tokenizer
+bleu = BLEU()
 
 def load_csv_as_dict(filepath, key_column):
     """
@@ -24,46 +27,111 @@ def load_csv_as_dict(filepath, key_column):
             data[row[key_column]] = row
     return data
 
-def calculate_bleu_scores(ground_truth_file, predictions_file, output_file):
+def ngram_statistics(gt_tokens, pred_tokens):
+    """sacrebleu's sufficient BLEU statistics of one pair: predicted and ground truth
+    length, matching n-grams and predicted n-grams per order. Counting the n-grams
+    with Counter and set operations is faster than sacrebleu's own extraction."""
+    correct = []
+    total = []
+    for order in range(1, bleu.max_ngram_order + 1):
+        pred_ngrams = Counter(zip(*[pred_tokens[i:] for i in range(order)]))
+        gt_ngrams = Counter(zip(*[gt_tokens[i:] for i in range(order)]))
+        correct.append(sum(min(pred_ngrams[ngram], gt_ngrams[ngram]) for ngram in pred_ngrams.keys() & gt_ngrams.keys()))
+        total.append(max(0, len(pred_tokens) - order + 1))
+    return [len(pred_tokens), len(gt_tokens)] + correct + total
+
+def bleu_score(stats):
+    """BLEU of summed statistics, normalized to [0, 1]."""
+    order = bleu.max_ngram_order
+    return bleu.compute_bleu(correct=stats[2:2 + order], total=stats[2 + order:], sys_len=stats[0], ref_len=stats[1],
+                             smooth_method=bleu.smooth_method, smooth_value=bleu.smooth_value,
+                             effective_order=bleu.effective_order, max_ngram_order=order).score / 100.0
+
+def score_pairs(pairs):
+    """Returns the canonical forms, the BLEU statistics and the Cypher token counts
+    (overlap, ground truth tokens, predicted tokens) of (ground truth, predicted)
+    query pairs. Both queries are scored in the canonical form that
+    execution_based.py memoizes on; each distinct query is canonicalized and
+    tokenized once, in the worker process that scores it."""
+    canonical = {}
+    bleu_tokens = {}
+    tokens = {}
+    canonical_pairs = []
+    bleu_stats = []
+    token_counts = []
+    for gt_query, pred_query in pairs:
+        for query in (gt_query, pred_query):
+            if query not in canonical:
+                canonical[query] = canonical_query(query)
+                bleu_tokens[query] = bleu.tokenizer(canonical[query].rstrip()).split()
+                tokens[query] = cypher_tokens(canonical[query])
+        canonical_pairs.append((canonical[gt_query], canonical[pred_query]))
+        bleu_stats.append(ngram_statistics(bleu_tokens[gt_query], bleu_tokens[pred_query]))
+        gt_tokens, pred_tokens = tokens[gt_query], tokens[pred_query]
+        token_counts.append((token_overlap(gt_tokens, pred_tokens), len(gt_tokens), len(pred_tokens)))
+    return canonical_pairs, bleu_stats, token_counts
+
+def calculate_bleu_scores(ground_truth_file, predictions_file, output_file, workers=WORKERS):
     # Load ground truth and prediction files
     ground_truth_data = load_csv_as_dict(ground_truth_file, key_column="NL input")
     predictions_data = load_csv_as_dict(predictions_file, key_column="NL input")
+    start = time.time()
 
     results = []
-    total_score = 0.0
-    match_count = 0
-
     for nl_input, pred_row in predictions_data.items():
         if nl_input not in ground_truth_data:
             print(f"Warning: No ground truth for NL input: {nl_input}")
             continue
         
         gt_row = ground_truth_data[nl_input]
-        ground_truth_query = preprocess_query(gt_row["Cypher Query"])
-        predicted_query = preprocess_query(pred_row["Predicted Query"])
+        results.append({
+            "NL input": nl_input,
+            "Cypher Query": gt_row["Cypher Query"],
+            "Predicted Query": pred_row["Predicted Query"]
+        })
 
-        predictions = [predicted_query]
-        references = [[ground_truth_query]]
-        result = sacrebleu.compute(predictions=predictions, references=references)
-        score = result["score"] / 100.0  # Normalize the BLEU score
-        total_score += score
-        match_count += 1
+    # One scoring pass: the n-gram statistics of every distinct pair give its
+    # sentence BLEU, and their sum the corpus BLEU. The token counts work the same way.
+    pairs = list(dict.fromkeys((row["Cypher Query"], row["Predicted Query"]) for row in results))
+    chunks = [pairs[i:i + CHUNK_SIZE] for i in range(0, len(pairs), CHUNK_SIZE)]
+    if workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            scored = list(pool.map(score_pairs, chunks))
+    else:
+        scored = [score_pairs(chunk) for chunk in chunks]
 
-        # Build output row
-        result_row = {
-            "NL input": nl_input,
-            "Cypher Query": ground_truth_query,
-            "Predicted Query": predicted_query,
-            "BLEU Score": round(score, 4)
-        }
-        results.append(result_row)
+    pair_scores = {}
+    for chunk, (canonical_pairs, bleu_stats, token_counts) in zip(chunks, scored):
+        for pair, canonical, stats, counts in zip(chunk, canonical_pairs, bleu_stats, token_counts):
+            pair_scores[pair] = (canonical, bleu_score(stats), token_f1(*counts), stats, counts)
+
+    corpus_stats = [0] * (2 + 2 * bleu.max_ngram_order)
+    token_counts = [0, 0, 0]  # overlap, ground truth tokens, predicted tokens
+    total_score = 0.0
+    total_token_f1 = 0.0
+    for row in results:
+        canonical, score, f1, stats, counts = pair_scores[row["Cypher Query"], row["Predicted Query"]]
+        row["Cypher Query"], row["Predicted Query"] = canonical  # written in the canonical form that was scored
+        total_score += score
+        total_token_f1 += f1
+        corpus_stats = [a + b for a, b in zip(corpus_stats, stats)]
+        token_counts = [a + b for a, b in zip(token_counts, counts)]
+        row["BLEU Score"] = round(score, 4)  # Normalized BLEU score
+        row["Token F1"] = round(f1, 4)
 
+    match_count = len(results)
     overall_score = total_score / match_count if match_count else 0.0
+    corpus_score = bleu_score(corpus_stats) if match_count else 0.0
+    elapsed = time.time() - start
     print(f"Overall BLEU Score: {overall_score:.4f}")
+    print(f"Corpus BLEU Score: {corpus_score:.4f}")
+    print(f"Overall Cypher token F1: {total_token_f1 / match_count if match_count else 0.0:.4f}")
+    print(f"Corpus Cypher token F1: {token_f1(*token_counts):.4f}")
+    print(f"Scored {match_count} pairs ({len(pairs)} distinct) in {elapsed:.2f}s")
 
     # Write output CSV
     with open(output_file, 'w', newline='', encoding='utf-8-sig') as file:
-        fieldnames = ["NL input", "Cypher Query", "Predicted Query", "BLEU Score"]
+        fieldnames = ["NL input", "Cypher Query", "Predicted Query", "BLEU Score", "Token F1"]
         writer = csv.DictWriter(file, fieldnames=fieldnames)
         writer.writeheader()
         writer.writerows(results)
@@ -73,4 +141,5 @@ ground_truth_csv = "path_to_ground_truth_file.csv"        # Replace with actual
 predictions_csv = "path_to_predictions_file.csv"          # Replace with actual path
 output_csv = "path_to_results_file.csv"        # Output file with BLEU scores
 
-calculate_bleu_scores(ground_truth_csv, predictions_csv, output_csv)
+if __name__ == "__main__":  # the worker processes import this module
+    calculate_bleu_scores(ground_truth_csv, predictions_csv, output_csv)
@@ -1,95 +1,98 @@
+import os
+import sys
+import numpy as np
 import pandas as pd
-import re
 
-def parse_key_values(key_values_str):
-    """Extracts key values manually using regex."""
-    if not isinstance(key_values_str, str) or not key_values_str.strip():
-        return {"Activity": [], "EntityType": [], "Actor": []}
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from key_values import KEYS, parse_key_values_column
 
-    key_values = {"Activity": [], "EntityType": [], "Actor": []}
+def divide(numerator, denominator):
+    """Element-wise numerator / denominator, 0.0 where the denominator is 0."""
+    return np.divide(numerator, denominator, out=np.zeros(np.shape(numerator)), where=np.asarray(denominator) > 0)
 
-    # Regex to extract values inside brackets, handling double quotes
-    activity_match = re.search(r'Activity:\s*\[(.*?)\]', key_values_str)
-    entity_match = re.search(r'EntityType:\s*\[(.*?)\]', key_values_str)
-    actor_match = re.search(r'Actor:\s*\[(.*?)\]', key_values_str)
+def f1_score(precision, recall):
+    return divide(2 * precision * recall, precision + recall)
 
-    if activity_match:
-        key_values["Activity"] = [x.strip().strip('"') for x in activity_match.group(1).split(",") if x.strip()]
-    if entity_match:
-        key_values["EntityType"] = [x.strip().strip('"') for x in entity_match.group(1).split(",") if x.strip()]
-    if actor_match:
-        key_values["Actor"] = [x.strip().strip('"') for x in actor_match.group(1).split(",") if x.strip()]
-
-    return key_values
-
-
-def compute_precision_recall(gt, pred):
-    """Computes precision and recall for extracted key values, handling special empty case."""
-    if all(len(gt[key]) == 0 for key in gt) and all(len(pred[key]) == 0 for key in pred):
-        return 1.0, 1.0  # Special case: both are empty → perfect precision and recall
-
-    true_positives = sum(len(set(pred[key]) & set(gt[key])) for key in gt)
-    predicted_count = sum(len(set(pred[key])) for key in pred)
-    ground_truth_count = sum(len(set(gt[key])) for key in gt)
-    
-    precision = true_positives / predicted_count if predicted_count > 0 else 0.0
-    recall = true_positives / ground_truth_count if ground_truth_count > 0 else 0.0
-    
-    return precision, recall
-
-
-def evaluate_key_extraction(ground_truth_file, predictions_file, output_file):
-    """Evaluates key value extraction performance and writes the results to a CSV file."""
+def evaluate_key_extraction(ground_truth_file, predictions_file, output_file, verbose=False):
+    """Evaluates key value extraction performance and writes the results to a CSV file.
+    Returns precision, recall and F1 per category and their micro average (over
+    all key values) and macro average (over the categories)."""
     # Load CSV files
     gt_df = pd.read_csv(ground_truth_file, sep=',', encoding='utf-8-sig')
     pred_df = pd.read_csv(predictions_file, sep=',', encoding='utf-8-sig')
-    
-    results = []
-    cumulative_true_positives = 0
-    cumulative_predicted_count = 0
-    cumulative_ground_truth_count = 0
 
     print("GT Columns:", gt_df.columns)
     print("Pred Columns:", pred_df.columns)
 
-    for _, gt_row in gt_df.iterrows():
-        nl_input = gt_row['NL input']
-        gt_key_values = parse_key_values(gt_row['Key Values'])
-        
-        # Find corresponding prediction
-        pred_row = pred_df[pred_df['NL input'] == nl_input]
-        if pred_row.empty:
-            pred_key_values = {"Activity": [], "EntityType": [], "Actor": []}
-        else:
-            pred_key_values = parse_key_values(pred_row.iloc[0]['Predicted Key Values'])
-        
-        precision, recall = compute_precision_recall(gt_key_values, pred_key_values)
-
-        # Update cumulative values for overall precision and recall
-        cumulative_true_positives += sum(len(set(pred_key_values[key]) & set(gt_key_values[key])) for key in gt_key_values)
-        cumulative_predicted_count += sum(len(set(pred_key_values[key])) for key in pred_key_values)
-        cumulative_ground_truth_count += sum(len(set(gt_key_values[key])) for key in gt_key_values)
-
-        print("GT Parsed:", gt_key_values)
-        print("Pred Parsed:", pred_key_values)
-
-        results.append([nl_input, gt_row['Key Values'], pred_row.iloc[0]['Predicted Key Values'] if not pred_row.empty else "{}", precision, recall])
-    
-    # Compute overall precision and recall
-    overall_precision = cumulative_true_positives / cumulative_predicted_count if cumulative_predicted_count > 0 else 0.0
-    overall_recall = cumulative_true_positives / cumulative_ground_truth_count if cumulative_ground_truth_count > 0 else 0.0
+    # Find the corresponding prediction of every rule with one join, the first one of duplicated rules
+    pred_df = pred_df.drop_duplicates('NL input')[['NL input', 'Predicted Key Values']]
+    df = gt_df[['NL input', 'Key Values']].merge(pred_df, on='NL input', how='left', validate='many_to_one')
+    missing = df['Predicted Key Values'].isna()
+    if missing.any():
+        print(f"Warning: No prediction for {missing.sum()} of {len(df)} rules, counted as empty")
+
+    # both columns are parsed at once, every distinct string only once
+    gt_parsed = parse_key_values_column(df['Key Values'], KEYS)
+    pred_parsed = parse_key_values_column(df['Predicted Key Values'], KEYS)
+
+    # counts per rule (rows) and category (columns)
+    true_positives = np.zeros((len(df), len(KEYS)), dtype=int)
+    predicted_counts = np.zeros_like(true_positives)
+    ground_truth_counts = np.zeros_like(true_positives)
+    for k, key in enumerate(KEYS):
+        gt_sets = [set(kv[key]) for kv in gt_parsed]
+        pred_sets = [set(kv[key]) for kv in pred_parsed]
+        true_positives[:, k] = [len(gt & pred) for gt, pred in zip(gt_sets, pred_sets)]
+        predicted_counts[:, k] = [len(pred) for pred in pred_sets]
+        ground_truth_counts[:, k] = [len(gt) for gt in gt_sets]
+
+    if verbose:
+        for gt_key_values, pred_key_values in zip(gt_parsed, pred_parsed):
+            print("GT Parsed:", gt_key_values)
+            print("Pred Parsed:", pred_key_values)
+
+    # per rule, over all categories; both empty is a perfect extraction
+    row_tp, row_pred, row_gt = true_positives.sum(axis=1), predicted_counts.sum(axis=1), ground_truth_counts.sum(axis=1)
+    both_empty = (row_pred == 0) & (row_gt == 0)
+    df['Precision'] = np.where(both_empty, 1.0, divide(row_tp, row_pred))
+    df['Recall'] = np.where(both_empty, 1.0, divide(row_tp, row_gt))
+    df['F1'] = np.where(both_empty, 1.0, f1_score(df['Precision'].to_numpy(), df['Recall'].to_numpy()))
+
+    # per category, and micro over all key values
+    tp, predicted, ground_truth = true_positives.sum(axis=0), predicted_counts.sum(axis=0), ground_truth_counts.sum(axis=0)
+    precision, recall = divide(tp, predicted), divide(tp, ground_truth)
+    metrics = {key: {"precision": float(precision[k]), "recall": float(recall[k]),
+                     "f1": float(f1_score(precision[k], recall[k])), "support": int(ground_truth[k])}
+               for k, key in enumerate(KEYS)}
+    micro_precision, micro_recall = divide(tp.sum(), predicted.sum()), divide(tp.sum(), ground_truth.sum())
+    metrics["micro"] = {"precision": float(micro_precision), "recall": float(micro_recall),
+                        "f1": float(f1_score(micro_precision, micro_recall)), "support": int(ground_truth.sum())}
+    # macro over the categories that occur in the ground truth or the predictions
+    occurring = [key for k, key in enumerate(KEYS) if predicted[k] or ground_truth[k]]
+    metrics["macro"] = {name: float(np.mean([metrics[key][name] for key in occurring])) if occurring else 0.0
+                        for name in ("precision", "recall", "f1")}
+    metrics["macro"]["support"] = int(ground_truth.sum())
 
     # Save results to CSV
-    result_df = pd.DataFrame(results, columns=['NL input', 'GT Key Values', 'Predicted Key Values', 'Precision', 'Recall'])
+    df['Predicted Key Values'] = df['Predicted Key Values'].fillna("{}")
+    result_df = df.rename(columns={'Key Values': 'GT Key Values'})[['NL input', 'GT Key Values', 'Predicted Key Values', 'Precision', 'Recall', 'F1']]
     result_df.to_csv(output_file, sep=',', index=False)
     
     print(f"Results saved to {output_file}")
-    print(f"Overall Precision: {overall_precision:.4f}")
-    print(f"Overall Recall: {overall_recall:.4f}")
+    print(f"Overall Precision: {metrics['micro']['precision']:.4f}")
+    print(f"Overall Recall: {metrics['micro']['recall']:.4f}")
+    print(f"Overall F1: {metrics['micro']['f1']:.4f}")
+    print(f"\n{'':<12}{'Precision':>10}{'Recall':>10}{'F1':>10}{'Support':>10}")
+    for name in (*KEYS, "micro", "macro"):
+        m = metrics[name]
+        print(f"{name:<12}{m['precision']:>10.4f}{m['recall']:>10.4f}{m['f1']:>10.4f}{m['support']:>10}")
+    return metrics
 
 
 # Usage: As input, we require a ground truth file which follows the same schema as the validation sets, and a predictions file. This should look like the example_kve_predictions.csv file.
 gt_file = 'path_to_ground_truth_file.csv' # Replace with your file path
 predictions_file = 'path_to_predictions_file.csv' # Replace with your file path
 results_file = 'path_to_results_file.csv' # Replace with your file path
-evaluate_key_extraction(gt_file, predictions_file, results_file)
+
+if __name__ == "__main__":
+    evaluate_key_extraction(gt_file, predictions_file, results_file)
@@ -3,6 +3,10 @@ import os
 import re
 import torch
 import pandas as pd
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from resume import resume_predictions
 
 
 os.environ["HF_TOKEN"] = "YOUR_HF_TOKEN"
@@ -33,16 +37,18 @@ def truncate_string(input_string):
     return input_string  # Return the original string if keyword not found
 
 
-#retrieve validation set - replace the file path
-validation_dataset = pd.read_csv("path_to_validation_set.csv", delimiter=',')
+def predict_key_values(validation_file, predictions_file, available_key_values=available_key_values):
+	"""Extracts the key values of every rule of validation_file and appends them to predictions_file."""
+	#retrieve validation set
+	validation_dataset = pd.read_csv(validation_file, delimiter=',')
 
-#define data frame that will later contain the predicted query, can be used for evaluation later
-df = pd.DataFrame(columns=['NL input', 'Predicted Key Values'])
+	#resume an interrupted run: rows already in the predictions file are skipped
+	done = resume_predictions(predictions_file, validation_dataset, ['NL input', 'Predicted Key Values'])
 
-#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query for each sample in the test dataset
-for index, row in validation_dataset.iterrows():
-	rule = row['NL input']
-	prompt=f""" You are an expert in extracting key values from natural language (NL) inputs.
+	#Iterate through test_dataset, prompt the fine-tuned model to obtain the predicted query for each sample in the test dataset
+	for index, row in validation_dataset.iloc[done:].iterrows():
+		rule = row['NL input']
+		prompt=f""" You are an expert in extracting key values from natural language (NL) inputs.
 
 		### Task Description:
 		Extract key values from the given business rule using only the available lists of:
@@ -137,24 +143,25 @@ for index, row in validation_dataset.iterrows():
 		"{rule}"
 		Extracted Key Values:  
 	"""
-	
-	device = "cuda:0"
-	inputs = tokenizer(prompt, return_tensors="pt").to(device)
-	outputs = model.generate(**inputs, max_new_tokens=100)
-	input_length = inputs['input_ids'].shape[1]
-
-	# Decode only the newly generated tokens
-	generated_tokens = outputs[0][input_length:]
-	new_tokens_decoded = tokenizer.decode(generated_tokens, skip_special_tokens=True)
-	key_values = truncate_string(new_tokens_decoded)
-	print(key_values)
-
-	new_entry = {
-	'NL input': rule,
-	'Predicted Key Values': key_values
-	}
-	# Append the new entry to the DataFrame
-	df = df._append(new_entry, ignore_index=True)
-    
-#Convert the data frame into a csv file and store it. Use it for evaluation.
-df.to_csv('path_to_predictions_file.csv', sep=',', index=False) # Replace with your file path
+
+		device = "cuda:0"
+		inputs = tokenizer(prompt, return_tensors="pt").to(device)
+		outputs = model.generate(**inputs, max_new_tokens=100)
+		input_length = inputs['input_ids'].shape[1]
+
+		# Decode only the newly generated tokens
+		generated_tokens = outputs[0][input_length:]
+		new_tokens_decoded = tokenizer.decode(generated_tokens, skip_special_tokens=True)
+		key_values = truncate_string(new_tokens_decoded)
+		print(key_values)
+
+		new_entry = {
+		'NL input': rule,
+		'Predicted Key Values': key_values
+		}
+		# Append the new entry to the predictions file, so it is kept if the run is interrupted
+		pd.DataFrame([new_entry]).to_csv(predictions_file, mode='a', header=False, sep=',', index=False)
+
+# Usage: replace the file paths
+if __name__ == "__main__":
+	predict_key_values("path_to_validation_set.csv", 'path_to_predictions_file.csv')
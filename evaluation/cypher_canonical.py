@@ -0,0 +1,207 @@
+"""Canonical text of a Cypher query.
+
+Two queries with the same canonical text return the same rows, up to the
+names of their columns. canonical_query normalizes
+
+- whitespace, comments, the case of keywords and function names, the quote
+  style of strings, backticks and the spelling of numbers (the token stream
+  of cypher_tokens.py),
+- variable names: they are renamed to v0, v1, ... in order of first
+  occurrence,
+- the order of commutative parts: the conjuncts of a WHERE condition that is
+  a plain AND chain, and the comma-separated patterns of a MATCH clause.
+
+Variables are renamed and parts sorted only if the query parses with the
+in-process Cypher parser (ocel_to_ekg/ekg_cypher.py), which tells variables
+apart from labels, property keys and functions. Other queries, e.g. invalid
+predictions, only get the normalized token stream.
+"""
+import os
+import re
+import sys
+from functools import lru_cache
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ocel_to_ekg"))
+from cypher_tokens import scan, KEYWORDS
+from ekg_cypher import parse, clause_variables, CypherError
+
+MAX_PASSES = 3  # Rename and sort rounds; sorting can change the order of first occurrence
+CACHE_SIZE = 100_000  # Canonical forms kept in memory
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z_0-9]*\Z")
+OPENING = {'(', '[', '{'}
+CLOSING = {')', ']', '}'}
+ARROWS = {'-', '->', '<-'}
+AND = ('keyword', 'AND')
+COMMA = ('op', ',')
+# keywords that start a clause, so they end a WHERE condition or MATCH pattern list
+CLAUSE_KEYWORDS = {'MATCH', 'OPTIONAL', 'WITH', 'RETURN', 'UNWIND', 'UNION', 'CALL', 'ORDER', 'SKIP',
+                   'LIMIT', 'CREATE', 'MERGE', 'DELETE', 'DETACH', 'SET', 'REMOVE', 'FOREACH'}
+# keywords written like functions: ANY(x IN list WHERE ...)
+FUNCTION_KEYWORDS = {'ALL', 'ANY', 'NONE', 'SINGLE', 'EXISTS'}
+# followed by a subquery in braces instead of a map
+SUBQUERY_KEYWORDS = {'EXISTS', 'CALL', 'COUNT', 'COLLECT'}
+
+def query_variables(tree):
+    """Returns the variable names and projection aliases of all parts of a parsed query."""
+    found = set()
+    for clauses in tree[1]:
+        for clause in clauses:
+            found |= clause_variables(clause)
+            if clause[0] in ('with', 'return') and clause[1]['items'] != '*':
+                found |= {alias for _, alias in clause[1]['items']}
+    return found
+
+def mark_variables(tokens, names):
+    """Changes the kind of the name tokens of the given variables to variable.
+    Labels, relationship types, property keys and map keys with the same name
+    as a variable stay names."""
+    brackets = []  # kind of every open bracket: map, list or group (parentheses, relationship, subquery)
+    label = False  # the token is a label or relationship type: it follows their colon or a | between types
+    result = []
+    for i, (kind, value) in enumerate(tokens):
+        is_label, label = label, False
+        previous = tokens[i - 1] if i else ('', '')
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        map_key = bool(brackets) and brackets[-1] == 'map' and previous[1] in ('{', ',') and following == ':'
+        if kind == 'name' and value in names and not is_label and not map_key and previous[1] != '.':
+            kind = 'variable'
+        result.append((kind, value))
+
+        if kind == 'op' and value in OPENING:
+            if value == '{':
+                brackets.append('group' if previous[1].upper() in SUBQUERY_KEYWORDS else 'map')
+            elif value == '[':
+                brackets.append('group' if previous[1] in ARROWS else 'list')
+            else:
+                brackets.append('group')
+        elif kind == 'op' and value in CLOSING and brackets:
+            brackets.pop()
+        if value == ':':
+            # colons of map keys and list slices are no labels
+            label = not (brackets and brackets[-1] == 'list') and not (
+                brackets and brackets[-1] == 'map' and previous[0] == 'name' and tokens[i - 2][1] in ('{', ','))
+        elif value == '|' and previous[0] == 'name' and tokens[i - 2][1] in (':', '|'):
+            label = True
+    return result
+
+def rename_variables(tokens):
+    """Renames the variables to v0, v1, ... in order of first occurrence."""
+    renamed = {}
+    result = []
+    for kind, value in tokens:
+        if kind == 'variable':
+            value = renamed.setdefault(value, f"v{len(renamed)}")
+        result.append((kind, value))
+    return result
+
+def is_opening(token):
+    return token[0] == 'op' and token[1] in OPENING or token == ('keyword', 'CASE')
+
+def is_closing(token):
+    return token[0] == 'op' and token[1] in CLOSING or token == ('keyword', 'END')
+
+def region_end(tokens, start, stop=()):
+    """Index after the WHERE condition or MATCH pattern list that starts at start:
+    the next clause keyword (or keyword in stop) or | outside brackets, or the
+    bracket that closes the enclosing one."""
+    depth = 0
+    for i in range(start, len(tokens)):
+        kind, value = tokens[i]
+        if is_opening(tokens[i]):
+            depth += 1
+        elif is_closing(tokens[i]):
+            if depth == 0:
+                return i
+            depth -= 1
+        elif depth == 0 and (value == '|' or kind == 'keyword' and (value in stop or value in CLAUSE_KEYWORDS
+                             and not (value == 'WITH' and tokens[i - 1][1] in ('STARTS', 'ENDS')))):
+            return i
+    return len(tokens)
+
+def split_top_level(tokens, separator):
+    """Splits tokens at the separator tokens outside brackets and CASE expressions."""
+    parts = [[]]
+    depth = 0
+    for token in tokens:
+        if is_opening(token):
+            depth += 1
+        elif is_closing(token):
+            depth -= 1
+        if depth == 0 and token == separator:
+            parts.append([])
+        else:
+            parts[-1].append(token)
+    return parts
+
+def sort_key(tokens):
+    """Orders parts by their text with the variables left out, so that the order
+    does not depend on the variable names, and ties by the full text."""
+    return join_tokens([('variable', '_') if kind == 'variable' else (kind, value) for kind, value in tokens]), join_tokens(tokens)
+
+def sort_commutative(tokens):
+    """Sorts the conjuncts of WHERE conditions without OR and XOR and the patterns
+    of MATCH clauses. The clauses are processed from the last to the first, so
+    nested ones are sorted before the clause that contains them."""
+    tokens = list(tokens)
+    for start in range(len(tokens) - 1, -1, -1):
+        if tokens[start] == ('keyword', 'WHERE'):
+            separator = AND
+            end = region_end(tokens, start + 1)
+            region = tokens[start + 1:end]
+            if len(split_top_level(region, ('keyword', 'OR'))) > 1 or len(split_top_level(region, ('keyword', 'XOR'))) > 1:
+                continue
+        elif tokens[start] == ('keyword', 'MATCH'):
+            separator = COMMA
+            end = region_end(tokens, start + 1, stop=('WHERE',))
+            region = tokens[start + 1:end]
+        else:
+            continue
+        parts = split_top_level(region, separator)
+        if len(parts) < 2 or not all(parts):
+            continue
+        parts.sort(key=sort_key)
+        region = parts[0]
+        for part in parts[1:]:
+            region = region + [separator] + part
+        tokens[start + 1:end] = region
+    return tokens
+
+def name_text(value):
+    if IDENTIFIER.match(value) and value.upper() not in KEYWORDS:
+        return value
+    return "`" + value.replace("`", "``") + "`"
+
+def join_tokens(tokens):
+    """Joins the tokens with single spaces, except inside brackets, around colons
+    and dots and between the nodes and relationships of a pattern."""
+    text = []
+    connector = False  # the previous token is an arrow of a pattern
+    for i, (kind, value) in enumerate(tokens):
+        previous = tokens[i - 1][1] if i else None
+        if value in ARROWS and (previous in (')', ']') or connector):
+            glued, connector = True, True
+        else:
+            glued = (connector or previous in ('(', '[', '{', '.', ':') or value in (')', ']', '}', ',', '.', ':')
+                     or value == '(' and (tokens[i - 1][0] == 'function' or previous in FUNCTION_KEYWORDS))
+            connector = False
+        if i and not glued:
+            text.append(" ")
+        text.append(name_text(value) if kind in ('name', 'variable') else value)
+    return "".join(text)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def canonical_query(query):
+    """Returns the canonical text of query (see the module docstring)."""
+    tokens = list(scan(query))
+    try:
+        names = query_variables(parse(query))
+    except CypherError:
+        return join_tokens(tokens)
+    tokens = mark_variables(tokens, names)
+    for _ in range(MAX_PASSES):
+        canonical = rename_variables(sort_commutative(tokens))
+        if canonical == tokens:
+            break
+        tokens = canonical
+    return join_tokens(tokens)
@@ -0,0 +1,99 @@
+"""Normalized Cypher token streams and a token-level similarity of two queries.
+
+The token stream ignores everything that does not change the query's meaning
+for a reader: whitespace and comments, the case of keywords and function
+names, the quote style and escapes of string literals, backticks around
+names and the spelling of numbers and of the inequality operator. Labels,
+relationship types, property keys and map keys keep their case even if they
+are spelled like a keyword, as Neo4j tells them apart by case. Any text that
+is not valid Cypher still yields tokens, so predictions never fail.
+"""
+import re
+from collections import Counter
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<number>\d+\.\d+(?:[eE][-+]?\d+)?|\d+[eE][-+]?\d+|\d+)
+  | (?P<name>[A-Za-z_][A-Za-z_0-9]*)
+  | (?P<quoted>`[^`]*`)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<param>\$[A-Za-z_0-9]+)
+  | (?P<op><>|!=|<=|>=|=~|->|<-|\.\.|[-+*/%^=<>()\[\]{},.:;|])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+KEYWORDS = {
+    'MATCH', 'OPTIONAL', 'WHERE', 'WITH', 'RETURN', 'UNWIND', 'AS', 'DISTINCT', 'ORDER', 'BY',
+    'SKIP', 'LIMIT', 'ASC', 'ASCENDING', 'DESC', 'DESCENDING', 'UNION', 'ALL', 'CALL', 'YIELD',
+    'CREATE', 'MERGE', 'DELETE', 'DETACH', 'SET', 'REMOVE', 'FOREACH', 'ON',
+    'AND', 'OR', 'XOR', 'NOT', 'IN', 'IS', 'NULL', 'TRUE', 'FALSE', 'CASE', 'WHEN', 'THEN',
+    'ELSE', 'END', 'EXISTS', 'STARTS', 'ENDS', 'CONTAINS', 'ANY', 'NONE', 'SINGLE',
+}
+
+# followed by a subquery in braces instead of a map
+SUBQUERY_KEYWORDS = {'EXISTS', 'CALL', 'COUNT', 'COLLECT'}
+
+OPENING_PARENTHESIS = re.compile(r"\s*\(")
+FOLLOWING_COLON = re.compile(r"\s*:(?!:)")
+
+def scan(query):
+    """Yields the (kind, normalized text) tokens of query. The kinds are keyword,
+    function, name, string, number, param, op and other."""
+    tokens = []
+    maps = []  # per open bracket, whether it is a map
+    label = False  # the next name is a label or relationship type: it follows their colon or a | between types
+    for m in TOKEN.finditer(query):
+        kind = m.lastgroup
+        value = m.group()
+        if kind == 'space':
+            continue
+        previous = tokens[-1] if tokens else ('', '')
+        is_label, label = label, False
+        if kind == 'name':
+            map_key = bool(maps) and maps[-1] and previous[1] in ('{', ',') and FOLLOWING_COLON.match(query, m.end())
+            upper = value.upper()
+            if is_label or map_key or previous == ('op', '.'):
+                pass  # labels, types and keys are case-sensitive
+            elif upper in KEYWORDS:
+                kind, value = 'keyword', upper
+            elif OPENING_PARENTHESIS.match(query, m.end()):  # function names are case-insensitive
+                kind, value = 'function', value.lower()
+        elif kind == 'quoted':
+            kind, value = 'name', value[1:-1]
+        elif kind == 'string':
+            value = value[1:-1]
+            if "\\" in value:
+                value = ESCAPE.sub(r"\1", value)
+            value = "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+        elif kind == 'number':
+            value = repr(float(value)) if ('.' in value or 'e' in value.lower()) else str(int(value))
+        elif value == '!=':
+            value = '<>'
+        elif kind == 'op' and value in ('(', '[', '{'):
+            maps.append(value == '{' and previous[1].upper() not in SUBQUERY_KEYWORDS)
+        elif kind == 'op' and value in (')', ']', '}') and maps:
+            maps.pop()
+        elif value == ':':
+            # the colon of a map key is no label colon
+            label = not (maps and maps[-1] and len(tokens) > 1 and tokens[-2][1] in ('{', ','))
+        elif value == '|':
+            label = previous[0] == 'name' and len(tokens) > 1 and tokens[-2][1] in (':', '|')
+        tokens.append((kind, value))
+        yield kind, value
+
+def cypher_tokens(query):
+    """Returns the normalized token stream of query as a list of strings."""
+    return [value for _, value in scan(query)]
+
+def token_overlap(reference_tokens, predicted_tokens):
+    """Returns the number of tokens the two streams have in common, counted as multisets."""
+    return sum((Counter(reference_tokens) & Counter(predicted_tokens)).values())
+
+def token_f1(overlap, reference_length, predicted_length):
+    """F1 of token precision (overlap / predicted) and recall (overlap / reference).
+    Summed counts of several pairs give the corpus-level F1."""
+    if reference_length == 0 and predicted_length == 0:
+        return 1.0
+    return 2 * overlap / (reference_length + predicted_length)
@@ -0,0 +1,71 @@
+"""Parser of key value strings, shared by the CQP and KVE evaluation scripts.
+
+A key value string lists the event log identifiers relevant for a rule, e.g.
+    Activity: ["Create Order", "Ship"], EntityType: [], Actor: ["R1"]
+Values may be double or single quoted (with backslash escapes), so commas,
+brackets and quotes inside a quoted value are kept. Unquoted values end at the
+next comma or closing bracket. Values of a list without its closing bracket
+are dropped.
+"""
+import re
+
+KEYS = ("Activity", "EntityType", "Actor")
+
+# One left-to-right scan: every match opens a list, is one of its items, or closes it.
+# Anything in between (separators, whitespace, stray text) is skipped.
+TOKEN = re.compile(r"""
+      (?P<key>[^\s:,\[\]"']+)\s*:\s*\[             # Key: [
+    | "(?P<dq>(?:[^"\\]|\\.)*)"                    # "double quoted"
+    | '(?P<sq>(?:[^'\\]|\\.)*)'                    # 'single quoted'
+    | (?P<close>\])
+    | (?P<bare>[^\s,\[\]"'][^,\]]*?)(?=\s*[,\]])   # unquoted
+""", re.VERBOSE | re.DOTALL)
+
+ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+
+def parse_key_values(kv_string, keys=None):
+    """Parses a key value string into a dict of value lists. With keys, the
+    result has exactly these keys (missing ones as empty lists, others are
+    dropped); otherwise it has every key of the string."""
+    result = {key: [] for key in keys} if keys else {}
+    if not isinstance(kv_string, str):  # NaN for an empty cell in pandas
+        return result
+
+    # Items are kept once their list is closed; a list left open (by a
+    # truncated prediction, or by the next key) contributes no values.
+    key = values = None
+    for match in TOKEN.finditer(kv_string):
+        kind = match.lastgroup
+        if kind == "key":
+            key = match.group("key")
+            values = None if keys and key not in result else []  # items of an unknown key are skipped
+        elif kind == "close":
+            if values is not None:
+                result.setdefault(key, []).extend(values)
+            values = None
+        elif values is not None:
+            value = match.group(kind)
+            if kind != "bare" and "\\" in value:
+                value = ESCAPE.sub(r"\1", value)
+            values.append(value)
+    return result
+
+def parse_key_values_column(column, keys=None):
+    """Parses a column (list, pandas Series, ...) of key value strings. Every
+    distinct string is parsed once; equal strings share their result dict,
+    which therefore must not be modified."""
+    parsed = {}
+    results = []
+    for kv_string in column:
+        if not isinstance(kv_string, str):
+            results.append(parse_key_values(kv_string, keys))
+            continue
+        result = parsed.get(kv_string)
+        if result is None:
+            result = parsed[kv_string] = parse_key_values(kv_string, keys)
+        results.append(result)
+    return results
+
+def contains_all_key_values(query, key_values_dict):
+    """Checks if all values from key_values_dict appear in the query."""
+    return all(value in query for values in key_values_dict.values() for value in values)
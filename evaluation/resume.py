@@ -0,0 +1,65 @@
+"""Resuming interrupted inference runs.
+
+The inference scripts append one prediction per rule to their predictions
+file, so a run that is interrupted leaves the rules predicted so far, and
+possibly a last line that was cut off while it was written.
+"""
+import csv
+import io
+import os
+
+def read_complete_rows(text, columns):
+    """Returns the records of CSV text after its header, and the length of the
+    text they span. A last record cut off by an interruption (no line end, an
+    open quote or missing fields) is left out."""
+    lines = io.StringIO(text, newline='').readlines()
+    consumed = 0
+    def feed():
+        nonlocal consumed
+        for line in lines:
+            consumed += len(line)
+            yield line
+
+    rows = []
+    end = 0
+    reader = csv.reader(feed(), strict=True)
+    try:
+        header = next(reader, None)
+        if header != columns:
+            return None, 0
+        end = consumed
+        for row in reader:
+            if text[consumed - 1] != '\n' or len(row) != len(columns):
+                break
+            rows.append(row)
+            end = consumed
+    except csv.Error:  # end of data inside a quoted field
+        pass
+    return rows, end
+
+def resume_predictions(predictions_file, validation_dataset, columns):
+    """Returns the number of rules of validation_dataset that an interrupted run
+    already predicted in predictions_file, so the run continues after them.
+    A cut-off last line is removed from the file, so its rule is predicted
+    again. Without a predictions file, it is created with the header columns."""
+    if not os.path.exists(predictions_file) or os.path.getsize(predictions_file) == 0:
+        with open(predictions_file, 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f, lineterminator=os.linesep).writerow(columns)  # as pandas' to_csv appends the rows
+        return 0
+
+    with open(predictions_file, newline='', encoding='utf-8') as f:
+        text = f.read()
+    rows, end = read_complete_rows(text, columns)
+    if rows is None:
+        raise ValueError(f"{predictions_file} does not have the columns {columns}. Remove it to start over.")
+    predicted = [row[0] for row in rows]  # the NL input column comes first
+    expected = [str(rule) for rule in validation_dataset['NL input'][:len(rows)]]
+    if len(rows) > len(validation_dataset) or predicted != expected:
+        raise ValueError(f"{predictions_file} does not belong to this validation set. Remove it to start over.")
+
+    if end < len(text):
+        with open(predictions_file, 'w', newline='', encoding='utf-8') as f:
+            f.write(text[:end])
+        print(f"Removed a partial last line from {predictions_file}")
+    print(f"Resuming after {len(rows)} predicted rows in {predictions_file}")
+    return len(rows)
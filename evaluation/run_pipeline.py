@@ -0,0 +1,239 @@
+"""Runs the evaluation scripts as a graph of stages with cached outputs.
+
+    kve_inference --> kve_score
+    cqp_inference --> bleu
+                  \\-> execution
+
+Every stage output is stored under a hash of everything it is computed from:
+the content of its input files (validation set, upstream outputs, LoRA
+adapter, local EKG), the source of its script (prompt template and
+configuration constants) and of the shared modules it uses, and its CLI
+parameters. A Neo4j EKG is identified by its fingerprint (node count per
+label, relationship count per type and GRAPH_VERSION), so a reloaded
+database does not reuse the outputs of the previous graph. A stage whose
+hash already has an output is not run again, so only the stages with
+changed inputs are recomputed.
+
+    python run_pipeline.py --validation-set validation_sets/CL_supported.csv \\
+        --cqp-model fine-tuned --adapter ../fine-tuning/lora_adapters/7B bleu execution
+
+With --predictions (or --kve-predictions) an existing predictions file is
+used instead of running the inference stage.
+"""
+import argparse
+import hashlib
+import importlib.util
+import json
+import os
+import sys
+import time
+
+EVALUATION_DIR = os.path.dirname(os.path.abspath(__file__))
+ARTIFACTS_DIR = os.path.join(EVALUATION_DIR, "artifacts")
+
+CQP_SCRIPTS = {
+    "fine-tuned": "CQP/fine-tuned_model_inference_to_csv.py",
+    "few-shot": "CQP/few_shot_baseline_inference_to_csv.py",
+    "text2cypher": "CQP/text2cypher_baseline_inference_to_csv.py",
+}
+
+class Stage:
+    def __init__(self, name, script, inputs, output, run, shared=()):
+        self.name = name
+        self.script = script  # path relative to EVALUATION_DIR, or a function of the CLI arguments
+        self.inputs = inputs  # names of the source files or upstream outputs the stage reads
+        self.output = output  # name of the file the stage produces
+        self.run = run  # run(module, args, inputs, output_file)
+        self.shared = shared  # modules the script imports, relative to EVALUATION_DIR
+
+    def script_path(self, args):
+        script = self.script(args) if callable(self.script) else self.script
+        return os.path.join(EVALUATION_DIR, script)
+
+def run_kve_inference(module, args, inputs, output_file):
+    if inputs["available_key_values"]:
+        with open(inputs["available_key_values"], encoding='utf-8') as f:
+            module.predict_key_values(inputs["validation_set"], output_file, available_key_values=f.read())
+    else:
+        module.predict_key_values(inputs["validation_set"], output_file)
+
+def run_cqp_inference(module, args, inputs, output_file):
+    if args.cqp_model == "fine-tuned":
+        if not inputs["adapter"]:
+            raise ValueError("The fine-tuned model needs --adapter")
+        module.predict_queries(inputs["validation_set"], output_file, inputs["adapter"])
+    else:
+        module.predict_queries(inputs["validation_set"], output_file)
+
+def run_bleu(module, args, inputs, output_file):
+    module.calculate_bleu_scores(inputs["validation_set"], inputs["predictions"], output_file)
+
+def run_execution(module, args, inputs, output_file):
+    module.LOCAL_EKG = inputs["graph"] if args.local_ekg else None
+    module.compare_and_save_results(inputs["validation_set"], inputs["predictions"], output_file, database=args.database)
+
+def run_kve_score(module, args, inputs, output_file):
+    module.evaluate_key_extraction(inputs["validation_set"], inputs["kve_predictions"], output_file)
+
+STAGES = {stage.name: stage for stage in [
+    Stage("kve_inference", "KVE/kve_inference_to_csv.py", ("validation_set", "available_key_values"),
+          "kve_predictions", run_kve_inference),
+    Stage("cqp_inference", lambda args: CQP_SCRIPTS[args.cqp_model], ("validation_set", "adapter"),
+          "predictions", run_cqp_inference),
+    Stage("bleu", "CQP/translation_based.py", ("validation_set", "predictions"),
+          "bleu_results", run_bleu, shared=("cypher_tokens.py", "cypher_canonical.py", "../ocel_to_ekg/ekg_cypher.py")),
+    Stage("execution", "CQP/execution_based.py", ("validation_set", "predictions", "graph"),
+          "execution_results", run_execution,
+          shared=("key_values.py", "cypher_tokens.py", "cypher_canonical.py",
+                  "../ocel_to_ekg/ekg_local.py", "../ocel_to_ekg/ekg_cypher.py", "../ocel_to_ekg/ekg_model.py")),
+    Stage("kve_score", "KVE/kve_evaluation.py", ("validation_set", "kve_predictions"),
+          "kve_results", run_kve_score, shared=("key_values.py",)),
+]}
+PRODUCERS = {stage.output: stage for stage in STAGES.values()}
+
+# Content hashes
+def hash_path(path):
+    """Hashes the content of a file, or of all files of a directory with their relative paths."""
+    digest = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                digest.update(os.path.relpath(file_path, path).encode())
+                digest.update(hash_path(file_path).encode())
+    else:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+def stage_params(stage, args):
+    """CLI parameters that change the output of a stage besides its input files."""
+    if stage.name == "cqp_inference":
+        return {"cqp_model": args.cqp_model}
+    if stage.name == "execution":
+        return {"database": args.database, "local_ekg": bool(args.local_ekg)}
+    return {}
+
+class Runner:
+    def __init__(self, args):
+        self.args = args
+        self.sources = {
+            "validation_set": args.validation_set,
+            "available_key_values": args.available_key_values,
+            "adapter": args.adapter,
+            "graph": args.local_ekg,  # a Neo4j graph is identified by neo4j_fingerprint()
+            "predictions": args.predictions,
+            "kve_predictions": args.kve_predictions,
+        }
+        self.hashes = {}
+        self.graph_fingerprint = None
+        self.outputs = {}  # stage name -> output file
+        self.report = []
+
+    def content_hash(self, path):
+        if not os.path.exists(path):  # output of a stale stage in a dry run
+            return None
+        if path not in self.hashes:
+            self.hashes[path] = hash_path(path)
+        return self.hashes[path]
+
+    def resolve(self, name):
+        """Returns the file of a stage input: a given source, or the (cached) output of its producer."""
+        if self.sources.get(name) is not None or name not in PRODUCERS:
+            return self.sources.get(name)
+        return self.build(PRODUCERS[name])
+
+    def neo4j_fingerprint(self):
+        """Returns the fingerprint of the Neo4j graph the execution stage runs on,
+        as its GT cache computes it: URI, database, GRAPH_VERSION and counts."""
+        if self.graph_fingerprint is None:
+            module = load_script(STAGES["execution"].script_path(self.args))
+            executor = module.Neo4jExecutor(module.NEO4J_URI, module.NEO4J_USER, module.NEO4J_PASSWORD,
+                                            pool_size=1, database=self.args.database)
+            try:
+                self.graph_fingerprint = {"uri": module.NEO4J_URI, "database": self.args.database,
+                                          "version": module.GRAPH_VERSION, **executor.fingerprint()}
+            finally:
+                executor.close()
+        return self.graph_fingerprint
+
+    def key(self, stage, inputs):
+        script = stage.script_path(self.args)
+        description = {
+            "stage": stage.name,
+            "code": {os.path.relpath(path, EVALUATION_DIR): self.content_hash(path)
+                     for path in [script] + [os.path.join(EVALUATION_DIR, m) for m in stage.shared]},
+            "inputs": {name: path and self.content_hash(path) for name, path in inputs.items()},
+            "params": stage_params(stage, self.args),
+        }
+        if "graph" in stage.inputs and not inputs["graph"]:
+            description["neo4j_graph"] = self.neo4j_fingerprint()
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:16], description
+
+    def build(self, stage):
+        if stage.name in self.outputs:
+            return self.outputs[stage.name]
+        inputs = {name: self.resolve(name) for name in stage.inputs}
+        key, description = self.key(stage, inputs)
+        artifact_dir = os.path.join(self.args.artifacts, stage.name, key)
+        output_file = os.path.join(artifact_dir, stage.output + ".csv")
+
+        start = time.time()
+        if os.path.exists(output_file) and stage.name not in self.args.force:
+            status = "cached"
+        elif self.args.dry_run:
+            status = "stale"
+        else:
+            print(f"\n=== {stage.name} ({key}) ===")
+            os.makedirs(artifact_dir, exist_ok=True)
+            # written to a partial file first: an interrupted stage is resumed on the next run
+            # and never mistaken for a finished one
+            partial_file = os.path.join(artifact_dir, stage.output + ".partial.csv")
+            stage.run(load_script(stage.script_path(self.args)), self.args, inputs, partial_file)
+            os.replace(partial_file, output_file)
+            with open(os.path.join(artifact_dir, "stage.json"), 'w', encoding='utf-8') as f:
+                json.dump({**description, "input_files": inputs, "created": time.strftime("%Y-%m-%d %H:%M:%S")}, f, indent=1)
+            status = "ran"
+        self.report.append((stage.name, status, key, output_file, time.time() - start))
+        self.outputs[stage.name] = output_file
+        return output_file
+
+def load_script(path):
+    """Imports a script by path; the inference scripts' file names are no module names."""
+    name = os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+    sys.path.insert(0, os.path.dirname(path))
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module  # the worker processes of translation_based import it by name
+    spec.loader.exec_module(module)
+    return module
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("targets", nargs="+", choices=list(STAGES), help="stages to bring up to date, with their upstream stages")
+    parser.add_argument("--validation-set", required=True, help="validation set CSV (NL input, Key Values, Cypher Query)")
+    parser.add_argument("--cqp-model", choices=list(CQP_SCRIPTS), default="fine-tuned", help="model of the cqp_inference stage")
+    parser.add_argument("--adapter", help="LoRA adapter folder of the fine-tuned model")
+    parser.add_argument("--available-key-values", help="text file with the available key values for the KVE prompt")
+    parser.add_argument("--predictions", help="existing CQP predictions file, replaces the cqp_inference stage")
+    parser.add_argument("--kve-predictions", help="existing KVE predictions file, replaces the kve_inference stage")
+    parser.add_argument("--local-ekg", help="EKG bulk-import directory or OCEL file to execute the queries on instead of Neo4j")
+    parser.add_argument("--database", help="Neo4j database of the EKG, default: the server's default database")
+    parser.add_argument("--artifacts", default=ARTIFACTS_DIR, help="directory of the stage outputs")
+    parser.add_argument("--force", nargs="*", default=[], choices=list(STAGES), help="rerun these stages even if cached")
+    parser.add_argument("--dry-run", action="store_true", help="only report which stages are cached and which are stale")
+    args = parser.parse_args(argv)
+
+    runner = Runner(args)
+    for target in args.targets:
+        runner.build(STAGES[target])
+
+    print(f"\n{'Stage':<15}{'Status':<8}{'Key':<18}{'Time':>9}  Output")
+    for name, status, key, output_file, elapsed in runner.report:
+        print(f"{name:<15}{status:<8}{key:<18}{elapsed:>8.1f}s  {os.path.relpath(output_file)}")
+    return runner.outputs
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,21 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig, BitsAndBytesConfig
 import gradio as gr
 import os
-from neo4j_connector import Neo4jConnector
+from neo4j_connector import Neo4jConnector, LocalEKGConnector
 from mistral_base_model import MistralBaseModel
 from mistral_ft_model import MistralFtModel
 
 os.environ["HF_TOKEN"] = "YOUR_HF_TOKEN" # fill in your HF token
+LOCAL_EKG = None # EKG bulk-import directory or OCEL 2.0 file to query in-process instead of Neo4j
 identifiers= ""
-mistral_base_model = MistralBaseModel()
-mistral_ft_model = MistralFtModel()
+# loaded when the app is launched, so the pipeline below can be imported and run with other models (benchmarks/fake_models.py)
+mistral_base_model = None
+mistral_ft_model = None
+local_connector = LocalEKGConnector(LOCAL_EKG) if LOCAL_EKG else None
 
 
 def get_query_result(query:str):
+	if local_connector:
+		return local_connector.execute_query(query)
 	connector = Neo4jConnector("bolt://localhost:7687", "neo4j", "12341234") # fill in connection details
 	results = connector.execute_query(query)
 	connector.close()
@@ -153,6 +157,9 @@ with gr.Blocks() as app:
 			generate_btn = gr.Button("Generate Answer")
 			generate_btn.click(correct_error, inputs=[user_request, error_message], outputs=answer_output)
 
-# Launch the app with public sharing
-app.launch(share=True)
+if __name__ == "__main__":
+	mistral_base_model = MistralBaseModel()
+	mistral_ft_model = MistralFtModel()
+	# Launch the app with public sharing
+	app.launch(share=True)
 
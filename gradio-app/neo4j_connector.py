@@ -1,6 +1,12 @@
+import os
+import sys
 from neo4j import GraphDatabase
 from neo4j.exceptions import CypherSyntaxError, Neo4jError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "ocel_to_ekg"))
+from ekg_cypher import CypherError
+from ekg_local import load_ekg
+
 class Neo4jConnector:
     def __init__(self, uri, user, password):
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
@@ -20,3 +26,23 @@ class Neo4jConnector:
         except Exception as e:
             return {"error": f"Unexpected error: {e}"}
 
+class LocalEKGConnector:
+    """Neo4jConnector stand-in that answers queries from an EKG held in memory
+    (ocel_to_ekg/ekg_local.py), loaded from a bulk-import directory or OCEL file.
+    Queries running longer than timeout seconds are aborted with an error."""
+    def __init__(self, path, timeout=None):
+        self.graph = load_ekg(path)
+        self.timeout = timeout
+
+    def close(self):
+        pass
+
+    def execute_query(self, query, parameters=None):
+        if parameters:
+            return {"error": "Unexpected error: query parameters are not supported by the local EKG"}
+        try:
+            return list(self.graph.run(query, timeout=self.timeout))
+        except CypherError as e:
+            return {"error": f"Cypher error: {e}"}
+        except Exception as e:
+            return {"error": f"Unexpected error: {e}"}
@@ -0,0 +1,76 @@
+import os
+import pandas as pd
+from ekg_model import (lbl_event, lbl_entity, lbl_rel, lbl_corr, lbl_df,
+                       event_rows, entity_rows, rel_rows, corr_rows, df_rows)
+
+# Writes an EKG as header+data CSV files in the format consumed by
+# `neo4j-admin database import full`, as an offline alternative to the
+# transactional load in ocel_to_ekg.py.
+
+def neo4j_type(col):
+    """Returns the neo4j-admin header type of a typed entity attribute column."""
+    if pd.api.types.is_bool_dtype(col):
+        return ':boolean'
+    if pd.api.types.is_integer_dtype(col):
+        return ':long'
+    if pd.api.types.is_float_dtype(col):
+        return ':double'
+    if pd.api.types.is_datetime64_any_dtype(col):
+        return ':datetime'
+    return ''
+
+def write_csv(out_dir, name, header, rows, chunk_size):
+    """Writes the header file and streams rows to the data file in chunks of chunk_size."""
+    header_path = os.path.join(out_dir, name + '_header.csv')
+    data_path = os.path.join(out_dir, name + '.csv')
+    rows.iloc[:0].set_axis(header, axis=1).to_csv(header_path, index=False)
+    with open(data_path, 'w', newline='', encoding='utf-8') as f:
+        for start in range(0, len(rows), chunk_size):
+            rows.iloc[start:start + chunk_size].to_csv(f, header=False, index=False)
+    return header_path, data_path
+
+def export_bulk_import(ocel, out_dir, chunk_size=100000):
+    """Exports Event/Entity nodes and REL/CORR/DF relationships of ocel to out_dir.
+    Returns the neo4j-admin arguments that import the written files."""
+    os.makedirs(out_dir, exist_ok=True)
+
+    events = event_rows(ocel)
+    events[':LABEL'] = lbl_event
+    events_files = write_csv(out_dir, 'events',
+        ['EventID:ID(' + lbl_event + ')', 'timestamp:datetime', 'Activity', ':LABEL'],
+        events, chunk_size)
+    del events
+
+    entities = entity_rows(ocel)
+    header = ['ID:ID(' + lbl_entity + ')' if c == 'ID' else c + neo4j_type(entities[c]) for c in entities.columns]
+    for c in entities.columns:
+        if pd.api.types.is_datetime64_any_dtype(entities[c]):
+            entities[c] = entities[c].map(lambda t: t.isoformat() if pd.notna(t) else None)
+    entities[':LABEL'] = lbl_entity
+    entities_files = write_csv(out_dir, 'entities', header + [':LABEL'], entities, chunk_size)
+    del entities
+
+    rel = rel_rows(ocel)
+    rel[':TYPE'] = lbl_rel
+    rel_files = write_csv(out_dir, 'rel',
+        [':START_ID(' + lbl_entity + ')', ':END_ID(' + lbl_entity + ')', 'qual', ':TYPE'],
+        rel, chunk_size)
+    del rel
+
+    corr = corr_rows(ocel)
+    corr[':TYPE'] = lbl_corr
+    corr_files = write_csv(out_dir, 'corr',
+        [':START_ID(' + lbl_event + ')', ':END_ID(' + lbl_entity + ')', ':TYPE'],
+        corr, chunk_size)
+    del corr
+
+    df = df_rows(ocel)
+    df[':TYPE'] = lbl_df
+    df_files = write_csv(out_dir, 'df',
+        [':START_ID(' + lbl_event + ')', ':END_ID(' + lbl_event + ')', 'EntityType', 'EntityID', ':TYPE'],
+        df, chunk_size)
+    del df
+
+    args = ['--nodes=' + ','.join(files) for files in (events_files, entities_files)]
+    args += ['--relationships=' + ','.join(files) for files in (rel_files, corr_files, df_files)]
+    return args
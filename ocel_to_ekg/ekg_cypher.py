@@ -0,0 +1,765 @@
+import re
+
+# Parser for the read-only Cypher subset used by the EKG rule queries (see
+# data/data_collection.csv). It turns a query into a small tuple-based syntax
+# tree that ekg_local.py evaluates in-process, without a Neo4j server.
+#
+# Expressions are tuples whose first element is the node kind, e.g.
+# ('prop', ('var', 'e'), 'timestamp') for e.timestamp. Patterns are
+# ('path', nodes, rels) with nodes (var, labels, props) and rels
+# (var, types, props, direction, length); clauses are
+# ('match', optional, paths, where), ('unwind', expr, var),
+# ('with', projection, where) and ('return', projection).
+
+class CypherError(Exception):
+    """Raised for queries that are invalid or outside the supported subset."""
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<number>\d+\.\d+(?:[eE][-+]?\d+)?|\d+[eE][-+]?\d+|\d+)
+  | (?P<name>[A-Za-z_][A-Za-z_0-9]*|`[^`]+`)
+  | (?P<string>'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")
+  | (?P<param>\$[A-Za-z_0-9]+)
+  | (?P<op><>|<=|>=|!=|=~|\.\.|[-+*/%^=<>()\[\]{},.:;|])
+""", re.VERBOSE | re.DOTALL)
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', 'b': '\b', 'f': '\f', '\\': '\\', "'": "'", '"': '"'}
+
+AGGREGATES = {'count', 'collect', 'sum', 'avg', 'min', 'max', 'stdev', 'stdevp',
+              'percentilecont', 'percentiledisc'}
+
+# keywords that end an expression, so a preceding CASE is a variable named case
+FOLLOW_KEYWORDS = {'AS', 'AND', 'OR', 'XOR', 'IN', 'IS', 'WHERE', 'RETURN', 'WITH', 'ORDER',
+                   'SKIP', 'LIMIT', 'MATCH', 'OPTIONAL', 'UNWIND', 'UNION', 'THEN', 'ELSE',
+                   'END', 'CONTAINS', 'STARTS', 'ENDS', 'ASC', 'DESC', 'ASCENDING', 'DESCENDING'}
+
+def unescape(s):
+    return re.sub(r'\\(u[0-9a-fA-F]{4}|.)',
+                  lambda m: chr(int(m.group(1)[1:], 16)) if m.group(1)[0] == 'u' and len(m.group(1)) == 5
+                  else ESCAPES.get(m.group(1), m.group(1)), s)
+
+def tokenize(query):
+    """Returns the (kind, value, start, end) tokens of query, ending with an 'eof' token."""
+    tokens = []
+    pos = 0
+    while pos < len(query):
+        m = TOKEN.match(query, pos)
+        if not m:
+            raise CypherError(f"Invalid input '{query[pos]}' (offset: {pos})")
+        kind = m.lastgroup
+        if kind != 'space':
+            value = m.group()
+            if kind == 'string':
+                value = unescape(value[1:-1])
+            elif kind == 'number':
+                value = float(value) if ('.' in value or 'e' in value.lower()) else int(value)
+            elif kind == 'name' and value.startswith('`'):
+                kind, value = 'quoted', value[1:-1]
+            elif kind == 'param':
+                value = value[1:]
+            tokens.append((kind, value, m.start(), m.end()))
+        pos = m.end()
+    tokens.append(('eof', None, len(query), len(query)))
+    return tokens
+
+class Parser:
+    def __init__(self, query):
+        self.query = query
+        self.tokens = tokenize(query)
+        self.i = 0
+
+    # token helpers
+
+    def peek(self, offset=0):
+        return self.tokens[min(self.i + offset, len(self.tokens) - 1)]
+
+    def error(self, expected=None):
+        kind, value, start, _ = self.peek()
+        found = 'end of input' if kind == 'eof' else self.query[start:self.peek()[3]]
+        message = f"Invalid input '{found}' (offset: {start})"
+        if expected:
+            message += f": expected {expected}"
+        return CypherError(message)
+
+    def is_op(self, op, offset=0):
+        kind, value, _, _ = self.peek(offset)
+        return kind == 'op' and value == op
+
+    def is_kw(self, *words, offset=0):
+        kind, value, _, _ = self.peek(offset)
+        return kind == 'name' and value.upper() in words
+
+    def accept_op(self, op):
+        if self.is_op(op):
+            self.i += 1
+            return True
+        return False
+
+    def accept_kw(self, *words):
+        if self.is_kw(*words):
+            self.i += 1
+            return True
+        return False
+
+    def expect_op(self, op):
+        if not self.accept_op(op):
+            raise self.error(f"'{op}'")
+
+    def expect_kw(self, word):
+        if not self.accept_kw(word):
+            raise self.error(word)
+
+    def name(self):
+        kind, value, _, _ = self.peek()
+        if kind not in ('name', 'quoted'):
+            raise self.error('an identifier')
+        self.i += 1
+        return value
+
+    # query structure
+
+    def parse(self):
+        """Returns ('union', [clause lists], [UNION ALL flags]) for the whole query."""
+        parts = [self.single_query()]
+        all_flags = []
+        while self.accept_kw('UNION'):
+            all_flags.append(self.accept_kw('ALL'))
+            parts.append(self.single_query())
+        self.accept_op(';')
+        if self.peek()[0] != 'eof':
+            raise self.error()
+        for clauses in parts:
+            if clauses[-1][0] != 'return':
+                raise CypherError("Query cannot conclude with " + clauses[-1][0].upper() +
+                                  " (must be a RETURN clause)")
+        return ('union', parts, all_flags)
+
+    def single_query(self):
+        clauses = []
+        while True:
+            if self.accept_kw('MATCH'):
+                clauses.append(self.match(False))
+            elif self.is_kw('OPTIONAL') and self.is_kw('MATCH', offset=1):
+                self.i += 2
+                clauses.append(self.match(True))
+            elif self.accept_kw('UNWIND'):
+                expr = self.expression()
+                self.expect_kw('AS')
+                clauses.append(('unwind', expr, self.name()))
+            elif self.accept_kw('WITH'):
+                projection = self.projection(aliased=True)
+                where = self.expression() if self.accept_kw('WHERE') else None
+                clauses.append(('with', projection, where))
+            elif self.accept_kw('RETURN'):
+                clauses.append(('return', self.projection()))
+                break
+            elif self.is_kw('CREATE', 'MERGE', 'DELETE', 'DETACH', 'SET', 'REMOVE', 'CALL', 'FOREACH', 'LOAD'):
+                raise CypherError(f"{self.peek()[1].upper()} is not supported by the in-process EKG backend "
+                                  "(read-only queries only)")
+            else:
+                break
+        if not clauses:
+            raise self.error("MATCH, OPTIONAL MATCH, UNWIND, WITH or RETURN")
+        return clauses
+
+    def match(self, optional):
+        paths = [self.path()]
+        while self.accept_op(','):
+            paths.append(self.path())
+        where = self.expression() if self.accept_kw('WHERE') else None
+        return ('match', optional, paths, where)
+
+    def projection(self, aliased=False):
+        """Parses the body of WITH/RETURN into a dict with distinct, items
+        ([(expr, alias)] or '*'), order ([(expr, descending)]), skip and limit.
+        With aliased, expressions other than variables need an alias (WITH)."""
+        distinct = self.accept_kw('DISTINCT')
+        if self.accept_op('*'):
+            items = '*'
+        else:
+            items = [self.item(aliased)]
+            while self.accept_op(','):
+                items.append(self.item(aliased))
+        order = []
+        if self.accept_kw('ORDER'):
+            self.expect_kw('BY')
+            while True:
+                expr = self.expression()
+                descending = False
+                if self.accept_kw('DESC', 'DESCENDING'):
+                    descending = True
+                else:
+                    self.accept_kw('ASC', 'ASCENDING')
+                order.append((expr, descending))
+                if not self.accept_op(','):
+                    break
+        skip = self.expression() if self.accept_kw('SKIP') else None
+        limit = self.expression() if self.accept_kw('LIMIT') else None
+        return {'distinct': distinct, 'items': items, 'order': order, 'skip': skip, 'limit': limit}
+
+    def item(self, aliased):
+        start = self.peek()[2]
+        expr = self.expression()
+        if self.accept_kw('AS'):
+            return expr, self.name()
+        if aliased and expr[0] != 'var':
+            raise CypherError("Expression in WITH must be aliased (use AS) (offset: " + str(start) + ")")
+        # unaliased items are named after their source text, like in Neo4j
+        return expr, self.query[start:self.tokens[self.i - 1][3]]
+
+    # patterns
+
+    def path(self):
+        if self.peek()[0] in ('name', 'quoted') and self.is_op('=', offset=1):
+            raise CypherError("Named paths are not supported by the in-process EKG backend")
+        nodes = [self.node()]
+        rels = []
+        while self.is_op('-') or (self.is_op('<') and self.is_op('-', offset=1)):
+            rels.append(self.relationship())
+            nodes.append(self.node())
+        return ('path', nodes, rels)
+
+    def node(self):
+        self.expect_op('(')
+        var = None
+        if self.peek()[0] in ('name', 'quoted'):
+            var = self.name()
+        labels = []
+        while self.accept_op(':'):
+            labels.append(self.name())
+        props = self.map_literal() if self.is_op('{') else None
+        self.expect_op(')')
+        return (var, tuple(labels), props)
+
+    def relationship(self):
+        incoming = self.accept_op('<')
+        self.expect_op('-')
+        var, types, props, length = None, (), None, None
+        if self.accept_op('['):
+            if self.peek()[0] in ('name', 'quoted'):
+                var = self.name()
+            if self.accept_op(':'):
+                types = [self.name()]
+                while self.accept_op('|'):
+                    self.accept_op(':')
+                    types.append(self.name())
+                types = tuple(types)
+            if self.accept_op('*'):
+                low = self.peek()[1] if self.peek()[0] == 'number' else None
+                if low is not None:
+                    self.i += 1
+                if self.accept_op('..'):
+                    high = self.peek()[1] if self.peek()[0] == 'number' else None
+                    if high is not None:
+                        self.i += 1
+                    length = (1 if low is None else low, high)
+                else:
+                    length = (1, None) if low is None else (low, low)
+            if self.is_op('{'):
+                props = self.map_literal()
+            self.expect_op(']')
+        self.expect_op('-')
+        outgoing = self.accept_op('>')
+        if incoming and outgoing:
+            direction = 'both'
+        else:
+            direction = 'in' if incoming else 'out' if outgoing else 'both'
+        return (var, types, props, direction, length)
+
+    def try_pattern(self):
+        """Parses a path with at least one relationship at the current position,
+        or rewinds and returns None if there is none."""
+        start = self.i
+        try:
+            path = self.path()
+        except CypherError:
+            self.i = start
+            return None
+        if not path[2]:
+            self.i = start
+            return None
+        return path
+
+    # expressions, from the lowest to the highest precedence
+
+    def expression(self):
+        left = self.xor_expr()
+        while self.accept_kw('OR'):
+            left = ('or', left, self.xor_expr())
+        return left
+
+    def xor_expr(self):
+        left = self.and_expr()
+        while self.accept_kw('XOR'):
+            left = ('xor', left, self.and_expr())
+        return left
+
+    def and_expr(self):
+        left = self.not_expr()
+        while self.accept_kw('AND'):
+            left = ('and', left, self.not_expr())
+        return left
+
+    def not_expr(self):
+        if self.accept_kw('NOT'):
+            return ('not', self.not_expr())
+        return self.comparison()
+
+    def comparison(self):
+        left = self.predicate()
+        parts = []
+        while self.peek()[0] == 'op' and self.peek()[1] in ('=', '<>', '!=', '<', '>', '<=', '>='):
+            op = self.peek()[1]
+            if op == '!=':
+                raise self.error("'<>' for inequality")
+            self.i += 1
+            if self.is_op('='):
+                raise self.error('an expression')
+            right = self.predicate()
+            parts.append(('cmp', op, left, right))
+            left = right
+        if not parts:
+            return left
+        # a < b < c means a < b AND b < c
+        result = parts[0]
+        for part in parts[1:]:
+            result = ('and', result, part)
+        return result
+
+    def predicate(self):
+        left = self.additive()
+        while True:
+            if self.is_kw('IS'):
+                self.i += 1
+                negated = self.accept_kw('NOT')
+                self.expect_kw('NULL')
+                left = ('isnull', left, negated)
+            elif self.accept_kw('IN'):
+                left = ('in', left, self.additive())
+            elif self.is_kw('STARTS', 'ENDS') and self.is_kw('WITH', offset=1):
+                op = self.peek()[1].upper()
+                self.i += 2
+                left = ('strop', op, left, self.additive())
+            elif self.accept_kw('CONTAINS'):
+                left = ('strop', 'CONTAINS', left, self.additive())
+            elif self.accept_op('=~'):
+                left = ('strop', 'REGEX', left, self.additive())
+            else:
+                return left
+
+    def additive(self):
+        left = self.multiplicative()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('+', '-'):
+            op = self.peek()[1]
+            self.i += 1
+            left = ('arith', op, left, self.multiplicative())
+        return left
+
+    def multiplicative(self):
+        left = self.power()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('*', '/', '%'):
+            op = self.peek()[1]
+            self.i += 1
+            left = ('arith', op, left, self.power())
+        return left
+
+    def power(self):
+        left = self.unary()
+        while self.accept_op('^'):
+            left = ('arith', '^', left, self.unary())
+        return left
+
+    def unary(self):
+        if self.accept_op('-'):
+            return ('neg', self.unary())
+        if self.accept_op('+'):
+            return self.unary()
+        return self.postfix()
+
+    def postfix(self):
+        expr = self.atom()
+        while True:
+            if self.is_op('.') and self.peek(1)[0] in ('name', 'quoted'):
+                self.i += 1
+                expr = ('prop', expr, self.name())
+            elif self.is_op('['):
+                self.i += 1
+                low = None if self.is_op('..') else self.expression()
+                if self.accept_op('..'):
+                    high = None if self.is_op(']') else self.expression()
+                    self.expect_op(']')
+                    expr = ('slice', expr, low, high)
+                else:
+                    self.expect_op(']')
+                    expr = ('index', expr, low)
+            elif self.is_op(':') and expr[0] == 'var' and self.peek(1)[0] in ('name', 'quoted'):
+                labels = []
+                while self.accept_op(':'):
+                    labels.append(self.name())
+                expr = ('haslabel', expr, tuple(labels))
+            else:
+                return expr
+
+    def atom(self):
+        kind, value, start, _ = self.peek()
+        if kind == 'number':
+            self.i += 1
+            return ('lit', value)
+        if kind == 'string':
+            self.i += 1
+            return ('lit', value)
+        if kind == 'param':
+            raise CypherError(f"Expected parameter(s): {value}")
+        if kind == 'op':
+            if value == '(':
+                pattern = self.try_pattern()
+                if pattern is not None:
+                    return ('patpred', pattern)
+                self.i += 1
+                expr = self.expression()
+                self.expect_op(')')
+                return expr
+            if value == '[':
+                return self.list_expr()
+            if value == '{':
+                return self.map_literal()
+            raise self.error('an expression')
+        if kind == 'quoted':
+            self.i += 1
+            return ('var', value)
+        if kind != 'name':
+            raise self.error('an expression')
+
+        word = value.upper()
+        if word == 'TRUE':
+            self.i += 1
+            return ('lit', True)
+        if word == 'FALSE':
+            self.i += 1
+            return ('lit', False)
+        if word == 'NULL':
+            self.i += 1
+            return ('lit', None)
+        if word == 'CASE' and not self.ends_expression(1):
+            self.i += 1
+            return self.case()
+        if word in ('EXISTS', 'COUNT') and self.is_op('{', offset=1):
+            self.i += 2
+            body = self.subquery()
+            return ('exists' if word == 'EXISTS' else 'countsub', body)
+        if word in ('ANY', 'ALL', 'NONE', 'SINGLE') and self.is_op('(', offset=1) \
+                and self.peek(2)[0] in ('name', 'quoted') and self.is_kw('IN', offset=3):
+            self.i += 2
+            var = self.name()
+            self.expect_kw('IN')
+            source = self.expression()
+            where = self.expression() if self.accept_kw('WHERE') else None
+            self.expect_op(')')
+            return ('quant', word.lower(), var, source, where)
+        if word == 'REDUCE' and self.is_op('(', offset=1):
+            self.i += 2
+            acc = self.name()
+            self.expect_op('=')
+            init = self.expression()
+            self.expect_op(',')
+            var = self.name()
+            self.expect_kw('IN')
+            source = self.expression()
+            self.expect_op('|')
+            expr = self.expression()
+            self.expect_op(')')
+            return ('reduce', acc, init, var, source, expr)
+
+        # function calls, possibly namespaced like duration.between(...)
+        j = 1
+        while self.is_op('.', offset=j) and self.peek(j + 1)[0] == 'name':
+            j += 2
+        if self.is_op('(', offset=j):
+            name = ''.join(str(self.peek(k)[1]) for k in range(j)).lower()
+            self.i += j + 1
+            return self.call(name)
+        self.i += 1
+        return ('var', value)
+
+    def ends_expression(self, offset):
+        kind, value, _, _ = self.peek(offset)
+        if kind == 'eof':
+            return True
+        if kind == 'op':
+            return value not in ('(', '[', '{', '-', '+')
+        return kind == 'name' and value.upper() in FOLLOW_KEYWORDS
+
+    def call(self, name):
+        if name == 'count' and self.accept_op('*'):
+            self.expect_op(')')
+            return ('countstar',)
+        if name == 'exists':
+            pattern = self.try_pattern()
+            if pattern is not None:
+                self.expect_op(')')
+                return ('patpred', pattern)
+        distinct = self.accept_kw('DISTINCT')
+        args = []
+        if not self.is_op(')'):
+            args.append(self.expression())
+            while self.accept_op(','):
+                args.append(self.expression())
+        self.expect_op(')')
+        if distinct and name not in AGGREGATES:
+            raise CypherError(f"Invalid use of DISTINCT with function '{name}'")
+        return ('call', name, distinct, args)
+
+    def case(self):
+        subject = None if self.is_kw('WHEN') else self.expression()
+        branches = []
+        while self.accept_kw('WHEN'):
+            condition = self.expression()
+            self.expect_kw('THEN')
+            branches.append((condition, self.expression()))
+        if not branches:
+            raise self.error('WHEN')
+        default = self.expression() if self.accept_kw('ELSE') else ('lit', None)
+        self.expect_kw('END')
+        return ('case', subject, branches, default)
+
+    def list_expr(self):
+        self.expect_op('[')
+        if self.peek()[0] in ('name', 'quoted') and self.is_kw('IN', offset=1):
+            var = self.name()
+            self.i += 1
+            source = self.expression()
+            where = self.expression() if self.accept_kw('WHERE') else None
+            projection = self.expression() if self.accept_op('|') else None
+            self.expect_op(']')
+            return ('listcomp', var, source, where, projection)
+        if self.is_op('('):
+            pattern = self.try_pattern()
+            if pattern is not None:
+                where = self.expression() if self.accept_kw('WHERE') else None
+                self.expect_op('|')
+                projection = self.expression()
+                self.expect_op(']')
+                return ('patcomp', pattern, where, projection)
+        items = []
+        if not self.is_op(']'):
+            items.append(self.expression())
+            while self.accept_op(','):
+                items.append(self.expression())
+        self.expect_op(']')
+        return ('list', items)
+
+    def map_literal(self):
+        self.expect_op('{')
+        entries = []
+        if not self.is_op('}'):
+            while True:
+                key = self.peek()
+                if key[0] not in ('name', 'quoted', 'string'):
+                    raise self.error('a property key name')
+                self.i += 1
+                self.expect_op(':')
+                entries.append((key[1], self.expression()))
+                if not self.accept_op(','):
+                    break
+        self.expect_op('}')
+        return ('map', entries)
+
+    def subquery(self):
+        """Parses the body of EXISTS {...} / COUNT {...}: either a full query
+        (with an optional RETURN) or a pattern list with an optional WHERE."""
+        if self.is_kw('MATCH', 'OPTIONAL', 'WITH', 'UNWIND'):
+            clauses = self.single_query()
+        else:
+            paths = [self.path()]
+            while self.accept_op(','):
+                paths.append(self.path())
+            where = self.expression() if self.accept_kw('WHERE') else None
+            clauses = [('match', False, paths, where)]
+        self.expect_op('}')
+        return clauses
+
+def parse(query):
+    """Parses and checks query, returning its syntax tree; raises CypherError for invalid input."""
+    tree = Parser(query).parse()
+    check(tree)
+    return tree
+
+def children(expr):
+    """Returns the direct subexpressions of expr that are evaluated in its own scope."""
+    kind = expr[0]
+    if kind in ('prop', 'not', 'neg', 'isnull', 'haslabel'):
+        return [expr[1]]
+    if kind in ('and', 'or', 'xor', 'in', 'index'):
+        return [expr[1], expr[2]]
+    if kind in ('arith', 'cmp', 'strop'):
+        return [expr[2], expr[3]]
+    if kind == 'slice':
+        return [e for e in expr[1:] if e is not None]
+    if kind == 'list':
+        return list(expr[1])
+    if kind == 'map':
+        return [e for _, e in expr[1]]
+    if kind == 'call':
+        return list(expr[3])
+    if kind == 'case':
+        found = [] if expr[1] is None else [expr[1]]
+        for condition, value in expr[2]:
+            found += [condition, value]
+        return found + [expr[3]]
+    return []
+
+def path_variables(path):
+    """Returns the named node and relationship variables of a path pattern."""
+    _, nodes, rels = path
+    return {n[0] for n in nodes if n[0]} | {r[0] for r in rels if r[0]}
+
+def path_properties(path):
+    _, nodes, rels = path
+    return [e[2] for e in nodes + rels if e[2] is not None]
+
+def variables(expr):
+    """Returns the variable names referenced anywhere in expr, including those
+    bound locally by comprehensions and subqueries (an over-approximation of
+    the variables expr depends on)."""
+    kind = expr[0]
+    if kind == 'var':
+        return {expr[1]}
+    found = set()
+    if kind in ('exists', 'countsub'):
+        for clause in expr[1]:
+            found |= clause_variables(clause)
+        return found
+    if kind in ('patpred', 'patcomp'):
+        found |= path_variables(expr[1])
+        nested = path_properties(expr[1]) + [e for e in expr[2:] if e is not None]
+    elif kind in ('listcomp', 'quant'):
+        found.add(expr[2] if kind == 'quant' else expr[1])
+        nested = [e for e in expr[2:] if isinstance(e, tuple)]
+    elif kind == 'reduce':
+        found |= {expr[1], expr[3]}
+        nested = [expr[2], expr[4], expr[5]]
+    else:
+        nested = children(expr)
+    for e in nested:
+        found |= variables(e)
+    return found
+
+def clause_variables(clause):
+    kind = clause[0]
+    if kind == 'match':
+        found = set()
+        for path in clause[2]:
+            found |= path_variables(path)
+            for props in path_properties(path):
+                found |= variables(props)
+        return found | (variables(clause[3]) if clause[3] is not None else set())
+    if kind == 'unwind':
+        return variables(clause[1]) | {clause[2]}
+    projection = clause[1]
+    exprs = [] if projection['items'] == '*' else [e for e, _ in projection['items']]
+    exprs += [e for e, _ in projection['order']]
+    if kind == 'with' and clause[2] is not None:
+        exprs.append(clause[2])
+    found = set()
+    for e in exprs:
+        found |= variables(e)
+    return found
+
+def contains_aggregate(expr):
+    """True if expr calls an aggregating function outside of nested subqueries."""
+    kind = expr[0]
+    if kind == 'countstar' or (kind == 'call' and expr[1] in AGGREGATES):
+        return True
+    if kind in ('listcomp', 'quant'):
+        return any(contains_aggregate(e) for e in expr[2:] if isinstance(e, tuple))
+    if kind == 'reduce':
+        return any(contains_aggregate(e) for e in (expr[2], expr[4], expr[5]))
+    return any(contains_aggregate(e) for e in children(expr))
+
+def check(tree):
+    """Checks variable scopes and the use of aggregating functions of a parsed
+    query, so that invalid queries fail like in Neo4j instead of returning rows."""
+    _, parts, _ = tree
+    columns = None
+    for clauses in parts:
+        scope = check_clauses(clauses, set())
+        items = clauses[-1][1]['items']
+        names = sorted(scope) if items == '*' else [alias for _, alias in items]
+        if columns is not None and names != columns:
+            raise CypherError("All sub queries in an UNION must have the same return column names")
+        columns = names
+
+def check_clauses(clauses, scope):
+    """Checks clauses starting with the variables in scope; returns the variables in scope after them."""
+    scope = set(scope)
+    for clause in clauses:
+        kind = clause[0]
+        if kind == 'match':
+            for path in clause[2]:
+                scope |= path_variables(path)
+            for path in clause[2]:
+                for props in path_properties(path):
+                    check_expr(props, scope)
+            if clause[3] is not None:
+                check_expr(clause[3], scope)
+        elif kind == 'unwind':
+            check_expr(clause[1], scope)
+            scope.add(clause[2])
+        else:
+            projection = clause[1]
+            if projection['items'] == '*':
+                projected = set(scope)
+            else:
+                aliases = [alias for _, alias in projection['items']]
+                if len(set(aliases)) < len(aliases):
+                    raise CypherError("Multiple result columns with the same name are not supported")
+                for expr, _ in projection['items']:
+                    check_expr(expr, scope, aggregates=True)
+                projected = set(aliases)
+            for expr, _ in projection['order']:
+                check_expr(expr, scope | projected, aggregates=True)
+            for expr in (projection['skip'], projection['limit']):
+                if expr is not None:
+                    check_expr(expr, set())
+            scope = projected
+            if kind == 'with' and clause[2] is not None:
+                check_expr(clause[2], scope)
+    return scope
+
+def check_expr(expr, scope, aggregates=False):
+    kind = expr[0]
+    if kind == 'var':
+        if expr[1] not in scope:
+            raise CypherError(f"Variable `{expr[1]}` not defined")
+        return
+    if kind == 'countstar' or (kind == 'call' and expr[1] in AGGREGATES):
+        name = 'count' if kind == 'countstar' else expr[1]
+        if not aggregates:
+            raise CypherError(f"Invalid use of aggregating function {name}(...) in this context")
+        for arg in expr[3] if kind == 'call' else []:
+            if contains_aggregate(arg):
+                raise CypherError("Can't use aggregate functions inside of aggregate functions.")
+            check_expr(arg, scope)
+        return
+    if kind in ('exists', 'countsub'):
+        check_clauses(expr[1], scope)
+        return
+    if kind in ('patpred', 'patcomp'):
+        inner = scope | path_variables(expr[1])
+        for e in path_properties(expr[1]) + [e for e in expr[2:] if e is not None]:
+            check_expr(e, inner)
+        return
+    if kind in ('listcomp', 'quant'):
+        var, source, rest = (expr[1], expr[2], expr[3:]) if kind == 'listcomp' else (expr[2], expr[3], expr[4:])
+        check_expr(source, scope, aggregates)
+        for e in rest:
+            if e is not None:
+                check_expr(e, scope | {var}, aggregates)
+        return
+    if kind == 'reduce':
+        check_expr(expr[2], scope, aggregates)
+        check_expr(expr[4], scope, aggregates)
+        check_expr(expr[5], scope | {expr[1], expr[3]}, aggregates)
+        return
+    for e in children(expr):
+        check_expr(e, scope, aggregates)
@@ -0,0 +1,1735 @@
+import calendar
+import csv
+import functools
+import itertools
+import math
+import os
+import re
+import statistics
+import threading
+import time
+from datetime import datetime, date, time as dtime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from ekg_cypher import parse, variables, contains_aggregate, CypherError
+from ekg_model import (lbl_event, lbl_entity, lbl_rel, lbl_corr, lbl_df,
+                       event_rows, entity_rows, rel_rows, corr_rows, df_rows, records)
+
+# In-process stand-in for a Neo4j server holding an EKG. The graph built by
+# ocel_to_ekg.py (Event/Entity nodes, CORR/DF/REL edges) is loaded into memory
+# with adjacency lists per relationship type and property indexes that are
+# built on first use, and the read-only Cypher subset of the rule queries
+# (ekg_cypher.py) is evaluated on it. Values follow Neo4j's semantics: null
+# propagation, three-valued logic, DateTime/Duration arithmetic and ordering.
+
+class QueryTimeout(Exception):
+    """Raised while iterating the records of a query that exceeded its timeout."""
+
+class Node:
+    __slots__ = ('id', 'labels', 'props')
+
+    def __init__(self, id, labels, props):
+        self.id = id
+        self.labels = labels
+        self.props = props
+
+class Relationship:
+    __slots__ = ('id', 'type', 'start', 'end', 'props')
+
+    def __init__(self, id, type, start, end, props):
+        self.id = id
+        self.type = type
+        self.start = start
+        self.end = end
+        self.props = props
+
+class Duration:
+    """A Cypher duration: months, days and seconds are kept apart like in Neo4j,
+    so duration.between(a, b).seconds excludes whole days."""
+    __slots__ = ('months', 'days', 'seconds', 'nanos')
+
+    def __init__(self, months=0, days=0, seconds=0, nanos=0):
+        self.months = months
+        self.days = days
+        self.seconds = seconds + nanos // 10**9
+        self.nanos = nanos % 10**9
+
+    def key(self):
+        return (self.months, self.days, self.seconds, self.nanos)
+
+    def __eq__(self, other):
+        return isinstance(other, Duration) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __neg__(self):
+        return Duration(-self.months, -self.days, -self.seconds, -self.nanos)
+
+    def __str__(self):
+        if not any(self.key()):
+            return 'PT0S'
+        text = 'P'
+        years, months = jdiv(self.months, 12), jmod(self.months, 12)
+        text += f'{years}Y' * bool(years) + f'{months}M' * bool(months) + f'{self.days}D' * bool(self.days)
+        seconds = self.seconds + self.nanos / 10**9
+        if seconds:
+            hours, rest = jdiv(self.seconds, 3600), jmod(self.seconds, 3600)
+            minutes = jdiv(rest, 60)
+            seconds = jmod(rest, 60) + self.nanos / 10**9
+            seconds = int(seconds) if seconds == int(seconds) else round(seconds, 9)
+            text += 'T' + f'{hours}H' * bool(hours) + f'{minutes}M' * bool(minutes) + f'{seconds}S' * bool(seconds)
+        return text
+
+    __repr__ = __str__
+
+AGG = ' agg'  # row key of the aggregate results of a group, never a valid variable name
+AVG_DAYS_PER_MONTH = 365.2425 / 12
+
+def jdiv(a, b):
+    """Integer division truncating towards zero, like Java/Cypher."""
+    q = abs(a) // abs(b)
+    return q if (a >= 0) == (b > 0) else -q
+
+def jmod(a, b):
+    return a - b * jdiv(a, b)
+
+def is_number(v):
+    return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+def type_name(v):
+    if v is None:
+        return 'NULL'
+    if isinstance(v, bool):
+        return 'Boolean'
+    if isinstance(v, int):
+        return 'Integer'
+    if isinstance(v, float):
+        return 'Float'
+    if isinstance(v, str):
+        return 'String'
+    if isinstance(v, list):
+        return 'List'
+    if isinstance(v, dict):
+        return 'Map'
+    if isinstance(v, Node):
+        return 'Node'
+    if isinstance(v, Relationship):
+        return 'Relationship'
+    if isinstance(v, Duration):
+        return 'Duration'
+    if isinstance(v, datetime):
+        return 'DateTime' if v.tzinfo else 'LocalDateTime'
+    if isinstance(v, date):
+        return 'Date'
+    if isinstance(v, dtime):
+        return 'Time' if v.tzinfo else 'LocalTime'
+    return type(v).__name__
+
+def mismatch(expected, v):
+    return CypherError(f"Type mismatch: expected {expected} but was {type_name(v)}")
+
+# equality, ordering and hashing
+
+def hashkey(v):
+    """Returns a hashable key of v under which equal Cypher values collide
+    (used for DISTINCT, grouping and property indexes)."""
+    if v is None or isinstance(v, str):
+        return v
+    if isinstance(v, bool):
+        return ('bool', v)
+    if isinstance(v, (int, float)):
+        return v
+    if isinstance(v, Node):
+        return ('node', v.id)
+    if isinstance(v, Relationship):
+        return ('rel', v.id)
+    if isinstance(v, list):
+        return ('list',) + tuple(hashkey(x) for x in v)
+    if isinstance(v, dict):
+        return ('map',) + tuple(sorted((k, hashkey(x)) for k, x in v.items()))
+    return (type_name(v), v)
+
+def equals(a, b):
+    """Cypher equality: None (null) if either side is null, no coercion between types."""
+    if a is None or b is None:
+        return None
+    if isinstance(a, bool) or isinstance(b, bool):
+        return isinstance(a, bool) and isinstance(b, bool) and a == b
+    if is_number(a) and is_number(b):
+        return a == b
+    if isinstance(a, (Node, Relationship)) or isinstance(b, (Node, Relationship)):
+        return a is b
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return False
+        result = True
+        for x, y in zip(a, b):
+            r = equals(x, y)
+            if r is False:
+                return False
+            if r is None:
+                result = None
+        return result
+    if isinstance(a, dict) and isinstance(b, dict):
+        if a.keys() != b.keys():
+            return False
+        return equals([a[k] for k in sorted(a)], [b[k] for k in sorted(b)])
+    if type_name(a) != type_name(b):
+        return False
+    return a == b
+
+def compare(a, b):
+    """Returns -1, 0 or 1, or None if a and b are not comparable (null or different types)."""
+    if a is None or b is None:
+        return None
+    if is_number(a) and is_number(b):
+        if a != a or b != b:
+            return None
+        return (a > b) - (a < b)
+    kind = type_name(a)
+    if kind != type_name(b) or kind in ('Map', 'Node', 'Relationship', 'Duration'):
+        return None
+    if kind == 'List':
+        for x, y in zip(a, b):
+            r = compare(x, y)
+            if r != 0:
+                return r
+        return (len(a) > len(b)) - (len(a) < len(b))
+    return (a > b) - (a < b)
+
+# global sort order of ORDER BY and min/max, nulls last
+ORDER_RANKS = {'Map': 0, 'Node': 1, 'Relationship': 2, 'List': 3, 'DateTime': 5, 'LocalDateTime': 6,
+               'Date': 7, 'Time': 8, 'LocalTime': 9, 'Duration': 10, 'String': 11, 'Boolean': 12,
+               'Integer': 13, 'Float': 13, 'NULL': 14}
+
+def order_key(v):
+    kind = type_name(v)
+    rank = ORDER_RANKS.get(kind, 4)
+    if v is None:
+        return (rank, 0)
+    if kind in ('Node', 'Relationship'):
+        return (rank, v.id)
+    if kind == 'Map':
+        return (rank, sorted((k, order_key(x)) for k, x in v.items()))
+    if kind == 'List':
+        return (rank, [order_key(x) for x in v])
+    if kind == 'Duration':
+        return (rank, v.key())
+    if kind == 'Time':
+        return (rank, (datetime.combine(date(2000, 1, 1), v) - v.utcoffset()).time())
+    if kind == 'Float' and v != v:
+        return (rank, math.inf)
+    return (rank, v)
+
+def truth(v):
+    """True only for true; false and null filter rows out, other types are errors."""
+    if v is True:
+        return True
+    if v is False or v is None:
+        return False
+    raise mismatch('Boolean', v)
+
+def boolean(v):
+    if v is None or isinstance(v, bool):
+        return v
+    raise mismatch('Boolean', v)
+
+def in_list(value, values):
+    if values is None:
+        return None
+    if not isinstance(values, list):
+        raise mismatch('List', values)
+    unknown = False
+    for x in values:
+        r = equals(value, x)
+        if r:
+            return True
+        if r is None:
+            unknown = True
+    return None if unknown else False
+
+def distinct_values(values):
+    seen = set()
+    result = []
+    for v in values:
+        k = hashkey(v)
+        if k not in seen:
+            seen.add(k)
+            result.append(v)
+    return result
+
+# temporal values
+
+DATETIME = re.compile(r'(\d{4})-?(\d{2})-?(\d{2})(?:T(\d{2})(?::?(\d{2})(?::?(\d{2})(?:[.,](\d{1,9}))?)?)?)?'
+                      r'(Z|[+-]\d{2}(?::?\d{2})?)?(?:\[([^\]]+)\])?')
+DATE = re.compile(r'(\d{4})(?:-(\d{2})(?:-(\d{2}))?)?')
+TIME = re.compile(r'(\d{2})(?::?(\d{2})(?::?(\d{2})(?:[.,](\d{1,9}))?)?)?(Z|[+-]\d{2}(?::?\d{2})?)?')
+ISO_DURATION = re.compile(r'([-+]?)P(?:([-+]?[\d.]+)Y)?(?:([-+]?[\d.]+)M)?(?:([-+]?[\d.]+)W)?(?:([-+]?[\d.]+)D)?'
+                          r'(?:T(?:([-+]?[\d.]+)H)?(?:([-+]?[\d.]+)M)?(?:([-+]?[\d.]+)S)?)?')
+
+DURATION_UNITS = {'years': ('months', 12), 'quarters': ('months', 3), 'months': ('months', 1),
+                  'weeks': ('days', 7), 'days': ('days', 1), 'hours': ('seconds', 3600),
+                  'minutes': ('seconds', 60), 'seconds': ('seconds', 1),
+                  'milliseconds': ('seconds', 1e-3), 'microseconds': ('seconds', 1e-6),
+                  'nanoseconds': ('seconds', 1e-9)}
+
+def zone(offset, name=None):
+    if name:
+        try:
+            return ZoneInfo(name)
+        except Exception:
+            raise CypherError(f"Invalid value for TimeZone: Text '{name}'")
+    if offset is None:
+        return None
+    if offset == 'Z':
+        return timezone.utc
+    digits = offset[1:].replace(':', '')
+    delta = timedelta(hours=int(digits[:2]), minutes=int(digits[2:4] or 0))
+    return timezone(-delta if offset[0] == '-' else delta)
+
+def micros(fraction):
+    return int((fraction or '0')[:6].ljust(6, '0'))
+
+def parse_datetime(text, local=False):
+    """Parses an ISO 8601 date-time string; values without an offset are in UTC, like in Neo4j."""
+    m = DATETIME.fullmatch(text.strip())
+    if not m:
+        raise CypherError(f'Text cannot be parsed to a {"LocalDateTime" if local else "DateTime"}\n"{text}"')
+    y, mo, d, h, mi, s, frac, offset, name = m.groups()
+    value = datetime(int(y), int(mo), int(d), int(h or 0), int(mi or 0), int(s or 0), micros(frac))
+    if local:
+        return value
+    return value.replace(tzinfo=zone(offset, name) or timezone.utc)
+
+def parse_date(text):
+    m = DATE.fullmatch(text.strip())
+    if not m:
+        raise CypherError(f'Text cannot be parsed to a Date\n"{text}"')
+    y, mo, d = m.groups()
+    return date(int(y), int(mo or 1), int(d or 1))
+
+def parse_time(text, local=False):
+    m = TIME.fullmatch(text.strip())
+    if not m:
+        raise CypherError(f'Text cannot be parsed to a {"LocalTime" if local else "Time"}\n"{text}"')
+    h, mi, s, frac, offset = m.groups()
+    value = dtime(int(h), int(mi or 0), int(s or 0), micros(frac))
+    return value if local else value.replace(tzinfo=zone(offset) or timezone.utc)
+
+def parse_duration(text):
+    m = ISO_DURATION.fullmatch(text.strip())
+    if not m or not any(m.groups()[1:]):
+        raise CypherError(f'Text cannot be parsed to a Duration\n"{text}"')
+    sign = -1 if m.group(1) == '-' else 1
+    units = ['years', 'months', 'weeks', 'days', 'hours', 'minutes', 'seconds']
+    return make_duration({u: sign * float(v) for u, v in zip(units, m.groups()[1:]) if v})
+
+def make_duration(components):
+    """Builds a Duration from unit amounts; fractions spill over into smaller units like in Neo4j."""
+    totals = {'months': 0, 'days': 0, 'seconds': 0}
+    for unit, amount in components.items():
+        if unit.lower() not in DURATION_UNITS:
+            raise CypherError(f"No such field in duration: {unit}")
+        if amount is None:
+            continue
+        if not is_number(amount):
+            raise mismatch('Number', amount)
+        group, factor = DURATION_UNITS[unit.lower()]
+        totals[group] += amount * factor
+    months = int(totals['months'])
+    days = totals['days'] + (totals['months'] - months) * AVG_DAYS_PER_MONTH
+    whole_days = int(days)
+    seconds = totals['seconds'] + (days - whole_days) * 86400
+    whole_seconds = math.floor(seconds)
+    return Duration(months, whole_days, whole_seconds, round((seconds - whole_seconds) * 10**9))
+
+def add_months(value, months):
+    if not months:
+        return value
+    m = value.month - 1 + months
+    year, month = value.year + m // 12, m % 12 + 1
+    return value.replace(year=year, month=month, day=min(value.day, calendar.monthrange(year, month)[1]))
+
+def add_duration(value, d):
+    if isinstance(value, datetime):
+        value = add_months(value, d.months)
+        return value + timedelta(days=d.days, seconds=d.seconds, microseconds=d.nanos // 1000)
+    if isinstance(value, date):
+        return add_months(value, d.months) + timedelta(days=d.days + jdiv(d.seconds, 86400))
+    day = 86400 * 10**6
+    total = ((value.hour * 60 + value.minute) * 60 + value.second) * 10**6 + value.microsecond
+    total = (total + d.seconds * 10**6 + d.nanos // 1000) % day
+    return value.replace(hour=total // 3600_000_000, minute=total // 60_000_000 % 60,
+                         second=total // 10**6 % 60, microsecond=total % 10**6)
+
+def duration_between(a, b):
+    """duration.between: whole months first, then whole days, then the remaining seconds."""
+    if a is None or b is None:
+        return None
+    if isinstance(a, dtime) or isinstance(b, dtime):
+        if not (isinstance(a, dtime) and isinstance(b, dtime)):
+            a, b = to_time(a), to_time(b)
+        delta = datetime.combine(date.min, b) - datetime.combine(date.min, a)
+        if a.tzinfo and b.tzinfo:
+            delta -= b.utcoffset() - a.utcoffset()
+        return Duration(seconds=math.floor(delta.total_seconds()), nanos=delta.microseconds * 1000)
+    if not isinstance(a, date) or not isinstance(b, date):
+        raise CypherError(f"Type mismatch: expected temporal values but was {type_name(a)} and {type_name(b)}")
+    if not isinstance(a, datetime) and not isinstance(b, datetime):
+        a, b = datetime.combine(a, dtime()), datetime.combine(b, dtime())
+    a = a if isinstance(a, datetime) else datetime.combine(a, dtime(), b.tzinfo)
+    b = b if isinstance(b, datetime) else datetime.combine(b, dtime(), a.tzinfo)
+    if a.tzinfo and b.tzinfo:
+        b = b.astimezone(a.tzinfo)
+    a, b = a.replace(tzinfo=None), b.replace(tzinfo=None)
+    months = (b.year - a.year) * 12 + b.month - a.month
+    if months > 0 and add_months(a, months) > b:
+        months -= 1
+    elif months < 0 and add_months(a, months) < b:
+        months += 1
+    rest = (b - add_months(a, months)) // timedelta(microseconds=1)
+    days = jdiv(rest, 86400 * 10**6)
+    rest -= days * 86400 * 10**6
+    seconds = jdiv(rest, 10**6)
+    return Duration(months, days, seconds, (rest - seconds * 10**6) * 1000)
+
+def to_time(value):
+    if isinstance(value, datetime):
+        return value.timetz()
+    if isinstance(value, dtime):
+        return value
+    if isinstance(value, date):
+        return dtime()
+    raise mismatch('a temporal value', value)
+
+def temporal_field(value, key):
+    k = key.lower()
+    if isinstance(value, (datetime, date)):
+        d = value.date() if isinstance(value, datetime) else value
+        fields = {'year': d.year, 'quarter': (d.month - 1) // 3 + 1, 'month': d.month,
+                  'week': d.isocalendar()[1], 'weekyear': d.isocalendar()[0], 'day': d.day,
+                  'ordinalday': d.timetuple().tm_yday, 'dayofweek': d.isoweekday(), 'weekday': d.isoweekday(),
+                  'dayofquarter': (d - date(d.year, (d.month - 1) // 3 * 3 + 1, 1)).days + 1}
+        if k in fields:
+            return fields[k]
+    if isinstance(value, (datetime, dtime)):
+        fields = {'hour': value.hour, 'minute': value.minute, 'second': value.second,
+                  'millisecond': value.microsecond // 1000, 'microsecond': value.microsecond,
+                  'nanosecond': value.microsecond * 1000}
+        if value.tzinfo:
+            offset = value.utcoffset()
+            minutes = int(offset.total_seconds()) // 60
+            fields['offset'] = '%s%02d:%02d' % ('-' if minutes < 0 else '+', abs(minutes) // 60, abs(minutes) % 60)
+            fields['offsetminutes'] = minutes
+            fields['offsetseconds'] = int(offset.total_seconds())
+            fields['timezone'] = str(value.tzinfo) if isinstance(value.tzinfo, ZoneInfo) else fields['offset']
+            if isinstance(value, datetime):
+                fields['epochseconds'] = math.floor(value.timestamp())
+                fields['epochmillis'] = math.floor(value.timestamp() * 1000)
+        if k in fields:
+            return fields[k]
+    raise CypherError(f"No such field: {key}")
+
+def duration_field(d, key):
+    k = key.lower()
+    fields = {'years': jdiv(d.months, 12), 'quarters': jdiv(d.months, 3), 'months': d.months,
+              'weeks': jdiv(d.days, 7), 'days': d.days, 'hours': jdiv(d.seconds, 3600),
+              'minutes': jdiv(d.seconds, 60), 'seconds': d.seconds,
+              'milliseconds': d.seconds * 1000 + d.nanos // 10**6,
+              'microseconds': d.seconds * 10**6 + d.nanos // 1000,
+              'nanoseconds': d.seconds * 10**9 + d.nanos,
+              'quartersofyear': jmod(jdiv(d.months, 3), 4), 'monthsofquarter': jmod(d.months, 3),
+              'monthsofyear': jmod(d.months, 12), 'daysofweek': jmod(d.days, 7),
+              'minutesofhour': jmod(jdiv(d.seconds, 60), 60), 'secondsofminute': jmod(d.seconds, 60),
+              'millisecondsofsecond': d.nanos // 10**6, 'microsecondsofsecond': d.nanos // 1000,
+              'nanosecondsofsecond': d.nanos}
+    if k not in fields:
+        raise CypherError(f"No such field: {key}")
+    return fields[k]
+
+def get_property(value, key):
+    if value is None:
+        return None
+    if isinstance(value, (Node, Relationship)):
+        return value.props.get(key)
+    if isinstance(value, dict):
+        return value.get(key)
+    if isinstance(value, Duration):
+        return duration_field(value, key)
+    if isinstance(value, (date, dtime)):
+        return temporal_field(value, key)
+    raise CypherError(f"Type mismatch: expected a map but was {type_name(value)}")
+
+def truncate(unit, value, result):
+    """date.truncate/datetime.truncate to unit, returning a Date or (Local)DateTime."""
+    if value is None:
+        return None
+    if not isinstance(value, date):
+        raise mismatch('a temporal value with a date', value)
+    unit = unit.lower()
+    d = value.date() if isinstance(value, datetime) else value
+    t = value.timetz() if isinstance(value, datetime) else dtime(tzinfo=timezone.utc if result == 'datetime' else None)
+    day_units = {'millennium': lambda: date(d.year // 1000 * 1000, 1, 1),
+                 'century': lambda: date(d.year // 100 * 100, 1, 1),
+                 'decade': lambda: date(d.year // 10 * 10, 1, 1),
+                 'year': lambda: date(d.year, 1, 1),
+                 'weekyear': lambda: date.fromisocalendar(d.isocalendar()[0], 1, 1),
+                 'quarter': lambda: date(d.year, (d.month - 1) // 3 * 3 + 1, 1),
+                 'month': lambda: date(d.year, d.month, 1),
+                 'week': lambda: d - timedelta(days=d.weekday()),
+                 'day': lambda: d}
+    time_units = {'hour': lambda: t.replace(minute=0, second=0, microsecond=0),
+                  'minute': lambda: t.replace(second=0, microsecond=0),
+                  'second': lambda: t.replace(microsecond=0),
+                  'millisecond': lambda: t.replace(microsecond=t.microsecond // 1000 * 1000),
+                  'microsecond': lambda: t}
+    if unit in day_units:
+        d, t = day_units[unit](), t.replace(hour=0, minute=0, second=0, microsecond=0)
+    elif unit in time_units and result == 'datetime':
+        t = time_units[unit]()
+    else:
+        raise CypherError(f"Unit '{unit}' is not supported for {result}.truncate")
+    return d if result == 'date' else datetime.combine(d, t)
+
+def temporal_map(args, kind):
+    fields = {k.lower(): v for k, v in args.items()}
+    tz = fields.pop('timezone', None)
+    tzinfo = None
+    if tz is not None:
+        tzinfo = zone(tz) if re.fullmatch(r'Z|[+-]\d{2}(:?\d{2})?', tz) else zone(None, tz)
+    if 'epochseconds' in fields or 'epochmillis' in fields:
+        seconds = fields.get('epochseconds', 0) + fields.get('epochmillis', 0) / 1000
+        return datetime.fromtimestamp(seconds, tzinfo or timezone.utc)
+    try:
+        d = date(int(fields.get('year', 1970)), int(fields.get('month', 1)), int(fields.get('day', 1)))
+        t = dtime(int(fields.get('hour', 0)), int(fields.get('minute', 0)), int(fields.get('second', 0)),
+                  int(fields.get('millisecond', 0)) * 1000 + int(fields.get('microsecond', 0))
+                  + int(fields.get('nanosecond', 0)) // 1000)
+    except ValueError as e:
+        raise CypherError(f"Invalid value for {kind}: {e}")
+    if kind == 'date':
+        return d
+    if kind == 'localdatetime':
+        return datetime.combine(d, t)
+    if kind == 'localtime':
+        return t
+    if kind == 'time':
+        return t.replace(tzinfo=tzinfo or timezone.utc)
+    return datetime.combine(d, t, tzinfo or timezone.utc)
+
+def temporal(kind, args):
+    """The date/datetime/localdatetime/time/localtime functions."""
+    if not args:
+        now = datetime.now(timezone.utc)
+        return {'date': now.date(), 'datetime': now, 'localdatetime': now.replace(tzinfo=None),
+                'time': now.timetz(), 'localtime': now.time()}[kind]
+    value = args[0]
+    if value is None:
+        return None
+    if isinstance(value, str):
+        if kind == 'date':
+            return parse_date(value)
+        if kind in ('time', 'localtime'):
+            return parse_time(value, local=kind == 'localtime')
+        return parse_datetime(value, local=kind == 'localdatetime')
+    if isinstance(value, dict):
+        return temporal_map(value, kind)
+    if isinstance(value, datetime):
+        return {'date': value.date(), 'datetime': value if value.tzinfo else value.replace(tzinfo=timezone.utc),
+                'localdatetime': value.replace(tzinfo=None), 'time': value.timetz() if value.tzinfo
+                else value.time().replace(tzinfo=timezone.utc), 'localtime': value.time()}[kind]
+    if isinstance(value, date):
+        if kind in ('time', 'localtime'):
+            raise mismatch('a temporal value with a time', value)
+        midnight = datetime.combine(value, dtime())
+        return {'date': value, 'datetime': midnight.replace(tzinfo=timezone.utc), 'localdatetime': midnight}[kind]
+    if isinstance(value, dtime) and kind in ('time', 'localtime'):
+        return value.replace(tzinfo=None) if kind == 'localtime' else value if value.tzinfo \
+            else value.replace(tzinfo=timezone.utc)
+    raise mismatch('String or Map', value)
+
+def duration(value):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return parse_duration(value)
+    if isinstance(value, dict):
+        return make_duration(value)
+    if isinstance(value, Duration):
+        return value
+    raise mismatch('String or Map', value)
+
+# arithmetic
+
+def to_string(v):
+    if v is None:
+        return None
+    if isinstance(v, bool):
+        return 'true' if v else 'false'
+    if isinstance(v, str):
+        return v
+    if isinstance(v, (int, float, Duration)):
+        return str(v)
+    if isinstance(v, (datetime, date, dtime)):
+        return v.isoformat().replace('+00:00', 'Z')
+    raise CypherError(f"Type mismatch: expected a value that can be converted to a String but was {type_name(v)}")
+
+def add(a, b):
+    if a is None or b is None:
+        return None
+    if is_number(a) and is_number(b):
+        return a + b
+    if isinstance(a, list):
+        return a + b if isinstance(b, list) else a + [b]
+    if isinstance(b, list):
+        return [a] + b
+    if isinstance(a, str) or isinstance(b, str):
+        if isinstance(a, (str, int, float)) and isinstance(b, (str, int, float)) \
+                and not isinstance(a, bool) and not isinstance(b, bool):
+            return to_string(a) + to_string(b)
+    if isinstance(a, Duration) and isinstance(b, Duration):
+        return Duration(a.months + b.months, a.days + b.days, a.seconds + b.seconds, a.nanos + b.nanos)
+    if isinstance(b, Duration) and isinstance(a, (date, dtime)):
+        return add_duration(a, b)
+    if isinstance(a, Duration) and isinstance(b, (date, dtime)):
+        return add_duration(b, a)
+    raise CypherError(f"Type mismatch: cannot add {type_name(a)} and {type_name(b)}")
+
+def subtract(a, b):
+    if a is None or b is None:
+        return None
+    if is_number(a) and is_number(b):
+        return a - b
+    if isinstance(b, Duration) and isinstance(a, (date, dtime, Duration)):
+        return add(a, -b)
+    raise CypherError(f"Type mismatch: cannot subtract {type_name(b)} from {type_name(a)}")
+
+def scale(d, factor):
+    return make_duration({'months': d.months * factor, 'days': d.days * factor,
+                          'seconds': (d.seconds + d.nanos / 10**9) * factor})
+
+def multiply(a, b):
+    if a is None or b is None:
+        return None
+    if is_number(a) and is_number(b):
+        return a * b
+    if isinstance(a, Duration) and is_number(b):
+        return scale(a, b)
+    if is_number(a) and isinstance(b, Duration):
+        return scale(b, a)
+    raise CypherError(f"Type mismatch: cannot multiply {type_name(a)} and {type_name(b)}")
+
+def divide(a, b):
+    if a is None or b is None:
+        return None
+    if isinstance(a, Duration) and is_number(b):
+        if b == 0:
+            raise CypherError("/ by zero")
+        return scale(a, 1 / b)
+    if not (is_number(a) and is_number(b)):
+        raise CypherError(f"Type mismatch: cannot divide {type_name(a)} by {type_name(b)}")
+    if isinstance(a, int) and isinstance(b, int):
+        if b == 0:
+            raise CypherError("/ by zero")
+        return jdiv(a, b)
+    if b == 0:
+        return math.nan if a == 0 or a != a else math.copysign(math.inf, a) * math.copysign(1, b)
+    return a / b
+
+def modulo(a, b):
+    if a is None or b is None:
+        return None
+    if not (is_number(a) and is_number(b)):
+        raise CypherError(f"Type mismatch: cannot compute the modulo of {type_name(a)} and {type_name(b)}")
+    if isinstance(a, int) and isinstance(b, int):
+        if b == 0:
+            raise CypherError("/ by zero")
+        return jmod(a, b)
+    return math.fmod(a, b) if b != 0 else math.nan
+
+def power(a, b):
+    if a is None or b is None:
+        return None
+    if not (is_number(a) and is_number(b)):
+        raise CypherError(f"Type mismatch: cannot raise {type_name(a)} to {type_name(b)}")
+    try:
+        return float(a) ** float(b)
+    except (OverflowError, ZeroDivisionError):
+        return math.inf
+
+ARITHMETIC = {'+': add, '-': subtract, '*': multiply, '/': divide, '%': modulo, '^': power}
+
+COMPARISONS = {
+    '=': equals,
+    '<>': lambda a, b: None if equals(a, b) is None else not equals(a, b),
+    '<': lambda a, b: None if compare(a, b) is None else compare(a, b) < 0,
+    '>': lambda a, b: None if compare(a, b) is None else compare(a, b) > 0,
+    '<=': lambda a, b: None if compare(a, b) is None else compare(a, b) <= 0,
+    '>=': lambda a, b: None if compare(a, b) is None else compare(a, b) >= 0,
+}
+
+def string_op(op, a, b):
+    if not isinstance(a, str) or not isinstance(b, str):
+        return None
+    if op == 'STARTS':
+        return a.startswith(b)
+    if op == 'ENDS':
+        return a.endswith(b)
+    if op == 'CONTAINS':
+        return b in a
+    try:
+        return re.fullmatch(b, a) is not None
+    except re.error as e:
+        raise CypherError(f"Invalid Regex: {e}")
+
+# scalar functions: name -> (function of the argument values, min args, max args)
+
+def null_safe(f):
+    return lambda v, *rest: None if v is None else f(v, *rest)
+
+def numeric(f):
+    def apply(v):
+        if v is None:
+            return None
+        if not is_number(v):
+            raise mismatch('Number', v)
+        return f(v)
+    return apply
+
+def to_integer(v):
+    if v is None or isinstance(v, bool):
+        return None if v is None else int(v)
+    if is_number(v):
+        return int(v) if v == v and abs(v) != math.inf else None
+    if isinstance(v, str):
+        try:
+            return int(float(v)) if re.fullmatch(r'\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*', v) else None
+        except ValueError:
+            return None
+    raise mismatch('String, Number or Boolean', v)
+
+def to_float(v):
+    if v is None or is_number(v):
+        return None if v is None else float(v)
+    if isinstance(v, str):
+        try:
+            return float(v)
+        except ValueError:
+            return None
+    raise mismatch('String or Number', v)
+
+def to_boolean(v):
+    if v is None or isinstance(v, bool):
+        return v
+    if isinstance(v, str):
+        return {'true': True, 'false': False}.get(v.strip().lower())
+    if isinstance(v, int):
+        return v != 0
+    raise mismatch('String, Integer or Boolean', v)
+
+def size(v):
+    if v is None:
+        return None
+    if isinstance(v, (str, list)):
+        return len(v)
+    raise mismatch('String or List', v)
+
+def cypher_range(start, end, step=1):
+    for v in (start, end, step):
+        if not isinstance(v, int) or isinstance(v, bool):
+            raise mismatch('Integer', v)
+    if step == 0:
+        raise CypherError("Step argument to range() can't be 0")
+    return list(range(start, end + (1 if step > 0 else -1), step))
+
+def substring(s, start, length=None):
+    if s is None:
+        return None
+    if not isinstance(s, str):
+        raise mismatch('String', s)
+    return s[start:] if length is None else s[start:start + length]
+
+def cypher_round(v, precision=None, mode=None):
+    if v is None:
+        return None
+    if not is_number(v):
+        raise mismatch('Number', v)
+    if precision is None:
+        return float(math.floor(v + 0.5))
+    factor = 10 ** precision
+    return math.floor(v * factor + 0.5) / factor
+
+def split(s, delimiter):
+    if s is None or delimiter is None:
+        return None
+    return s.split(delimiter) if delimiter else list(s)
+
+FUNCTIONS = {
+    'size': (size, 1, 1),
+    'length': (size, 1, 1),
+    'abs': (numeric(abs), 1, 1),
+    'ceil': (numeric(lambda v: float(math.ceil(v))), 1, 1),
+    'floor': (numeric(lambda v: float(math.floor(v))), 1, 1),
+    'round': (cypher_round, 1, 3),
+    'sign': (numeric(lambda v: (v > 0) - (v < 0)), 1, 1),
+    'sqrt': (numeric(lambda v: math.sqrt(v) if v >= 0 else math.nan), 1, 1),
+    'exp': (numeric(math.exp), 1, 1),
+    'log': (numeric(lambda v: math.log(v) if v > 0 else math.nan), 1, 1),
+    'log10': (numeric(lambda v: math.log10(v) if v > 0 else math.nan), 1, 1),
+    'e': (lambda: math.e, 0, 0),
+    'pi': (lambda: math.pi, 0, 0),
+    'tointeger': (to_integer, 1, 1),
+    'tofloat': (to_float, 1, 1),
+    'toboolean': (to_boolean, 1, 1),
+    'tostring': (to_string, 1, 1),
+    'toupper': (null_safe(str.upper), 1, 1),
+    'tolower': (null_safe(str.lower), 1, 1),
+    'trim': (null_safe(str.strip), 1, 1),
+    'ltrim': (null_safe(str.lstrip), 1, 1),
+    'rtrim': (null_safe(str.rstrip), 1, 1),
+    'replace': (lambda s, a, b: None if None in (s, a, b) else s.replace(a, b), 3, 3),
+    'substring': (substring, 2, 3),
+    'left': (lambda s, n: None if s is None else s[:n], 2, 2),
+    'right': (lambda s, n: None if s is None else s[len(s) - n:] if n else '', 2, 2),
+    'split': (split, 2, 2),
+    'reverse': (null_safe(lambda v: v[::-1]), 1, 1),
+    'head': (null_safe(lambda v: v[0] if v else None), 1, 1),
+    'last': (null_safe(lambda v: v[-1] if v else None), 1, 1),
+    'tail': (null_safe(lambda v: v[1:]), 1, 1),
+    'range': (cypher_range, 2, 3),
+    'coalesce': (lambda *args: next((a for a in args if a is not None), None), 1, None),
+    'isempty': (null_safe(lambda v: len(v) == 0), 1, 1),
+    'exists': (lambda v: v is not None, 1, 1),
+    'id': (null_safe(lambda v: v.id), 1, 1),
+    'elementid': (null_safe(lambda v: str(v.id)), 1, 1),
+    'labels': (null_safe(lambda v: sorted(v.labels)), 1, 1),
+    'type': (null_safe(lambda v: v.type), 1, 1),
+    'keys': (null_safe(lambda v: list(v.keys() if isinstance(v, dict) else v.props)), 1, 1),
+    'properties': (null_safe(lambda v: dict(v if isinstance(v, dict) else v.props)), 1, 1),
+    'startnode': (null_safe(lambda v: v.start), 1, 1),
+    'endnode': (null_safe(lambda v: v.end), 1, 1),
+    'timestamp': (lambda: int(time.time() * 1000), 0, 0),
+    'date': (lambda *args: temporal('date', args), 0, 1),
+    'datetime': (lambda *args: temporal('datetime', args), 0, 1),
+    'localdatetime': (lambda *args: temporal('localdatetime', args), 0, 1),
+    'time': (lambda *args: temporal('time', args), 0, 1),
+    'localtime': (lambda *args: temporal('localtime', args), 0, 1),
+    'duration': (duration, 1, 1),
+    'duration.between': (duration_between, 2, 2),
+    'duration.inseconds': (lambda a, b: None if None in (a, b) else
+                           make_duration({'seconds': (to_instant(b) - to_instant(a)).total_seconds()}), 2, 2),
+    'duration.indays': (lambda a, b: None if None in (a, b) else
+                        Duration(days=jdiv((to_instant(b) - to_instant(a)) // timedelta(seconds=1), 86400)), 2, 2),
+    'duration.inmonths': (lambda a, b: None if None in (a, b) else Duration(months=duration_between(a, b).months), 2, 2),
+    'date.truncate': (lambda unit, v, *_: truncate(unit, v, 'date'), 2, 3),
+    'datetime.truncate': (lambda unit, v, *_: truncate(unit, v, 'datetime'), 2, 3),
+    'datetime.fromepoch': (lambda s, ns=0: datetime.fromtimestamp(s + ns / 10**9, timezone.utc), 1, 2),
+    'datetime.fromepochmillis': (lambda ms: datetime.fromtimestamp(ms / 1000, timezone.utc), 1, 1),
+}
+
+def to_instant(value):
+    """Returns value as a datetime for duration.inSeconds/inDays (dates at midnight UTC)."""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime.combine(value, dtime(), timezone.utc)
+    raise mismatch('a temporal value with a date', value)
+
+# aggregating functions
+
+class Aggregate:
+    """One aggregating function call of a WITH/RETURN projection; its per-group
+    state is the list of non-null argument values."""
+
+    def __init__(self, name, distinct, args):
+        self.name = name
+        self.distinct = distinct
+        self.args = args
+        self.parameter = None
+
+    def add(self, state, row):
+        if self.args is None:
+            state.append(True)
+            return
+        value = self.args[0](row)
+        if len(self.args) > 1 and self.parameter is None:
+            self.parameter = self.args[1](row)
+        if value is not None:
+            state.append(value)
+
+    def result(self, values):
+        if self.distinct:
+            values = distinct_values(values)
+        name = self.name
+        if name == 'count':
+            return len(values)
+        if name == 'collect':
+            return list(values)
+        if name in ('min', 'max'):
+            if not values:
+                return None
+            return (min if name == 'min' else max)(values, key=order_key)
+        if any(isinstance(v, Duration) for v in values):
+            if not all(isinstance(v, Duration) for v in values) or name not in ('sum', 'avg'):
+                raise CypherError(f"{name}() can only handle numerical values, durations, and null")
+            total = functools.reduce(add, values, Duration())
+            return total if name == 'sum' else (scale(total, 1 / len(values)) if values else None)
+        for v in values:
+            if not is_number(v):
+                raise CypherError(f"{name}() can only handle numerical values, durations, and null. Got {type_name(v)}")
+        if name == 'sum':
+            return sum(values)
+        if name == 'avg':
+            return sum(values) / len(values) if values else None
+        if name in ('stdev', 'stdevp'):
+            if len(values) < 2:
+                return 0.0
+            return statistics.stdev(values) if name == 'stdev' else statistics.pstdev(values)
+        if not values:
+            return None
+        values = sorted(values)
+        p = self.parameter
+        if p is None or not is_number(p) or not 0 <= p <= 1:
+            raise CypherError(f"Invalid input '{p}' is not a valid argument, must be a number in the range 0.0 to 1.0")
+        if name == 'percentiledisc':
+            return values[max(0, math.ceil(p * len(values)) - 1)]
+        position = p * (len(values) - 1)
+        low = math.floor(position)
+        high = min(low + 1, len(values) - 1)
+        return float(values[low] + (values[high] - values[low]) * (position - low))
+
+def export(value):
+    """Converts a value like Record.data() of the Neo4j driver: nodes become
+    their property maps and relationships (start, type, end) tuples."""
+    if isinstance(value, Node):
+        return dict(value.props)
+    if isinstance(value, Relationship):
+        return (dict(value.start.props), value.type, dict(value.end.props))
+    if isinstance(value, list):
+        return [export(v) for v in value]
+    if isinstance(value, dict):
+        return {k: export(v) for k, v in value.items()}
+    return value
+
+def split_and(expr):
+    if expr is None:
+        return []
+    if expr[0] == 'and':
+        return split_and(expr[1]) + split_and(expr[2])
+    return [expr]
+
+class Execution:
+    """One run of a parsed query on a LocalEKG. Iterating it yields the
+    records lazily, so only as many rows are matched as are consumed.
+    db_hits counts the nodes and relationships visited and rows the rows
+    produced by all clauses, like the totals of a Neo4j PROFILE; operators
+    lists the planned operators under their Neo4j names."""
+
+    def __init__(self, graph, tree, timeout=None):
+        self.graph = graph
+        self.tree = tree
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.db_hits = 0
+        self.rows = 0
+        self.steps = 0
+        self.anonymous = 0
+        self.operators = []
+
+    def __iter__(self):
+        _, parts, all_flags = self.tree
+        if len(parts) > 1:
+            self.operators.append('Union')
+        records = itertools.chain.from_iterable(self.prepare(clauses)([{}]) for clauses in parts)
+        if not all(all_flags):
+            self.operators.append('Distinct')
+            records = self.distinct(records)
+        self.operators.append('ProduceResults')
+        for record in records:
+            yield {k: export(v) for k, v in record.items()}
+
+    def tick(self):
+        self.steps += 1
+        if not self.steps & 1023 and self.deadline and time.monotonic() > self.deadline:
+            raise QueryTimeout("The transaction has been terminated: the query exceeded its timeout")
+
+    def visit(self):
+        self.db_hits += 1
+        self.tick()
+
+    def counted(self, rows):
+        for row in rows:
+            self.rows += 1
+            yield row
+
+    def distinct(self, rows):
+        seen = set()
+        for row in rows:
+            key = tuple((k, hashkey(v)) for k, v in row.items())
+            if key not in seen:
+                seen.add(key)
+                yield row
+
+    def prepare(self, clauses):
+        """Compiles clauses into a function from input rows to output rows; subqueries
+        are prepared once and then run for every outer row."""
+        stages = [getattr(self, 'prepare_' + clause[0])(clause) for clause in clauses]
+        def run(rows):
+            for stage in stages:
+                rows = self.counted(stage(rows))
+            return rows
+        return run
+
+    # clauses
+
+    def prepare_unwind(self, clause):
+        _, expr, var = clause
+        fn = self.compile(expr)
+        self.operators.append('Unwind')
+        def unwind(rows):
+            for row in rows:
+                values = fn(row)
+                if values is None:
+                    continue
+                for value in values if isinstance(values, list) else [values]:
+                    self.tick()
+                    out = dict(row)
+                    out[var] = value
+                    yield out
+        return unwind
+
+    def prepare_with(self, clause):
+        _, projection, where = clause
+        project = self.prepare_projection(projection)
+        if where is None:
+            return project
+        fn = self.compile(where)
+        self.operators.append('Filter')
+        return lambda rows: (row for row in project(rows) if truth(fn(row)))
+
+    def prepare_return(self, clause):
+        return self.prepare_projection(clause[1])
+
+    def prepare_match(self, clause):
+        _, optional, paths, where = clause
+        paths = [self.name_anonymous(path) for path in paths]
+        named = [v for path in paths for v in self.path_names(path) if not v.startswith(' ')]
+        anonymous = [v for path in paths for v in self.path_names(path) if v.startswith(' ')]
+        conjuncts = [(variables(c), self.compile(c)) for c in split_and(where)]
+        props = {id(spec): self.compile_props(spec[2])
+                 for path in paths for spec in path[1] + path[2]}
+        if optional:
+            self.operators.append('Optional')
+        plans = {}
+
+        def match(rows):
+            for row in rows:
+                scope = frozenset(row)
+                plan = plans.get(scope)
+                if plan is None:
+                    plan = plans[scope] = self.plan(paths, scope, conjuncts, props)
+                matched = False
+                for out, _ in self.expand(plan, 0, row, ()):
+                    matched = True
+                    for v in anonymous:
+                        out.pop(v, None)
+                    yield out
+                if optional and not matched:
+                    out = dict(row)
+                    for v in named:
+                        out.setdefault(v, None)
+                    yield out
+        return match
+
+    # pattern matching
+
+    def name_anonymous(self, path):
+        """Gives unnamed nodes and relationships internal names starting with a space."""
+        def named(spec):
+            if spec[0]:
+                return spec
+            self.anonymous += 1
+            return (f' {self.anonymous}',) + spec[1:]
+        _, nodes, rels = path
+        return ('path', [named(n) for n in nodes], [named(r) for r in rels])
+
+    @staticmethod
+    def path_names(path):
+        return [spec[0] for spec in path[1] + path[2]]
+
+    def compile_props(self, props):
+        return [] if props is None else [(key, self.compile(expr)) for key, expr in props[1]]
+
+    def estimate(self, node, bound):
+        """Estimated number of candidates of a node pattern when matching starts there."""
+        var, labels, props = node
+        if var in bound:
+            return 0
+        label = labels[0] if labels else None
+        if props is not None and props[1]:
+            key, expr = props[1][0]
+            if expr[0] == 'lit':
+                return len(self.graph.index(label, key).get(hashkey(expr[1]), ()))
+            return len(self.graph.label_nodes(label)) / 10
+        return len(self.graph.label_nodes(label))
+
+    def plan(self, paths, bound, conjuncts, props):
+        """Orders the node scans and expansions of a MATCH: paths connected to
+        bound variables first, each starting at its bound or most selective node.
+        Every WHERE conjunct is evaluated right after the step that binds its
+        last variable."""
+        bound = set(bound)
+        steps, bound_after = [], []
+        remaining = list(paths)
+        while remaining:
+            path = next((p for p in remaining if any(n[0] in bound for n in p[1])), None)
+            if path is None:
+                path = min(remaining, key=lambda p: min(self.estimate(n, bound) for n in p[1]))
+            remaining.remove(path)
+            _, nodes, rels = path
+            start = min(range(len(nodes)), key=lambda i: self.estimate(nodes[i], bound))
+            node = nodes[start]
+            steps.append(('node', node[0], node[1], props[id(node)]))
+            self.operators.append('Argument' if node[0] in bound else 'NodeIndexSeek' if node[2]
+                                  else 'NodeByLabelScan' if node[1] else 'AllNodesScan')
+            bound.add(node[0])
+            bound_after.append(set(bound))
+            order = [(i, i + 1, rels[i], rels[i][3]) for i in range(start, len(rels))]
+            flipped = {'out': 'in', 'in': 'out', 'both': 'both'}
+            order += [(i, i - 1, rels[i - 1], flipped[rels[i - 1][3]]) for i in range(start, 0, -1)]
+            for source, target, rel, direction in order:
+                target_node = nodes[target]
+                into = target_node[0] in bound
+                steps.append(('rel', rel[0], rel[1], props[id(rel)], direction, rel[4],
+                              nodes[source][0], target_node[0], target_node[1], props[id(target_node)]))
+                self.operators.append(('VarLengthExpand' if rel[4] else 'Expand') + ('(Into)' if into else '(All)'))
+                bound |= {rel[0], target_node[0]}
+                bound_after.append(set(bound))
+        filters = [[] for _ in steps]
+        for names, fn in conjuncts:
+            index = next((i for i, b in enumerate(bound_after) if names <= b), len(steps) - 1)
+            filters[index].append(fn)
+        if conjuncts:
+            self.operators.append('Filter')
+        return list(zip(steps, filters))
+
+    def expand(self, plan, i, row, used):
+        if i == len(plan):
+            yield row, used
+            return
+        step, filters = plan[i]
+        matches = self.match_node(step, row, used) if step[0] == 'node' else self.match_rel(step, row, used)
+        for out, out_used in matches:
+            if all(truth(f(out)) for f in filters):
+                yield from self.expand(plan, i + 1, out, out_used)
+
+    def node_matches(self, node, labels, props, row):
+        for label in labels:
+            if label not in node.labels:
+                return False
+        for key, fn in props:
+            if equals(node.props.get(key), fn(row)) is not True:
+                return False
+        return True
+
+    def match_node(self, step, row, used):
+        _, var, labels, props = step
+        if var in row:
+            node = row[var]
+            if node is None:
+                return
+            if not isinstance(node, Node):
+                raise mismatch('Node', node)
+            if self.node_matches(node, labels, props, row):
+                yield row, used
+            return
+        label = labels[0] if labels else None
+        if props:
+            key, fn = props[0]
+            value = fn(row)
+            if value is None:
+                return
+            candidates = self.graph.index(label, key).get(hashkey(value), ())
+        else:
+            candidates = self.graph.label_nodes(label)
+        for node in candidates:
+            self.visit()
+            if self.node_matches(node, labels, props, row):
+                out = dict(row)
+                out[var] = node
+                yield out, used
+
+    def match_rel(self, step, row, used):
+        _, var, types, rel_props, direction, length, source, target, labels, props = step
+        node = row[source]
+        if node is None:
+            return
+        if not isinstance(node, Node):
+            raise mismatch('Node', node)
+        if length:
+            candidates = self.var_length(node, types, rel_props, direction, length, used, row)
+        else:
+            candidates = ((rel, other) for rel, other in self.graph.neighbours(node, types, direction)
+                          if rel.id not in used)
+        bound_rel = row.get(var) if var in row else False
+        for rel, other in candidates:
+            self.visit()
+            if bound_rel is not False and bound_rel is not rel:
+                continue
+            if not length and rel_props and not self.node_matches(rel, (), rel_props, row):
+                continue
+            if target in row:
+                if row[target] is not other:
+                    continue
+                out = dict(row)
+            else:
+                if not self.node_matches(other, labels, props, row):
+                    continue
+                out = dict(row)
+                out[target] = other
+            out[var] = rel
+            new_ids = tuple(r.id for r in rel) if length else (rel.id,)
+            yield out, used + new_ids
+
+    def var_length(self, node, types, rel_props, direction, length, used, row):
+        """Yields (relationship list, end node) of all paths with length[0] to length[1] hops."""
+        low, high = length
+        stack = [(node, [])]
+        while stack:
+            current, rels = stack.pop()
+            if len(rels) >= low:
+                yield rels, current
+            if high is not None and len(rels) >= high:
+                continue
+            for rel, other in self.graph.neighbours(current, types, direction):
+                self.visit()
+                if rel.id in used or any(r is rel for r in rels):
+                    continue
+                if rel_props and not self.node_matches(rel, (), rel_props, row):
+                    continue
+                stack.append((other, rels + [rel]))
+
+    # projections
+
+    def prepare_projection(self, projection):
+        """Compiles a WITH/RETURN projection with its DISTINCT, ORDER BY, SKIP and LIMIT."""
+        if projection['items'] == '*':
+            # the columns of * are only known from the rows
+            def project_all(rows):
+                rows = iter(rows)
+                first = next(rows, None)
+                if first is None:
+                    return iter(())
+                items = [(('var', name), name) for name in sorted(first) if not name.startswith(' ')]
+                return self.prepare_items(projection, items)(itertools.chain([first], rows))
+            return project_all
+        return self.prepare_items(projection, projection['items'])
+
+    def prepare_items(self, projection, items):
+        aggregates = []
+        fns = [(alias, self.compile(expr, aggregates)) for expr, alias in items]
+        aggregating = any(contains_aggregate(expr) for expr, _ in items)
+        self.operators.append('EagerAggregation' if aggregating else 'Projection')
+        if projection['distinct']:
+            self.operators.append('Distinct')
+        order = [(self.order_function(expr, items), descending) for expr, descending in projection['order']]
+        if order:
+            self.operators.append('Sort')
+        skip = self.count_argument(projection['skip'], 'SKIP')
+        limit = self.count_argument(projection['limit'], 'LIMIT')
+        if skip or limit is not None:
+            self.operators.append('Limit' if limit is not None else 'Skip')
+
+        def project(rows):
+            if aggregating:
+                pairs = self.aggregate(items, fns, aggregates, rows)
+            else:
+                pairs = ((row, {alias: fn(row) for alias, fn in fns}) for row in rows)
+            if projection['distinct']:
+                pairs = self.distinct_pairs(pairs)
+            if order:
+                pairs = list(pairs)
+                for key, descending in reversed(order):
+                    pairs.sort(key=lambda pair: order_key(key(*pair)), reverse=descending)
+            if skip or limit is not None:
+                pairs = itertools.islice(pairs, skip, None if limit is None else skip + limit)
+            return (out for _, out in pairs)
+        return project
+
+    def aggregate(self, items, fns, aggregates, rows):
+        keys = [i for i, (expr, _) in enumerate(items) if not contains_aggregate(expr)]
+        groups = {}
+        for row in rows:
+            self.tick()
+            values = [fns[i][1](row) for i in keys]
+            key = tuple(hashkey(v) for v in values)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = (row, values, [[] for _ in aggregates])
+            for aggregate, state in zip(aggregates, group[2]):
+                aggregate.add(state, row)
+        if not groups and not keys:
+            # aggregating over no rows without grouping keys still returns one row
+            groups[()] = ({}, [], [[] for _ in aggregates])
+        for row, values, states in groups.values():
+            env = dict(row)
+            env[AGG] = [aggregate.result(state) for aggregate, state in zip(aggregates, states)]
+            key_values = dict(zip(keys, values))
+            out = {alias: key_values[i] if i in key_values else fn(env) for i, (alias, fn) in enumerate(fns)}
+            yield env, out
+
+    def distinct_pairs(self, pairs):
+        seen = set()
+        for row, out in pairs:
+            key = tuple(hashkey(v) for v in out.values())
+            if key not in seen:
+                seen.add(key)
+                yield row, out
+
+    def order_function(self, expr, items):
+        """ORDER BY sees the projected columns and, without aggregation, the variables before the projection."""
+        alias = next((a for e, a in items if e == expr), None)
+        if alias is not None:
+            return lambda row, out: out[alias]
+        fn = self.compile(expr)
+        return lambda row, out: fn({**row, **out})
+
+    def count_argument(self, expr, clause):
+        if expr is None:
+            return 0 if clause == 'SKIP' else None
+        value = self.compile(expr)({})
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise CypherError(f"Invalid input. '{value}' is not a valid value. Must be a non-negative integer.")
+        return value
+
+    # expressions
+
+    def compile(self, expr, aggregates=None):
+        """Compiles an expression into a function of the row (a dict of variable
+        values). Aggregating function calls are registered in aggregates and
+        read their per-group result from the row."""
+        kind = expr[0]
+        compile = lambda e: self.compile(e, aggregates)
+
+        if kind == 'lit':
+            value = expr[1]
+            return lambda row: value
+        if kind == 'var':
+            name = expr[1]
+            return lambda row: row[name]
+        if kind == 'prop':
+            target, key = compile(expr[1]), expr[2]
+            def prop(row):
+                value = target(row)
+                if type(value) is Node:
+                    return value.props.get(key)
+                return get_property(value, key)
+            return prop
+        if kind == 'index':
+            target, index = compile(expr[1]), compile(expr[2])
+            def item(row):
+                value, i = target(row), index(row)
+                if value is None or i is None:
+                    return None
+                if isinstance(value, list):
+                    if not isinstance(i, int) or isinstance(i, bool):
+                        raise mismatch('Integer', i)
+                    return value[i] if -len(value) <= i < len(value) else None
+                if isinstance(i, str):
+                    return get_property(value, i)
+                raise mismatch('List or Map', value)
+            return item
+        if kind == 'slice':
+            target = compile(expr[1])
+            low = compile(expr[2]) if expr[2] is not None else (lambda row: 0)
+            high = compile(expr[3]) if expr[3] is not None else (lambda row: None)
+            def sliced(row):
+                value = target(row)
+                if value is None:
+                    return None
+                if not isinstance(value, list):
+                    raise mismatch('List', value)
+                return value[low(row):high(row)]
+            return sliced
+        if kind == 'arith':
+            op, left, right = ARITHMETIC[expr[1]], compile(expr[2]), compile(expr[3])
+            return lambda row: op(left(row), right(row))
+        if kind == 'neg':
+            operand = compile(expr[1])
+            def neg(row):
+                value = operand(row)
+                if value is None:
+                    return None
+                if is_number(value) or isinstance(value, Duration):
+                    return -value
+                raise mismatch('Number or Duration', value)
+            return neg
+        if kind == 'cmp':
+            op, left, right = COMPARISONS[expr[1]], compile(expr[2]), compile(expr[3])
+            return lambda row: op(left(row), right(row))
+        if kind == 'and':
+            left, right = compile(expr[1]), compile(expr[2])
+            def conjunction(row):
+                a = boolean(left(row))
+                if a is False:
+                    return False
+                b = boolean(right(row))
+                if b is False:
+                    return False
+                return None if a is None or b is None else True
+            return conjunction
+        if kind == 'or':
+            left, right = compile(expr[1]), compile(expr[2])
+            def disjunction(row):
+                a = boolean(left(row))
+                if a is True:
+                    return True
+                b = boolean(right(row))
+                if b is True:
+                    return True
+                return None if a is None or b is None else False
+            return disjunction
+        if kind == 'xor':
+            left, right = compile(expr[1]), compile(expr[2])
+            def exclusive(row):
+                a, b = boolean(left(row)), boolean(right(row))
+                return None if a is None or b is None else a != b
+            return exclusive
+        if kind == 'not':
+            operand = compile(expr[1])
+            def negation(row):
+                value = boolean(operand(row))
+                return None if value is None else not value
+            return negation
+        if kind == 'isnull':
+            operand, negated = compile(expr[1]), expr[2]
+            return lambda row: (operand(row) is None) != negated
+        if kind == 'in':
+            value, values = compile(expr[1]), compile(expr[2])
+            return lambda row: in_list(value(row), values(row))
+        if kind == 'strop':
+            op, left, right = expr[1], compile(expr[2]), compile(expr[3])
+            return lambda row: string_op(op, left(row), right(row))
+        if kind == 'haslabel':
+            target, labels = compile(expr[1]), expr[2]
+            def has_labels(row):
+                node = target(row)
+                if node is None:
+                    return None
+                if not isinstance(node, Node):
+                    raise mismatch('Node', node)
+                return all(label in node.labels for label in labels)
+            return has_labels
+        if kind == 'list':
+            items = [compile(e) for e in expr[1]]
+            return lambda row: [item(row) for item in items]
+        if kind == 'map':
+            entries = [(key, compile(e)) for key, e in expr[1]]
+            return lambda row: {key: fn(row) for key, fn in entries}
+        if kind == 'case':
+            return self.compile_case(expr, compile)
+        if kind in ('call', 'countstar'):
+            return self.compile_call(expr, aggregates)
+        if kind in ('listcomp', 'quant', 'reduce'):
+            return self.compile_list_function(expr, compile)
+        if kind in ('exists', 'countsub', 'patpred', 'patcomp'):
+            return self.compile_subquery(expr, compile)
+        raise CypherError(f"Unsupported expression: {kind}")
+
+    def compile_case(self, expr, compile):
+        _, subject, branches, default = expr
+        subject = compile(subject) if subject is not None else None
+        branches = [(compile(condition), compile(value)) for condition, value in branches]
+        default = compile(default)
+        def case(row):
+            if subject is None:
+                for condition, value in branches:
+                    if condition(row) is True:
+                        return value(row)
+            else:
+                v = subject(row)
+                for candidate, value in branches:
+                    if equals(v, candidate(row)) is True:
+                        return value(row)
+            return default(row)
+        return case
+
+    def compile_call(self, expr, aggregates):
+        if expr[0] == 'countstar':
+            name, distinct, args = 'count', False, None
+        else:
+            _, name, distinct, args = expr
+        if name in ('count', 'collect', 'sum', 'avg', 'min', 'max', 'stdev', 'stdevp',
+                    'percentilecont', 'percentiledisc'):
+            if aggregates is None:
+                raise CypherError(f"Invalid use of aggregating function {name}(...) in this context")
+            if args is not None and len(args) != (2 if name.startswith('percentile') else 1):
+                raise CypherError(f"Function {name}() called with {len(args)} arguments")
+            index = len(aggregates)
+            aggregates.append(Aggregate(name, distinct, None if args is None else [self.compile(a) for a in args]))
+            return lambda row: row[AGG][index]
+        if name not in FUNCTIONS:
+            raise CypherError(f"Unknown function '{name}'")
+        fn, low, high = FUNCTIONS[name]
+        if len(args) < low or (high is not None and len(args) > high):
+            raise CypherError(f"Function {name}() called with {len(args)} arguments")
+        args = [self.compile(a, aggregates) for a in args]
+        def call(row):
+            values = [a(row) for a in args]
+            try:
+                return fn(*values)
+            except CypherError:
+                raise
+            except (TypeError, AttributeError, ValueError, IndexError, OverflowError) as e:
+                raise CypherError(f"Invalid argument for {name}(): {e}")
+        return call
+
+    def compile_list_function(self, expr, compile):
+        kind = expr[0]
+        if kind == 'reduce':
+            _, acc, init, var, source, body = expr
+            init, source, body = compile(init), compile(source), compile(body)
+            def reduce(row):
+                values = source(row)
+                if values is None:
+                    return None
+                if not isinstance(values, list):
+                    raise mismatch('List', values)
+                scope = dict(row)
+                scope[acc] = init(row)
+                for value in values:
+                    self.tick()
+                    scope[var] = value
+                    scope[acc] = body(scope)
+                return scope[acc]
+            return reduce
+
+        if kind == 'listcomp':
+            _, var, source, where, projection = expr
+        else:
+            _, quantifier, var, source, where = expr
+            projection = None
+        source = compile(source)
+        where = compile(where) if where is not None else None
+        projection = compile(projection) if projection is not None else None
+
+        def results(row):
+            values = source(row)
+            if values is None:
+                return None
+            if not isinstance(values, list):
+                raise mismatch('List', values)
+            scope = dict(row)
+            out = []
+            for value in values:
+                self.tick()
+                scope[var] = value
+                out.append((value, boolean(where(scope)) if where is not None else True,
+                            projection(scope) if projection is not None else value))
+            return out
+
+        if kind == 'listcomp':
+            def comprehension(row):
+                out = results(row)
+                return None if out is None else [value for _, keep, value in out if keep is True]
+            return comprehension
+
+        def quantified(row):
+            out = results(row)
+            if out is None:
+                return None
+            verdicts = [keep for _, keep, _ in out]
+            unknown = None in verdicts
+            if quantifier == 'any':
+                return True if True in verdicts else None if unknown else False
+            if quantifier == 'all':
+                return False if False in verdicts else None if unknown else True
+            if quantifier == 'none':
+                return False if True in verdicts else None if unknown else True
+            matches = verdicts.count(True)
+            return False if matches > 1 else None if unknown else matches == 1
+        return quantified
+
+    def compile_subquery(self, expr, compile):
+        kind = expr[0]
+        if kind in ('exists', 'countsub'):
+            clauses = expr[1]
+        else:
+            clauses = [('match', False, [expr[1]], expr[2] if kind == 'patcomp' else None)]
+        self.operators.append('SemiApply' if kind in ('exists', 'patpred') else 'Apply')
+        # the subquery runs with the outer row in scope
+        run = self.prepare(clauses)
+        if kind in ('exists', 'patpred'):
+            return lambda row: next(iter(run([row])), None) is not None
+        if kind == 'countsub':
+            return lambda row: sum(1 for _ in run([row]))
+        projection = compile(expr[3])
+        return lambda row: [projection(out) for out in run([row])]
+
+class LocalEKG:
+    """An EKG held in memory: nodes with labels and properties, relationships
+    in per-node adjacency lists by type, and (label, property) indexes."""
+
+    def __init__(self):
+        self.nodes = []
+        self.relationships = []
+        self.by_label = {}
+        self.outgoing = []
+        self.incoming = []
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def add_node(self, labels, props):
+        node = Node(len(self.nodes), frozenset(labels), props)
+        self.nodes.append(node)
+        self.outgoing.append({})
+        self.incoming.append({})
+        for label in labels:
+            self.by_label.setdefault(label, []).append(node)
+        return node
+
+    def add_relationship(self, rel_type, start, end, props):
+        rel = Relationship(len(self.relationships), rel_type, start, end, props)
+        self.relationships.append(rel)
+        self.outgoing[start.id].setdefault(rel_type, []).append(rel)
+        self.incoming[end.id].setdefault(rel_type, []).append(rel)
+        return rel
+
+    def label_nodes(self, label):
+        return self.nodes if label is None else self.by_label.get(label, [])
+
+    def index(self, label, key):
+        """Returns the index value -> nodes of a label and property; built on first use."""
+        index = self.indexes.get((label, key))
+        if index is None:
+            with self.lock:
+                index = self.indexes.get((label, key))
+                if index is None:
+                    index = {}
+                    for node in self.label_nodes(label):
+                        value = node.props.get(key)
+                        if value is not None:
+                            index.setdefault(hashkey(value), []).append(node)
+                    self.indexes[(label, key)] = index
+        return index
+
+    def neighbours(self, node, types, direction):
+        """Yields (relationship, other node) of node's relationships of the given types."""
+        if direction in ('out', 'both'):
+            adjacency = self.outgoing[node.id]
+            for rel_type in types or list(adjacency):
+                for rel in adjacency.get(rel_type, ()):
+                    yield rel, rel.end
+        if direction in ('in', 'both'):
+            adjacency = self.incoming[node.id]
+            for rel_type in types or list(adjacency):
+                for rel in adjacency.get(rel_type, ()):
+                    yield rel, rel.start
+
+    def run(self, query, timeout=None):
+        """Parses query and returns its Execution, which yields the records as
+        dicts when iterated. Raises CypherError for invalid or unsupported
+        queries; iterating raises QueryTimeout after timeout seconds."""
+        return Execution(self, parsed(query), timeout)
+
+    def fingerprint(self):
+        """Returns the node count per label and relationship count per type."""
+        counts = {f"node:{label}": len(nodes) for label, nodes in self.by_label.items()}
+        for rel in self.relationships:
+            counts[f"rel:{rel.type}"] = counts.get(f"rel:{rel.type}", 0) + 1
+        return counts
+
+    @classmethod
+    def from_ocel(cls, ocel):
+        """Builds the EKG of a pm4py OCEL with the row builders of ocel_to_ekg.py."""
+        graph = cls()
+        events = {}
+        for row in records(event_rows(ocel)):
+            row['timestamp'] = parse_datetime(row['timestamp'])
+            events[row['EventID']] = graph.add_node([lbl_event], row)
+        entities = {}
+        for row in records(entity_rows(ocel)):
+            props = {k: v.to_pydatetime() if hasattr(v, 'to_pydatetime') else v
+                     for k, v in row.items() if v is not None}
+            entities[props['ID']] = graph.add_node([lbl_entity], props)
+        for row in records(rel_rows(ocel)):
+            graph.add_relationship(lbl_rel, entities[row['o1']], entities[row['o2']], {'qual': row['qual']})
+        for row in records(corr_rows(ocel)):
+            graph.add_relationship(lbl_corr, events[row['e']], entities[row['o']], {})
+        for row in records(df_rows(ocel)):
+            graph.add_relationship(lbl_df, events[row['e1']], events[row['e2']],
+                                   {'EntityType': row['EntityType'], 'EntityID': row['EntityID']})
+        return graph
+
+    @classmethod
+    def from_bulk_import(cls, directory):
+        """Loads the header+data CSV files written by ekg_bulk_import.py (the
+        neo4j-admin import format); node files before relationship files."""
+        graph = cls()
+        ids = {}
+        headers = sorted(f for f in os.listdir(directory) if f.endswith('_header.csv'))
+        files = []
+        for header_file in headers:
+            with open(os.path.join(directory, header_file), newline='', encoding='utf-8') as f:
+                header = next(csv.reader(f))
+            is_relationship = any(':START_ID' in column for column in header)
+            files.append((is_relationship, header, os.path.join(directory, header_file[:-len('_header.csv')] + '.csv')))
+        for is_relationship, header, data_file in sorted(files, key=lambda f: f[0]):
+            columns = [bulk_column(column) for column in header]
+            with open(data_file, newline='', encoding='utf-8') as f:
+                for values in csv.reader(f):
+                    props, labels, rel_type, start, end, node_id = {}, [], None, None, None, None
+                    for (name, field, group), value in zip(columns, values):
+                        if field == 'LABEL':
+                            labels = [label for label in value.split(';') if label]
+                        elif field == 'TYPE':
+                            rel_type = value
+                        elif field == 'START_ID':
+                            start = ids[group][value]
+                        elif field == 'END_ID':
+                            end = ids[group][value]
+                        else:
+                            if field == 'ID':
+                                node_id = (group, value)
+                            if name and value != '':
+                                props[name] = bulk_value(field, value)
+                    if is_relationship:
+                        graph.add_relationship(rel_type, start, end, props)
+                    else:
+                        node = graph.add_node(labels, props)
+                        if node_id is not None:
+                            ids.setdefault(node_id[0], {})[node_id[1]] = node
+        return graph
+
+def bulk_column(column):
+    """Splits a neo4j-admin header column like 'EventID:ID(Event)' into (name, type, id group)."""
+    name, _, field = column.partition(':')
+    group = None
+    if '(' in field:
+        field, group = field[:-1].split('(')
+    return name, field.upper() if field.upper() in ('ID', 'LABEL', 'TYPE', 'START_ID', 'END_ID') else field.lower(), group
+
+def bulk_value(field, value):
+    if field in ('long', 'int', 'short', 'byte'):
+        return int(value)
+    if field in ('double', 'float'):
+        return float(value)
+    if field == 'boolean':
+        return value.lower() == 'true'
+    if field == 'datetime':
+        return parse_datetime(value)
+    if field == 'localdatetime':
+        return parse_datetime(value, local=True)
+    if field == 'date':
+        return parse_date(value)
+    return value
+
+@functools.lru_cache(maxsize=4096)
+def parsed(query):
+    return parse(query)
+
+def load_ekg(path):
+    """Loads an EKG from a bulk-import directory (ekg_bulk_import.py) or from an OCEL 2.0 file."""
+    if os.path.isdir(path):
+        return LocalEKG.from_bulk_import(path)
+    import pm4py
+    return LocalEKG.from_ocel(pm4py.read.read_ocel2_json(path))
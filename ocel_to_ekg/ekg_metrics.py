@@ -0,0 +1,72 @@
+import json
+import os
+import resource
+import threading
+import time
+
+# Result counters of the Neo4j summaries that are summed up per stage
+COUNTERS = ['nodes_created', 'relationships_created', 'properties_set',
+            'labels_added', 'indexes_added', 'constraints_added']
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class IngestionMetrics:
+    """Collects per-stage ingestion metrics of an ocel_to_ekg run and writes
+    them as a JSON report, so ingestion runs can be compared across releases
+    and log sizes."""
+
+    def __init__(self):
+        self.stages = {}
+        self.current = None
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def start(self, action):
+        if self.current is not None:
+            raise RuntimeError(f"Stage {action} started while another stage is running; stages cannot be nested")
+        self.current = {'wall_time': 0.0, 'rows': 0, 'transactions': 0, 'bytes_read': 0}
+        self.current.update({c: 0 for c in COUNTERS})
+        self.stages[action] = self.current
+
+    def finish(self, wall_time, bytes_read=0):
+        stats = self.current
+        stats['wall_time'] = wall_time
+        stats['bytes_read'] += bytes_read
+        stats['rows_per_sec'] = stats['rows'] / wall_time if wall_time > 0 else 0.0
+        stats['peak_rss_mb'] = peak_rss_mb()
+        self.current = None
+
+    def record(self, rows, summary=None):
+        """Adds rows processed rows and, given its result summary, one committed
+        transaction; safe to call from worker threads."""
+        if self.current is None:
+            return
+        with self.lock:
+            self.current['rows'] += rows
+            if summary is not None:
+                self.current['transactions'] += 1
+                for c in COUNTERS:
+                    self.current[c] += getattr(summary.counters, c)
+
+    def add_bytes(self, n):
+        if self.current is not None:
+            self.current['bytes_read'] += n
+
+    def report(self, **run_info):
+        totals = {key: sum(s[key] for s in self.stages.values())
+                  for key in ['wall_time', 'rows', 'transactions', 'bytes_read'] + COUNTERS}
+        return {
+            'run': run_info,
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+            'peak_rss_mb': peak_rss_mb(),
+            'totals': totals,
+            'stages': self.stages,
+        }
+
+    def write(self, path, **run_info):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(**run_info), f, indent=2)
+        print(f"Metrics report saved to {path}")
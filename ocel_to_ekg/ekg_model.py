@@ -0,0 +1,172 @@
+import re
+import pandas as pd
+
+# EKG data model shared by the Neo4j loader (ocel_to_ekg.py) and the offline
+# bulk-import export (ekg_bulk_import.py). Everything here works on pm4py OCEL
+# objects and pandas frames only, so it can be used without a database.
+
+lbl_event = 'Event'
+lbl_entity =  'Entity'
+lbl_rel = 'REL'
+lbl_corr='CORR'
+lbl_df = 'DF'
+lbl_derived = 'DERIVED'
+lbl_snapshot = 'Snapshot'
+lbl_has_snapshot = 'SNAPSHOT'
+
+lbl_meta_node_log = 'node:Log'  
+lbl_meta_node_class = 'node:Class' 
+lbl_meta_node_event = 'node:Event' 
+lbl_meta_node_entity = 'node:Entity'
+lbl_meta_node_snapshot = 'node:Snapshot' 
+
+lbl_meta_node_entity_reified = 'node:Reified_Entity' 
+lbl_meta_node_snapshot_reified = 'node:Reified_Snapshot'
+
+lbl_meta_rel_log_has_event = 'rel:has' 
+lbl_meta_rel_event_observed_class = 'rel:observed'
+lbl_meta_rel_entity_snapshot_snapshot = 'rel:snapshot'  
+lbl_meta_rel_snapshot_rel_update_snapshot = 'rel:rel:SnapshotUpdate'  
+lbl_meta_rel_entity_rel_entity = 'rel:rel:Entity'
+lbl_meta_rel_snapshot_rel_snapshot = 'rel:rel:Snapshot' 
+
+lbl_meta_rel_derived = 'rel:derived' 
+
+
+lbl_meta_rel_event_corr = 'rel:corr' 
+lbl_meta_rel_event_corr_entity = 'rel:corr:Entity'
+lbl_meta_rel_event_corr_entity_reified = 'rel:corr:ReifiedEntity' 
+
+lbl_meta_rel_event_corr_snapshot  = 'rel:corr:Snapshot'
+lbl_meta_rel_event_corr_snapshot_reified  ='rel:corr:ReifiedSnapshot' 
+
+lbl_meta_rel_event_df_entity_event  ='rel_Event-df[entity]->Event'
+lbl_meta_rel_event_df_snapshot_event  ='rel_Event-df[snapshot]->Event'
+lbl_meta_rel_event_df_event='rel:df' 
+
+lbl_meta_schema = 'schema:index'
+lbl_meta_read = 'read:ocel'
+lbl_meta_export = 'export:bulk_import'
+
+# attribute strings that are taken for datetimes start with an ISO date
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def event_rows(ocel):
+    """Returns the Event node properties with timestamps formatted column-wise."""
+    events = ocel.events
+    return pd.DataFrame({
+        'EventID': events[ocel.event_id_column].astype(str),
+        'timestamp': events[ocel.event_timestamp].dt.strftime('%Y-%m-%dT%H:%M') + ':00.000+0100',
+        'Activity': events[ocel.event_activity].astype(str),
+    })
+
+def number_text(value):
+    """Returns a number as it would be written in a log: 12, 12.5."""
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+def parse_dates(values):
+    """Parses ISO datetimes. Values with different UTC offsets, e.g. on both sides
+    of a daylight saving change, are converted to UTC, as pandas keeps one
+    time zone per column."""
+    try:
+        return pd.to_datetime(values, errors='coerce', format='ISO8601')
+    except ValueError:  # mixed offsets, or offsets next to local times
+        return pd.to_datetime(values, errors='coerce', format='ISO8601', utc=True)
+
+def typed_column(col):
+    """Converts a string column to numbers or datetimes if all its values parse as
+    such without losing anything: each string must be the plain text of its
+    number, so values with leading zeros (IDs, zip codes, phone numbers) stay
+    strings, and datetimes must be ISO dates. Columns pm4py already parsed to
+    numbers or datetimes are kept as they are."""
+    if not (pd.api.types.is_object_dtype(col) or pd.api.types.is_string_dtype(col)):
+        return col
+    values = col.dropna()
+    if values.empty:
+        return col
+    strings = values.map(lambda v: isinstance(v, str)).astype(bool)
+    numeric = pd.to_numeric(values, errors='coerce')
+    if numeric.notna().all() and (numeric[strings].map(number_text) == values[strings]).all():
+        return pd.to_numeric(col, errors='coerce')
+    if values.astype(str).str.match(ISO_DATE).all():
+        dates = parse_dates(values)
+        if dates.notna().all():
+            return parse_dates(col)
+    return col
+
+def entity_rows(ocel):
+    """Returns the Entity node properties, one column per attribute with its
+    native type (number, datetime, string); missing values stay NaN/NaT. ID and
+    EntityType stay strings, as the REL/CORR rows refer to them."""
+    objects = ocel.objects.rename(columns={
+        ocel.object_id_column: 'ID',
+        ocel.object_type_column: 'EntityType',
+    })
+    for c in objects.columns:
+        if c not in ('ID', 'EntityType'):
+            objects[c] = typed_column(objects[c])
+    objects['ID'] = objects['ID'].astype(str)
+    objects['EntityType'] = objects['EntityType'].astype(str)
+    return objects
+
+def snapshot_rows(ocel):
+    """Returns the OCEL 2.0 object attribute changes as Snapshot rows, one frame
+    (EntityID, timestamp, value) per changed attribute, with typed values."""
+    changes = ocel.object_changes
+    if changes is None or changes.empty:
+        return {}
+    snapshots = {}
+    for field, group in changes.groupby(ocel.changed_field):
+        snapshots[field] = pd.DataFrame({
+            'EntityID': group[ocel.object_id_column].astype(str),
+            'timestamp': group[ocel.event_timestamp].dt.strftime('%Y-%m-%dT%H:%M') + ':00.000+0100',
+            'value': typed_column(group[field].astype(object)),
+        }).reset_index(drop=True)
+    return snapshots
+
+def records(df):
+    """Returns the rows of df as parameter maps; missing values become None, so
+    they are not stored as properties."""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+def rel_rows(ocel):
+    """Returns one (source, target, qualifier) row per distinct REL edge between entities."""
+    o2o = ocel.o2o
+    return pd.DataFrame({
+        'o1': o2o[ocel.object_id_column].astype(str),
+        'o2': o2o[ocel.object_id_column + '_2'].astype(str),
+        'qual': o2o[ocel.qualifier].astype(str),
+    }).drop_duplicates()
+
+def corr_rows(ocel):
+    """Returns one (event, entity) row per distinct CORR edge; qualifiers are not kept."""
+    relations = ocel.relations
+    return pd.DataFrame({
+        'e': relations[ocel.event_id_column].astype(str),
+        'o': relations[ocel.object_id_column].astype(str),
+    }).drop_duplicates()
+
+def df_rows(ocel, tails=None):
+    """Computes the DF edges client-side: per entity, each event is linked to the
+    next event correlated to it in timestamp order.
+
+    tails optionally holds the last event already in the graph per entity
+    (columns 'e1', 'EntityType', 'EntityID') when appending to an EKG; it is
+    linked to the first appended event of its entity."""
+    relations = ocel.relations.drop_duplicates([ocel.event_id_column, ocel.object_id_column])
+    relations = relations.sort_values([ocel.object_id_column, ocel.event_timestamp], kind='stable')
+    rows = pd.DataFrame({
+        'e1': relations[ocel.event_id_column].astype(str),
+        'e2': relations[ocel.event_id_column].astype(str),
+        'EntityType': relations[ocel.object_type_column].astype(str),
+        'EntityID': relations[ocel.object_id_column].astype(str),
+    })
+    if tails is not None and len(tails):
+        # stable sort on the entity keeps each tail in front of the appended events
+        rows = pd.concat([tails.assign(e2=tails['e1'])[rows.columns], rows])
+        rows = rows.sort_values('EntityID', kind='stable')
+    rows['e2'] = rows.groupby('EntityID', sort=False)['e2'].shift(-1)
+    rows = rows.dropna(subset=['e2'])
+    return rows.reset_index(drop=True)
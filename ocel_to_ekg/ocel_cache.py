@@ -0,0 +1,51 @@
+import hashlib
+import json
+import os
+import shutil
+import pandas as pd
+import pm4py
+from pm4py.objects.ocel.obj import OCEL
+
+# Columnar cache of parsed OCEL logs. Parsing the OCEL JSON with pm4py
+# dominates start-up time of repeated ingestions, so the parsed tables are
+# stored as Parquet under a key of the source file's content hash and the
+# converter version, and memory-mapped on subsequent runs instead of re-parsing.
+
+# bump when the cached tables change, e.g. how they are derived from the log
+CACHE_VERSION = 1
+TABLES = ['events', 'objects', 'relations', 'o2o', 'object_changes']
+
+def file_hash(file_path):
+    h = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def cache_key(file_path):
+    return file_hash(file_path) + '-v' + str(CACHE_VERSION) + '-pm4py' + pm4py.__version__
+
+def read_ocel_cached(file_path, cache_dir):
+    """Returns the OCEL of file_path from cache_dir, parsing and caching it on a miss."""
+    entry = os.path.join(cache_dir, cache_key(file_path))
+    if os.path.exists(os.path.join(entry, 'meta.json')):
+        print(f"Reading parsed OCEL from cache {entry}")
+        return OCEL(**{t: pd.read_parquet(os.path.join(entry, t + '.parquet'), memory_map=True) for t in TABLES})
+
+    ocel = pm4py.read.read_ocel2_json(file_path)
+
+    # written to a temporary directory first, so an interrupted run leaves no partial entry
+    tmp = entry + '.tmp'
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        for t in TABLES:
+            getattr(ocel, t).to_parquet(os.path.join(tmp, t + '.parquet'), index=False)
+    except Exception as e:
+        print(f"Error: Could not cache parsed OCEL: {str(e)}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return ocel
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'source': file_path, 'cache_version': CACHE_VERSION, 'pm4py': pm4py.__version__}, f)
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp, entry)
+    return ocel
@@ -0,0 +1,76 @@
+import ijson
+import pandas as pd
+from pm4py.objects.ocel.obj import OCEL
+
+# Streaming reader for OCEL 2.0 JSON logs that do not fit into memory next to
+# the Neo4j heap. Instead of pm4py.read.read_ocel2_json, the file is parsed
+# incrementally with ijson and handed to the loader as small OCEL objects with
+# the usual pm4py column names, so the ekg_model row builders apply unchanged.
+# Each reader makes one pass over the file; peak memory is bounded by
+# chunk_size, apart from the object id -> type map the E2O rows need.
+
+EVENT_COLUMNS = ['ocel:eid', 'ocel:activity', 'ocel:timestamp']
+OBJECT_COLUMNS = ['ocel:oid', 'ocel:type']
+RELATION_COLUMNS = ['ocel:eid', 'ocel:activity', 'ocel:timestamp', 'ocel:oid', 'ocel:type', 'ocel:qualifier']
+O2O_COLUMNS = ['ocel:oid', 'ocel:oid_2', 'ocel:qualifier']
+
+# bytes consumed from OCEL files by all passes so far
+bytes_read = 0
+
+def _items(file_path, prefix):
+    global bytes_read
+    with open(file_path, 'rb') as f:
+        try:
+            yield from ijson.items(f, prefix, use_float=True)
+        finally:
+            bytes_read += f.tell()
+
+def _chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _ocel(events=None, objects=None, relations=None, o2o=None):
+    return OCEL(
+        events=events if events is not None else pd.DataFrame(columns=EVENT_COLUMNS),
+        objects=objects if objects is not None else pd.DataFrame(columns=OBJECT_COLUMNS),
+        relations=relations if relations is not None else pd.DataFrame(columns=RELATION_COLUMNS),
+        o2o=o2o if o2o is not None else pd.DataFrame(columns=O2O_COLUMNS),
+    )
+
+def read_object_types(file_path):
+    """Returns the object id -> object type map used to type the E2O relations."""
+    return {o['id']: o['type'] for o in _items(file_path, 'objects.item')}
+
+def read_objects(file_path, chunk_size):
+    """Yields OCEL chunks holding up to chunk_size objects and their O2O relations.
+    Objects keep the first value of each attribute, as in pm4py's objects table."""
+    for chunk in _chunks(_items(file_path, 'objects.item'), chunk_size):
+        objects = []
+        o2o = []
+        for o in chunk:
+            row = {'ocel:oid': o['id'], 'ocel:type': o['type']}
+            for att in o.get('attributes') or []:
+                row.setdefault(att['name'], att['value'])
+            objects.append(row)
+            for r in o.get('relationships') or []:
+                o2o.append((o['id'], r['objectId'], r.get('qualifier', '')))
+        yield _ocel(objects=pd.DataFrame(objects),
+                    o2o=pd.DataFrame(o2o, columns=O2O_COLUMNS))
+
+def read_events(file_path, chunk_size, object_types):
+    """Yields OCEL chunks holding up to chunk_size events and their E2O relations."""
+    for chunk in _chunks(_items(file_path, 'events.item'), chunk_size):
+        events = pd.DataFrame([(e['id'], e['type'], e['time']) for e in chunk], columns=EVENT_COLUMNS)
+        events['ocel:timestamp'] = pd.to_datetime(events['ocel:timestamp'], format='ISO8601')
+        relations = pd.DataFrame(
+            [(e['id'], r['objectId'], r.get('qualifier', '')) for e in chunk for r in e.get('relationships') or []],
+            columns=['ocel:eid', 'ocel:oid', 'ocel:qualifier'])
+        relations = relations.merge(events, on='ocel:eid')
+        relations['ocel:type'] = relations['ocel:oid'].map(object_types)
+        yield _ocel(events=events, relations=relations[RELATION_COLUMNS])
@@ -1,188 +1,348 @@
 import time
+from concurrent.futures import ThreadPoolExecutor
 import pm4py
+import pandas as pd
 from neo4j import GraphDatabase
 import os
+from ekg_model import *
+from ekg_bulk_import import export_bulk_import
+import ocel_stream
+from ocel_stream import read_object_types, read_objects, read_events
+from ekg_metrics import IngestionMetrics
+from ocel_cache import read_ocel_cached
 
 #SETUP - adjust as needed
 experiment_name = 'order-management' 
 file_path = os.path.join("ocel2", experiment_name + ".jsonocel")
 
+# 'row' sends one CREATE statement per event/object, 'batched' sends parameter
+# batches of batch_size rows through a single UNWIND statement per batch,
+# 'bulk_import' writes neo4j-admin import files to export_dir instead of loading
+ingestion_mode = 'batched'
+batch_size = 10000
+export_dir = os.path.join("bulk_import", experiment_name)
 
-lbl_event = 'Event'
-lbl_entity =  'Entity'
-lbl_rel = 'REL'
-lbl_corr='CORR'
-lbl_df = 'DF'
-lbl_derived = 'DERIVED'
+# worker threads, each with its own session, that load the REL/CORR batches
+# of 'batched' mode in parallel
+edge_workers = 4
 
-lbl_meta_node_log = 'node:Log'  
-lbl_meta_node_class = 'node:Class' 
-lbl_meta_node_event = 'node:Event' 
-lbl_meta_node_entity = 'node:Entity'
-lbl_meta_node_snapshot = 'node:Snapshot' 
+# stream the OCEL file in chunks of stream_chunk_size events/objects instead of
+# loading it into memory with pm4py (not combinable with 'bulk_import')
+streaming = False
+stream_chunk_size = 50000
 
-lbl_meta_node_entity_reified = 'node:Reified_Entity' 
-lbl_meta_node_snapshot_reified = 'node:Reified_Snapshot'
+# directory of the parsed-OCEL cache (Parquet tables keyed by the file's
+# content hash), None parses the file with pm4py on every run
+cache_dir = "cache"
 
-lbl_meta_rel_log_has_event = 'rel:has' 
-lbl_meta_rel_event_observed_class = 'rel:observed'
-lbl_meta_rel_entity_snapshot_snapshot = 'rel:snapshot'  
-lbl_meta_rel_snapshot_rel_update_snapshot = 'rel:rel:SnapshotUpdate'  
-lbl_meta_rel_entity_rel_entity = 'rel:rel:Entity'
-lbl_meta_rel_snapshot_rel_snapshot = 'rel:rel:Snapshot' 
+# append only the events/objects of the file that are not yet in the graph
+# (by EventID/ID) instead of wiping and reloading it; appended events are
+# assumed to follow the events already loaded for their entities
+append = False
 
-lbl_meta_rel_derived = 'rel:derived' 
+# seconds to wait for constraints/indexes to come online before loading edges
+index_timeout = 600
 
-
-lbl_meta_rel_event_corr = 'rel:corr' 
-lbl_meta_rel_event_corr_entity = 'rel:corr:Entity'
-lbl_meta_rel_event_corr_entity_reified = 'rel:corr:ReifiedEntity' 
-
-lbl_meta_rel_event_corr_snapshot  = 'rel:corr:Snapshot'
-lbl_meta_rel_event_corr_snapshot_reified  ='rel:corr:ReifiedSnapshot' 
-
-lbl_meta_rel_event_df_entity_event  ='rel_Event-df[entity]->Event'
-lbl_meta_rel_event_df_snapshot_event  ='rel_Event-df[snapshot]->Event'
-lbl_meta_rel_event_df_event='rel:df' 
+# JSON report with per-stage wall time, rows, transactions, bytes read,
+# peak RSS and Neo4j result counters of this run
+metrics_path = os.path.join("metrics", experiment_name + "_" + time.strftime('%Y%m%d-%H%M%S') + ".json")
 
 meta_time = {}
+metrics = IngestionMetrics()
 
 # Connection Details - adjust as needed
 URI  = 'bolt://localhost:7687'
 AUTH = ('neo4j', '12341234')
 
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    driver.verify_connectivity()
-    
-ocel = pm4py.read.read_ocel2_json(file_path)
+def timed(action, stage, *args):
+    """Runs a loading stage and records its wall time in meta_time and its metrics under action."""
+    metrics.start(action)
+    read = ocel_stream.bytes_read
+    start = time.time()
+    result = stage(*args)
+    end = time.time()
+    print(end - start)
+    meta_time[action] =  end - start
+    metrics.finish(end - start, ocel_stream.bytes_read - read)
+    return result
+
+def execute(driver, query, count=1, **params):
+    """Runs a single statement over count input rows and records it in the metrics of the current stage."""
+    _, summary, _ = driver.execute_query(query, **params)
+    metrics.record(count, summary)
+
+def run_batched(driver, query, df, **params):
+    """Sends df in batches of batch_size rows as the $rows parameter of query."""
+    for start in range(0, len(df), batch_size):
+        batch = records(df.iloc[start:start + batch_size])
+        execute(driver, query, count=len(batch), rows=batch, **params)
+
+def partitions(df, column, n):
+    """Splits df into n partitions by the hash of column, so all rows of a node stay in one partition."""
+    keys = pd.util.hash_pandas_object(df[column], index=False) % n
+    return [df[keys.values == i] for i in range(n)]
+
+def run_partitioned(driver, query, df, column):
+    """Like run_batched, but the rows are partitioned by column and each partition
+    is loaded on its own worker session. Batches of different partitions touch
+    disjoint nodes of column; lock conflicts on the other end node surface as
+    transient deadlock errors, which execute_write retries."""
+    def load(part):
+        with driver.session() as session:
+            for start in range(0, len(part), batch_size):
+                rows = records(part.iloc[start:start + batch_size])
+                summary = session.execute_write(lambda tx: tx.run(query, rows=rows).consume())
+                metrics.record(len(rows), summary)
+
+    with ThreadPoolExecutor(max_workers=edge_workers) as pool:
+        list(pool.map(load, partitions(df, column, edge_workers)))
+
+def read_ocel(file_path):
+    """Parses the OCEL file, or reads its parsed tables from cache_dir if set; run
+    through timed, which records it as the read stage."""
+    if cache_dir is not None:
+        ocel = read_ocel_cached(file_path, cache_dir)
+    else:
+        ocel = pm4py.read.read_ocel2_json(file_path)
+    metrics.record(len(ocel.events) + len(ocel.objects))
+    metrics.add_bytes(os.path.getsize(file_path))
+    return ocel
 
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    driver.execute_query('MATCH (a) DETACH DELETE a')
-    
 #Event Nodes
-action = lbl_meta_node_event
-start = time.time()
-
-
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    for idx, row in ocel.events.iterrows():
-        driver.execute_query("CREATE (:"+lbl_event+" {EventID: '"+
-            row[ocel.event_id_column]+
-            "', timestamp: datetime('"+
-            str(row[ocel.event_timestamp].strftime('%Y-%m-%dT%H:%M')+':00.000+0100')+
-            "'), Activity:'"+
-            row[ocel.event_activity]+
-            "'})")
-
-end = time.time()
-print(end - start)
-meta_time[action] =  end - start
+def create_event_nodes(driver, ocel):
+    if ingestion_mode == 'batched':
+        run_batched(driver,
+            "UNWIND $rows AS row " +
+            "CREATE (:"+lbl_event+" {EventID: row.EventID, timestamp: datetime(row.timestamp), Activity: row.Activity})",
+            event_rows(ocel))
+    else:
+        for idx, row in ocel.events.iterrows():
+            execute(driver, "CREATE (:"+lbl_event+" {EventID: '"+
+                row[ocel.event_id_column]+
+                "', timestamp: datetime('"+
+                str(row[ocel.event_timestamp].strftime('%Y-%m-%dT%H:%M')+':00.000+0100')+
+                "'), Activity:'"+
+                row[ocel.event_activity]+
+                "'})")
 
 #Entity Nodes
-action = lbl_meta_node_entity
-start = time.time()
-
-cols = list(ocel.objects.columns)
-def map(n):
-    return '`'+n.replace(ocel.object_id_column, "ID").replace(ocel.object_type_column, "EntityType")+'`'
-
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    for idx, rows in ocel.objects.fillna('').iterrows():
-            atts = [map(c)+":'"+str(rows[c])+"'" for c in cols]
-            res = ""
-            for a in atts:
-                res = res + a + ", "
-        
-                
-            driver.execute_query("CREATE (:"+lbl_entity+" {"+
-                  res[:-2] +
-                 "})"
-                 )
-        
-end = time.time()
-print(end - start)
-meta_time[action] =  end - start
+def create_entity_nodes(driver, ocel):
+    if ingestion_mode == 'batched':
+        run_batched(driver,
+            "UNWIND $rows AS row " +
+            "CREATE (n:"+lbl_entity+") SET n = row",
+            entity_rows(ocel))
+    else:
+        cols = list(ocel.objects.columns)
+        def map_column(n):
+            return n.replace(ocel.object_id_column, "ID").replace(ocel.object_type_column, "EntityType")
+
+        for idx, rows in ocel.objects.fillna('').iterrows():
+                atts = ['`'+map_column(c)+"`:'"+str(rows[c])+"'" for c in cols]
+                res = ""
+                for a in atts:
+                    res = res + a + ", "
+            
+                    
+                execute(driver, "CREATE (:"+lbl_entity+" {"+
+                      res[:-2] +
+                     "})"
+                     )
+
+#Snapshot Nodes
+# one Snapshot per OCEL 2.0 object attribute change, linked from its entity and
+# holding the new value under the attribute's own name; merged, so appending a
+# log again does not duplicate snapshots
+def create_snapshot_nodes(driver, ocel):
+    for field, rows in snapshot_rows(ocel).items():
+        run_batched(driver,
+            "UNWIND $rows AS row " +
+            "MATCH (o:"+lbl_entity+" {ID: row.EntityID}) " +
+            "MERGE (o)-[:"+lbl_has_snapshot+"]->(s:"+lbl_snapshot+" {EntityID: row.EntityID, attribute: $field, timestamp: datetime(row.timestamp)}) " +
+            "SET s.EntityType = o.EntityType, s.`"+field.replace('`', '``')+"` = row.value",
+            rows, field=field)
+
+#Schema
+# Uniqueness constraints back the ID lookups of the REL/CORR phases; the
+# remaining indexes serve the Activity/EntityType/timestamp predicates of rule queries
+def create_schema(driver):
+    execute(driver, "CREATE CONSTRAINT event_id IF NOT EXISTS FOR (e:"+lbl_event+") REQUIRE e.EventID IS UNIQUE", count=0)
+    execute(driver, "CREATE CONSTRAINT entity_id IF NOT EXISTS FOR (o:"+lbl_entity+") REQUIRE o.ID IS UNIQUE", count=0)
+    execute(driver, "CREATE INDEX event_activity IF NOT EXISTS FOR (e:"+lbl_event+") ON (e.Activity)", count=0)
+    execute(driver, "CREATE INDEX event_timestamp IF NOT EXISTS FOR (e:"+lbl_event+") ON (e.timestamp)", count=0)
+    execute(driver, "CREATE INDEX entity_type IF NOT EXISTS FOR (o:"+lbl_entity+") ON (o.EntityType)", count=0)
+    execute(driver, "CALL db.awaitIndexes($timeout)", count=0, timeout=index_timeout)
 
 #REL Edges
-action = lbl_meta_rel_entity_rel_entity
-start = time.time()
-
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    for idx,row in ocel.o2o.iterrows():
-        o1 = row[ocel.object_id_column]
-        o2 = row[ocel.object_id_column+'_2']
-        q  = row[ocel.qualifier]
+def create_rel_edges(driver, ocel):
+    if ingestion_mode == 'batched':
+        run_partitioned(driver,
+            "UNWIND $rows AS row " +
+            "MATCH (o1:"+lbl_entity+" {ID: row.o1}), (o2:"+lbl_entity+" {ID: row.o2}) " +
+            "MERGE (o1)-[:"+lbl_rel+" {qual: row.qual}]->(o2)",
+            rel_rows(ocel), 'o1')
+    else:
+        for idx,row in ocel.o2o.iterrows():
+            o1 = row[ocel.object_id_column]
+            o2 = row[ocel.object_id_column+'_2']
+            q  = row[ocel.qualifier]
     
-        driver.execute_query(
-            "MATCH (o1:"+lbl_entity+" {ID: '"+str(o1)+"'}), (o2:"+lbl_entity+" {ID: '"+str(o2)+"'}) MERGE (o1)-[:"+lbl_rel +" {qual:'"+str(q)+"'}]->(o2)" 
-        )
-
-end = time.time()
-print(end - start)
-meta_time[action] =  end - start
+            execute(driver,
+                "MATCH (o1:"+lbl_entity+" {ID: '"+str(o1)+"'}), (o2:"+lbl_entity+" {ID: '"+str(o2)+"'}) MERGE (o1)-[:"+lbl_rel +" {qual:'"+str(q)+"'}]->(o2)" 
+            )
 
 #CORR Edges
-action = lbl_meta_rel_event_corr_entity
-start = time.time()
-
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    for idx,row in ocel.relations.iterrows():
-        e = row[ocel.event_id_column]
-        o = row[ocel.object_id_column]
-        q  = row[ocel.qualifier]
-
-        driver.execute_query(
-            "MATCH (e:"+lbl_event+" {EventID:'" + str(e) + "'}), (o:"+lbl_entity+" {ID:'"+str(o)+"'}) " +
-            "MERGE (e)-[:"+lbl_corr+"]->(o)"
-        )
-
-end = time.time()
-print(end - start)
-meta_time[action] =  end - start
+def create_corr_edges(driver, ocel):
+    if ingestion_mode == 'batched':
+        run_partitioned(driver,
+            "UNWIND $rows AS row " +
+            "MATCH (e:"+lbl_event+" {EventID: row.e}), (o:"+lbl_entity+" {ID: row.o}) " +
+            "MERGE (e)-[:"+lbl_corr+"]->(o)",
+            corr_rows(ocel), 'o')
+    else:
+        for idx,row in ocel.relations.iterrows():
+            e = row[ocel.event_id_column]
+            o = row[ocel.object_id_column]
+            q  = row[ocel.qualifier]
+
+            execute(driver,
+                "MATCH (e:"+lbl_event+" {EventID:'" + str(e) + "'}), (o:"+lbl_entity+" {ID:'"+str(o)+"'}) " +
+                "MERGE (e)-[:"+lbl_corr+"]->(o)"
+            )
 
 #DF Edges
-action = lbl_meta_rel_event_df_event
-start = time.time()
-
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    
-    driver.execute_query(
-    "MATCH (e:"+lbl_event+")-[:"+lbl_corr+"]->(n)  " +
-    "WITH n, e order by e.timestamp  " +
-    "WITH n, collect(e) as es, range(0, size(collect(e))-2) as esn " +
-    "UNWIND esn as i  " +
-    "MATCH (a), (b)  " +
-    "WHERE a=es[i] and b=es[i+1]  " +
-    "MERGE (a)-[:"+lbl_df+" {EntityType:n.EntityType, EntityID:n.ID}]->(b) "
-    )
-
-# removing parallel dfs
-
-with GraphDatabase.driver(URI, auth=AUTH) as driver:
-    driver.execute_query(
-        "MATCH ()-[r:"+lbl_df+"]->() " +
-        "SET r.addNewKnowledge = TRUE " 
-    )
-    driver.execute_query(
-        "MATCH (n)<-[:"+lbl_corr+"]-(e1:"+lbl_event+")-[r1:"+lbl_df+" {EntityID:n.ID}]->(e2:"+lbl_event+") " +
-        "MATCH (n)<-[:"+lbl_derived+"]-(rn)<--(e1)-[r2:"+lbl_df+"  {EntityID:rn.ID}]->(e2) " +
-        "SET r2.addNewKnowledge = FALSE " 
-    )
-    driver.execute_query(
-        "MATCH ()-[rb:"+lbl_df+" {addNewKnowledge:TRUE}]->()-[r:"+lbl_df+"  {EntityID:rb.ID}]->()-[ra:"+lbl_df+"  {EntityID:r.ID, addNewKnowledge:TRUE}]->() " +
-        "SET r.addNewKnowledge=TRUE " 
-    )
-    driver.execute_query(
-        "MATCH ()-[r:"+lbl_df+" {addNewKnowledge:FALSE}]->() " +
-        "DELETE r " 
-    )
-    driver.execute_query(
-        "MATCH ()-[r:"+lbl_df+"]->() " +
-        "REMOVE  r.addNewKnowledge " 
-    )
-
-
-end = time.time()
-print(end - start)
-meta_time[action] =  end - start
-
+# computed client-side (ekg_model.df_rows) and written in batches
+def create_df_edges(driver, ocel, tails=None):
+    run_batched(driver,
+        "UNWIND $rows AS row " +
+        "MATCH (a:"+lbl_event+" {EventID: row.e1}), (b:"+lbl_event+" {EventID: row.e2}) " +
+        "CREATE (a)-[:"+lbl_df+" {EntityType: row.EntityType, EntityID: row.EntityID}]->(b)",
+        df_rows(ocel, tails=tails))
+
+#Append
+def existing_ids(driver, label, key, ids):
+    """Returns the subset of ids already present as the key property of label nodes."""
+    found = set()
+    for start in range(0, len(ids), batch_size):
+        records, _, _ = driver.execute_query(
+            "UNWIND $ids AS id MATCH (n:"+label+" {"+key+": id}) RETURN id",
+            ids=ids[start:start + batch_size])
+        found.update(r['id'] for r in records)
+    return found
+
+def restrict_to_delta(driver, ocel):
+    """Drops the events and objects of ocel that are already in the graph, along
+    with the E2O relations of known events. O2O relations are kept as REL edges
+    are merged."""
+    events = ocel.events[ocel.event_id_column].astype(str)
+    objects = ocel.objects[ocel.object_id_column].astype(str)
+    known_events = existing_ids(driver, lbl_event, 'EventID', events.unique().tolist())
+    known_objects = existing_ids(driver, lbl_entity, 'ID', objects.unique().tolist())
+
+    ocel.events = ocel.events[~events.isin(known_events)]
+    ocel.objects = ocel.objects[~objects.isin(known_objects)]
+    ocel.relations = ocel.relations[~ocel.relations[ocel.event_id_column].astype(str).isin(known_events)]
+    return ocel
+
+def entity_tails(driver, ocel):
+    """Returns the last event in the graph of every entity touched by the E2O
+    relations of ocel, i.e. its correlated event without an outgoing DF edge.
+    Must run before the new CORR edges are created."""
+    ids = ocel.relations[ocel.object_id_column].astype(str).unique().tolist()
+    tails = []
+    for start in range(0, len(ids), batch_size):
+        records, _, _ = driver.execute_query(
+            "UNWIND $ids AS id " +
+            "MATCH (n:"+lbl_entity+" {ID: id})<-[:"+lbl_corr+"]-(e:"+lbl_event+") " +
+            "WHERE NOT (e)-[:"+lbl_df+" {EntityID: id}]->() " +
+            "RETURN e.EventID AS e1, n.EntityType AS EntityType, n.ID AS EntityID",
+            ids=ids[start:start + batch_size])
+        tails.extend(r.data() for r in records)
+    return pd.DataFrame(tails, columns=['e1', 'EntityType', 'EntityID'])
+
+
+#DF Edges (streaming)
+# without the full relations table at hand, the DF edges are derived in the
+# database, one entity per row and batch_size entities per transaction
+def create_df_edges_in_db(driver):
+    with driver.session() as session:
+        summary = session.run(
+            "MATCH (n:"+lbl_entity+") " +
+            "CALL { WITH n " +
+            "  MATCH (e:"+lbl_event+")-[:"+lbl_corr+"]->(n) " +
+            "  WITH n, e ORDER BY e.timestamp " +
+            "  WITH n, collect(e) AS es " +
+            "  UNWIND range(0, size(es)-2) AS i " +
+            "  WITH n, es[i] AS a, es[i+1] AS b " +
+            "  CREATE (a)-[:"+lbl_df+" {EntityType: n.EntityType, EntityID: n.ID}]->(b) " +
+            "} IN TRANSACTIONS OF $batch_size ROWS",
+            batch_size=batch_size).consume()
+    metrics.record(summary.counters.relationships_created, summary)
+
+def stream_stage(stage, driver, chunks):
+    """Runs a loading stage on each OCEL chunk of a streaming reader."""
+    for chunk in chunks:
+        stage(driver, chunk)
+
+
+if __name__ == "__main__":
+    if streaming and ingestion_mode == 'bulk_import':
+        raise ValueError("streaming = True is not supported with ingestion_mode = 'bulk_import'; "
+                         "set streaming = False to export the bulk-import files")
+    if append and ingestion_mode == 'bulk_import':
+        raise ValueError("append = True is not supported with ingestion_mode = 'bulk_import'; "
+                         "neo4j-admin import builds a new database, so append needs a transactional mode")
+    if append and streaming:
+        raise ValueError("append = True is not supported with streaming = True, which wipes the graph before loading")
+    if streaming:
+        with GraphDatabase.driver(URI, auth=AUTH) as driver:
+            driver.verify_connectivity()
+            driver.execute_query('MATCH (a) DETACH DELETE a')
+
+            object_types = timed(lbl_meta_read, read_object_types, file_path)
+            timed(lbl_meta_node_event, stream_stage, create_event_nodes, driver,
+                  read_events(file_path, stream_chunk_size, object_types))
+            timed(lbl_meta_node_entity, stream_stage, create_entity_nodes, driver,
+                  read_objects(file_path, stream_chunk_size))
+            timed(lbl_meta_schema, create_schema, driver)
+            timed(lbl_meta_rel_entity_rel_entity, stream_stage, create_rel_edges, driver,
+                  read_objects(file_path, stream_chunk_size))
+            timed(lbl_meta_rel_event_corr_entity, stream_stage, create_corr_edges, driver,
+                  read_events(file_path, stream_chunk_size, object_types))
+            timed(lbl_meta_rel_event_df_event, create_df_edges_in_db, driver)
+    elif append:
+        ocel = timed(lbl_meta_read, read_ocel, file_path)
+        with GraphDatabase.driver(URI, auth=AUTH) as driver:
+            driver.verify_connectivity()
+
+            ocel = restrict_to_delta(driver, ocel)
+            tails = entity_tails(driver, ocel)
+            timed(lbl_meta_node_event, create_event_nodes, driver, ocel)
+            timed(lbl_meta_node_entity, create_entity_nodes, driver, ocel)
+            timed(lbl_meta_schema, create_schema, driver)
+            timed(lbl_meta_node_snapshot, create_snapshot_nodes, driver, ocel)
+            timed(lbl_meta_rel_entity_rel_entity, create_rel_edges, driver, ocel)
+            timed(lbl_meta_rel_event_corr_entity, create_corr_edges, driver, ocel)
+            timed(lbl_meta_rel_event_df_event, create_df_edges, driver, ocel, tails)
+    elif ingestion_mode == 'bulk_import':
+        ocel = timed(lbl_meta_read, read_ocel, file_path)
+        args = timed(lbl_meta_export, export_bulk_import, ocel, export_dir, batch_size)
+        print("neo4j-admin database import full neo4j " + " ".join(args))
+    else:
+        ocel = timed(lbl_meta_read, read_ocel, file_path)
+        with GraphDatabase.driver(URI, auth=AUTH) as driver:
+            driver.verify_connectivity()
+            driver.execute_query('MATCH (a) DETACH DELETE a')
+
+            timed(lbl_meta_node_event, create_event_nodes, driver, ocel)
+            timed(lbl_meta_node_entity, create_entity_nodes, driver, ocel)
+            timed(lbl_meta_schema, create_schema, driver)
+            timed(lbl_meta_node_snapshot, create_snapshot_nodes, driver, ocel)
+            timed(lbl_meta_rel_entity_rel_entity, create_rel_edges, driver, ocel)
+            timed(lbl_meta_rel_event_corr_entity, create_corr_edges, driver, ocel)
+            timed(lbl_meta_rel_event_df_event, create_df_edges, driver, ocel)
+
+    metrics.write(metrics_path, experiment=experiment_name, file=file_path,
+                  file_bytes=os.path.getsize(file_path), ingestion_mode=ingestion_mode,
+                  streaming=streaming, append=append, batch_size=batch_size,
+                  edge_workers=edge_workers)